@@ -0,0 +1,78 @@
+"""
+Microbenchmark: memoized rendering.render_board vs the old per-square loop.
+
+    python benchmarks/bench_board_render.py
+"""
+
+import os
+import random
+import sys
+import timeit
+
+import chess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chess_game.rendering import PIECE_SYMBOLS, _render, render_board  # noqa: E402
+
+
+def legacy_board_to_dict(chess_board, is_black_player):
+    # the loop views.board_to_dict used before the rendering module
+    board_dict = {}
+    for row in range(8):
+        for col in range(8):
+            square = chess.square(col, 7 - row) if not is_black_player else chess.square(7 - col, row)
+            piece = chess_board.piece_at(square)
+            if is_black_player:
+                square_name = f"{chr(ord('h') - col)}{row + 1}"
+            else:
+                square_name = f"{chr(ord('a') + col)}{8 - row}"
+            board_dict[square_name] = PIECE_SYMBOLS.get(piece.symbol(), '') if piece else '&nbsp;'
+    return board_dict
+
+
+def sample_positions(count, seed=7):
+    rng = random.Random(seed)
+    board = chess.Board()
+    positions = []
+    while len(positions) < count:
+        moves = list(board.legal_moves)
+        if not moves or board.ply() > 120:
+            board.reset()
+            continue
+        board.push(rng.choice(moves))
+        positions.append(board.copy(stack=False))
+    return positions
+
+
+def main(number=20):
+    positions = sample_positions(200)
+    for board in positions:
+        for flipped in (False, True):
+            assert render_board(board, flipped) == legacy_board_to_dict(board, flipped)
+
+    def run_legacy():
+        for board in positions:
+            legacy_board_to_dict(board, False)
+            legacy_board_to_dict(board, True)
+
+    def run_cached():
+        for board in positions:
+            render_board(board, False)
+            render_board(board, True)
+
+    def run_cold():
+        _render.cache_clear()
+        run_cached()
+
+    renders = len(positions) * 2 * number
+    legacy = timeit.timeit(run_legacy, number=number)
+    cold = timeit.timeit(run_cold, number=number)
+    cached = timeit.timeit(run_cached, number=number)
+    print(f'legacy board_to_dict: {legacy / renders * 1e6:8.2f} us/render')
+    print(f'render_board (cold):  {cold / renders * 1e6:8.2f} us/render  ({legacy / cold:.1f}x)')
+    print(f'render_board (memo):  {cached / renders * 1e6:8.2f} us/render  ({legacy / cached:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
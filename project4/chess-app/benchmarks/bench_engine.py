@@ -0,0 +1,92 @@
+"""
+Benchmark: computer-opponent throughput with concurrent solo games.
+
+Each simulated game asks engine.analyse for a move, plays it, then plays a
+random reply for the guest, all games at once on one event loop. Reports
+engine moves per second, aggregate nodes per second, average depth and how
+late a 10 ms event-loop ticker ran (searches must not stall the loop).
+
+    python benchmarks/bench_engine.py --games 8 --moves 4 --workers 4
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+import chess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chess_project.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+
+from chess_game import engine  # noqa: E402
+
+
+async def play(seed, moves, time_limit, results):
+    rng = random.Random(seed)
+    board = chess.Board()
+    for _ in range(moves):
+        if board.is_game_over():
+            break
+        result = await engine.analyse(board.fen(), time_limit)
+        board.push_uci(result['move'])
+        results.append(result)
+        if board.is_game_over():
+            break
+        board.push(rng.choice(list(board.legal_moves)))
+
+
+async def ticker(stop, lags):
+    while not stop.is_set():
+        started = time.monotonic()
+        await asyncio.sleep(0.01)
+        lags.append(time.monotonic() - started - 0.01)
+
+
+async def run(games, moves, time_limit):
+    results, lags = [], []
+    stop = asyncio.Event()
+    tick = asyncio.create_task(ticker(stop, lags))
+    started = time.monotonic()
+    await asyncio.gather(*(play(seed, moves, time_limit, results) for seed in range(games)))
+    elapsed = time.monotonic() - started
+    stop.set()
+    await tick
+    return results, lags, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--games', type=int, default=8)
+    parser.add_argument('--moves', type=int, default=4, help='Engine moves per game')
+    parser.add_argument('--time-limit', type=float, default=0.25, help='Seconds per engine move')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Engine processes (0 = thread)')
+    options = parser.parse_args()
+
+    settings.ENGINE_WORKERS = options.workers
+    if engine.get_pool() is not None:
+        # start the workers before timing
+        engine.get_pool().submit(engine.search, chess.STARTING_FEN, 0.01).result()
+
+    results, lags, elapsed = asyncio.run(run(options.games, options.moves, options.time_limit))
+    engine.shutdown_pool()
+
+    nodes = sum(result['nodes'] for result in results)
+    lags.sort()
+    print(f'{options.games} games x {options.moves} moves, {options.workers} workers, {options.time_limit}s/move')
+    print(f'engine moves/s:     {len(results) / elapsed:8.2f}')
+    print(f'nodes/s (all):      {nodes / elapsed:8.0f}')
+    print(f'average depth:      {sum(result["depth"] for result in results) / max(len(results), 1):8.2f}')
+    print(f'loop lag p50 / max: {lags[len(lags) // 2] * 1000:6.1f} / {lags[-1] * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,419 @@
+"""
+End-to-end load test: HTTP moves and websocket fan-out against a live server.
+
+Starts Daphne on a throwaway database (or targets --url), registers
+2 x games users, pairs them through the challenge API and plays scripted
+lines with every player connected to /ws/game/<id>/ (and /ws/lobby/ when
+the scenario asks). Each move is timed from the moment the mover sends it
+(HTTP make_move or a socket "move" action) until the opponent's socket
+receives the game_move event for that ply.
+
+    python benchmarks/loadtest.py benchmarks/scenarios/ws_moves.json
+    python benchmarks/loadtest.py benchmarks/scenarios/http_moves.json --json result.json
+
+Scenario files are JSON:
+
+    name            label printed with the report
+    seed            seeds line choice, think times and mixed transports
+    games           concurrent games (two users each)
+    transport       "http", "ws" or "mixed" (a coin flip per move)
+    lobby_sockets   also hold a /ws/lobby/ socket per user
+    think_time_ms   [min, max] pause before each move
+    move_timeout_s  seconds to wait for the opponent's notification
+    lines           move sequences in UCI, one picked per game
+
+Only the standard library is used, including the small HTTP and websocket
+clients below, so the harness runs wherever the app does.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import urlsplit
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'Load-test-pass-9137'
+
+
+class HTTPClient:
+    """One user's cookie jar; every request opens a connection (Connection: close)"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.cookies = {}
+
+    def cookie_header(self):
+        return '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+
+    async def request(self, method, path, data=None):
+        body = json.dumps(data).encode() if data is not None else b''
+        headers = [
+            f'{method} {path} HTTP/1.1',
+            f'Host: {self.host}:{self.port}',
+            'Connection: close',
+            'Accept: application/json',
+            f'Content-Length: {len(body)}',
+        ]
+        if data is not None:
+            headers.append('Content-Type: application/json')
+        if self.cookies:
+            headers.append(f'Cookie: {self.cookie_header()}')
+        if 'csrftoken' in self.cookies:
+            headers.append(f'X-CSRFToken: {self.cookies["csrftoken"]}')
+
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode() + body)
+            await writer.drain()
+            head = await reader.readuntil(b'\r\n\r\n')
+            payload = await reader.read()
+        finally:
+            writer.close()
+
+        lines = head.decode('latin-1').split('\r\n')
+        status = int(lines[0].split()[1])
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            if name.lower() == 'set-cookie':
+                for morsel in SimpleCookie(value.strip()).values():
+                    self.cookies[morsel.key] = morsel.value
+        try:
+            return status, json.loads(payload) if payload else None
+        except ValueError:
+            return status, None
+
+
+class WebSocket:
+    """Minimal RFC 6455 client: text frames, masked sends, ping replies"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host, port, path, cookie):
+        reader, writer = await asyncio.open_connection(host, port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write((
+            f'GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\n'
+            f'Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n'
+            f'Cookie: {cookie}\r\n\r\n'
+        ).encode())
+        head = await reader.readuntil(b'\r\n\r\n')
+        if b' 101 ' not in head.split(b'\r\n', 1)[0]:
+            writer.close()
+            raise ConnectionError(f'websocket upgrade refused for {path}')
+        return cls(reader, writer)
+
+    def _send_frame(self, opcode, payload):
+        mask = os.urandom(4)
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, 0x80 | length)
+        elif length < 1 << 16:
+            header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 0x80 | 127, length)
+        # XOR the payload with the repeated mask in one big-integer operation
+        repeated = (mask * (length // 4 + 1))[:length]
+        masked = (int.from_bytes(payload, 'big') ^ int.from_bytes(repeated, 'big')).to_bytes(length, 'big')
+        self.writer.write(header + mask + masked)
+
+    async def send_json(self, data):
+        self._send_frame(0x1, json.dumps(data).encode())
+        await self.writer.drain()
+
+    async def recv_json(self):
+        """Next text message as JSON, None once the server closes"""
+        message = b''
+        while True:
+            first, second = await self.reader.readexactly(2)
+            opcode, length = first & 0x0f, second & 0x7f
+            if length == 126:
+                length = struct.unpack('!H', await self.reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', await self.reader.readexactly(8))[0]
+            payload = await self.reader.readexactly(length)
+            if opcode == 0x8:
+                return None
+            if opcode == 0x9:
+                self._send_frame(0xA, payload)
+                continue
+            if opcode in (0x1, 0x2, 0x0):
+                message += payload
+                if first & 0x80:
+                    return json.loads(message)
+
+    async def close(self):
+        try:
+            self._send_frame(0x8, struct.pack('!H', 1000))
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        self.writer.close()
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = {}
+        self.moves = 0
+        self.lobby_messages = 0
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def percentile(self, fraction):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Player:
+    def __init__(self, host, port, username):
+        self.username = username
+        self.http = HTTPClient(host, port)
+        self.host, self.port = host, port
+        self.id = None
+        self.game_socket = None
+        self.lobby_socket = None
+        # ply -> event set when this player's socket hears about it
+        self.seen = {}
+        self.last_ply = 0
+
+    async def register(self):
+        status, data = await self.http.request('POST', '/api/auth/register/', {
+            'username': self.username, 'password1': PASSWORD, 'password2': PASSWORD,
+        })
+        if status != 201:
+            raise RuntimeError(f'registering {self.username} failed: {status} {data}')
+        self.id = data['user']['id']
+
+    def waiter(self, ply):
+        return self.seen.setdefault(ply, asyncio.Event())
+
+    def heard(self, ply):
+        # a refresh can cover several plies at once
+        for number in range(self.last_ply + 1, ply + 1):
+            self.waiter(number).set()
+        self.last_ply = max(self.last_ply, ply)
+
+    async def listen_game(self, stats):
+        while True:
+            message = await self.game_socket.recv_json()
+            if message is None:
+                return
+            action = message.get('action')
+            if action == 'game_move':
+                self.heard(message['data']['ply'])
+            elif action == 'game_refresh':
+                self.heard(message['data']['game']['move_count'])
+            elif action == 'move_rejected':
+                stats.error('move_rejected')
+
+    async def listen_lobby(self, stats):
+        while await self.lobby_socket.recv_json() is not None:
+            stats.lobby_messages += 1
+
+
+async def pair(white, black):
+    status, data = await white.http.request('POST', '/api/challenges/', {'challenged_id': black.id})
+    if status != 201:
+        raise RuntimeError(f'challenge failed: {status} {data}')
+    challenge_id = data['challenge']['id']
+    status, data = await black.http.request('POST', f'/api/challenges/{challenge_id}/accept/', {})
+    if status != 200:
+        raise RuntimeError(f'accept failed: {status} {data}')
+    game = data['game']
+    # the challenger plays white
+    if game['white_player']['id'] != white.id:
+        white, black = black, white
+    return game['id'], white, black
+
+
+async def play(game_id, white, black, line, scenario, rng, stats):
+    think_min, think_max = scenario.get('think_time_ms', [0, 0])
+    timeout = scenario.get('move_timeout_s', 10)
+    transport = scenario.get('transport', 'ws')
+    for ply, uci in enumerate(line.split(), start=1):
+        mover, opponent = (white, black) if ply % 2 else (black, white)
+        await asyncio.sleep(rng.uniform(think_min, think_max) / 1000)
+        heard = opponent.waiter(ply)
+        use_ws = transport == 'ws' or transport == 'mixed' and rng.random() < 0.5
+
+        started = time.perf_counter()
+        if use_ws:
+            await mover.game_socket.send_json({
+                'action': 'move', 'id': ply, 'from_square': uci[:2], 'to_square': uci[2:4], 'promotion': uci[4:] or None,
+            })
+        else:
+            status, _ = await mover.http.request('POST', f'/api/games/{game_id}/make_move/', {
+                'from_square': uci[:2], 'to_square': uci[2:4], 'promotion': uci[4:] or None,
+            })
+            if status != 200:
+                stats.error(f'http_{status}')
+                return
+        try:
+            await asyncio.wait_for(heard.wait(), timeout)
+        except asyncio.TimeoutError:
+            stats.error('notification_timeout')
+            return
+        stats.latencies.append(time.perf_counter() - started)
+        stats.moves += 1
+
+
+async def run(scenario, host, port):
+    rng = random.Random(scenario.get('seed', 0))
+    stats = Stats()
+    tag = f'{int(time.time())}{os.getpid()}'
+    players = [Player(host, port, f'load{tag}u{i}') for i in range(2 * scenario['games'])]
+
+    started = time.perf_counter()
+    for player in players:
+        await player.register()
+    games = [await pair(players[i], players[i + 1]) for i in range(0, len(players), 2)]
+    setup_time = time.perf_counter() - started
+
+    listeners = []
+    for game_id, white, black in games:
+        for player in (white, black):
+            player.game_socket = await WebSocket.connect(host, port, f'/ws/game/{game_id}/', player.http.cookie_header())
+            listeners.append(asyncio.create_task(player.listen_game(stats)))
+            if scenario.get('lobby_sockets'):
+                player.lobby_socket = await WebSocket.connect(host, port, '/ws/lobby/', player.http.cookie_header())
+                listeners.append(asyncio.create_task(player.listen_lobby(stats)))
+
+    lines = scenario['lines']
+    plans = [(game, rng.choice(lines), random.Random(rng.random())) for game in games]
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        play(game_id, white, black, line, scenario, game_rng, stats)
+        for (game_id, white, black), line, game_rng in plans
+    ))
+    elapsed = time.perf_counter() - started
+
+    for player in players:
+        for sock in (player.game_socket, player.lobby_socket):
+            if sock is not None:
+                await sock.close()
+    for task in listeners:
+        task.cancel()
+    await asyncio.gather(*listeners, return_exceptions=True)
+    return stats, elapsed, setup_time
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workdir):
+    """Daphne on a fresh database, presence and channel layer under workdir"""
+    env = {
+        **os.environ,
+        'DJANGO_SETTINGS_MODULE': 'chess_project.settings',
+        'DATABASE_PATH': os.path.join(workdir, 'db.sqlite3'),
+        'PRESENCE_DB_PATH': os.path.join(workdir, 'presence.sqlite3'),
+        'CHANNEL_LAYER_DB_PATH': os.path.join(workdir, 'channels.sqlite3'),
+        'DEBUG': 'False',
+    }
+    subprocess.run(
+        [sys.executable, 'manage.py', 'migrate', '--noinput', '-v', '0'], cwd=APP_DIR, env=env, check=True
+    )
+    port = free_port()
+    # a file rather than a pipe, so a chatty server never blocks on a full buffer
+    log = open(os.path.join(workdir, 'daphne.log'), 'w+')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'daphne', '-b', '127.0.0.1', '-p', str(port), 'chess_project.asgi:application'],
+        cwd=APP_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            log.seek(0)
+            raise RuntimeError(f'daphne exited: {log.read()}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return server, port
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError('daphne did not start within 30s')
+
+
+def report(scenario, stats, elapsed, setup_time):
+    def ms(value):
+        return f'{value * 1000:.1f} ms' if value is not None else 'n/a'
+
+    attempted = stats.moves + sum(stats.errors.values())
+    result = {
+        'scenario': scenario.get('name', 'unnamed'),
+        'games': scenario['games'],
+        'transport': scenario.get('transport', 'ws'),
+        'moves': stats.moves,
+        'moves_per_second': round(stats.moves / elapsed, 2) if elapsed else 0,
+        'latency_p50_ms': round(stats.percentile(0.50) * 1000, 2) if stats.latencies else None,
+        'latency_p95_ms': round(stats.percentile(0.95) * 1000, 2) if stats.latencies else None,
+        'latency_p99_ms': round(stats.percentile(0.99) * 1000, 2) if stats.latencies else None,
+        'error_rate': round(sum(stats.errors.values()) / attempted, 4) if attempted else 0,
+        'errors': stats.errors,
+        'lobby_messages': stats.lobby_messages,
+        'setup_seconds': round(setup_time, 2),
+    }
+    print(f"scenario {result['scenario']}: {result['games']} games over {result['transport']}, setup {setup_time:.1f}s")
+    print(f'moves:            {stats.moves} in {elapsed:.2f}s ({result["moves_per_second"]} moves/s)')
+    print(f'notify latency:   p50 {ms(stats.percentile(0.50))}  p95 {ms(stats.percentile(0.95))}  '
+          f'p99 {ms(stats.percentile(0.99))}')
+    print(f'errors:           {result["error_rate"] * 100:.2f}% {stats.errors or ""}')
+    if scenario.get('lobby_sockets'):
+        print(f'lobby messages:   {stats.lobby_messages}')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('scenario', help='Scenario JSON file')
+    parser.add_argument('--url', help='Target a running server (e.g. http://127.0.0.1:8000) instead of starting one')
+    parser.add_argument('--json', help='Also write the results to this file')
+    options = parser.parse_args()
+
+    with open(options.scenario) as scenario_file:
+        scenario = json.load(scenario_file)
+
+    server = None
+    workdir = tempfile.TemporaryDirectory(prefix='chess-loadtest-')
+    try:
+        if options.url:
+            target = urlsplit(options.url)
+            host, port = target.hostname, target.port or 80
+        else:
+            server, port = start_server(workdir.name)
+            host = '127.0.0.1'
+        stats, elapsed, setup_time = asyncio.run(run(scenario, host, port))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+        workdir.cleanup()
+
+    result = report(scenario, stats, elapsed, setup_time)
+    if options.json:
+        with open(options.json, 'w') as out:
+            json.dump(result, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""
+Microbenchmarks for the hot helpers, serializers and the make_move path,
+checked against stored baselines.
+
+Runs on a throwaway SQLite database (plus presence store and channel layer)
+seeded with users, online presence and games, then times each case as the
+best of several repeats. A case fails when it is slower than its baseline
+by more than --threshold (default 30%); the exit status is then 1.
+
+    python benchmarks/microbench.py               # compare with baselines.json
+    python benchmarks/microbench.py --update      # record new baselines
+    python benchmarks/microbench.py -k serializer # only matching cases
+
+Baselines are per machine: record them on the machine that runs the check.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES = os.path.join(APP_DIR, 'benchmarks', 'baselines.json')
+
+sys.path.insert(0, APP_DIR)
+WORKDIR = tempfile.TemporaryDirectory(prefix='chess-microbench-')
+os.environ.update({
+    'DJANGO_SETTINGS_MODULE': 'chess_project.settings',
+    'DATABASE_PATH': os.path.join(WORKDIR.name, 'db.sqlite3'),
+    'PRESENCE_DB_PATH': os.path.join(WORKDIR.name, 'presence.sqlite3'),
+    'CHANNEL_LAYER_DB_PATH': os.path.join(WORKDIR.name, 'channels.sqlite3'),
+    'BROADCAST_COALESCE_WINDOW': '0',
+})
+
+import chess  # noqa: E402
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.test import Client  # noqa: E402
+
+from chess_game.consumers import LobbyConsumer  # noqa: E402
+from chess_game.models import Game  # noqa: E402
+from chess_game.packing import pack_moves  # noqa: E402
+from chess_game.presence import get_presence  # noqa: E402
+from chess_game.rendering import _render  # noqa: E402
+from chess_game.serializers import GameSerializer  # noqa: E402
+from chess_game.views import board_to_dict, get_logged_in_users_excluding_current  # noqa: E402
+
+USER_COUNTS = (10, 100, 1000)
+GAME_LENGTHS = (10, 100, 300)
+
+
+class MockRequest:
+    def __init__(self, user):
+        self.user = user
+
+
+def measure(func, number, repeat=5):
+    """Best seconds per call over repeat runs of number calls"""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def random_game(plies, rng):
+    # a random legal line that is still going after plies moves
+    while True:
+        board = chess.Board()
+        for _ in range(plies):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            board.push(rng.choice(moves))
+        if board.ply() == plies and not board.is_game_over():
+            return board
+
+
+def seed():
+    call_command('migrate', verbosity=0)
+    rng = random.Random(7)
+    users = User.objects.bulk_create([User(username=f'bench{i}') for i in range(max(USER_COUNTS) + 2)])
+    # a finished game for every tenth user, so lobby history is not empty
+    for white, black in zip(users[:max(USER_COUNTS):20], users[10:max(USER_COUNTS):20]):
+        board = random_game(20, rng)
+        Game.objects.create(
+            white_player=white, black_player=black, status='completed', outcome='draw',
+            board_state=board.fen(), move_count=20, packed_moves=pack_moves(board.move_stack),
+        )
+    return users, rng
+
+
+def bench_render(users, rng):
+    boards = [random_game(rng.randrange(1, 80), rng) for _ in range(100)]
+    game = Game(white_player=users[0], black_player=users[1])
+
+    def run():
+        for board in boards:
+            board_to_dict(board, users[0], game)
+            board_to_dict(board, users[1], game)
+
+    def cold():
+        _render.cache_clear()
+        run()
+
+    yield 'board_to_dict_memo', run, 20, 2 * len(boards)
+    yield 'board_to_dict_cold', cold, 5, 2 * len(boards)
+
+
+def bench_serializer(users, rng):
+    for plies in GAME_LENGTHS:
+        board = random_game(plies, rng)
+        game = Game.objects.create(
+            white_player=users[-2], black_player=users[-1], status='completed', outcome='draw',
+            board_state=board.fen(), move_count=plies, packed_moves=pack_moves(board.move_stack),
+        )
+        game = Game.objects.select_related('white_player', 'black_player', 'winner').get(pk=game.pk)
+        yield f'game_serializer_{plies}_plies', lambda: GameSerializer(game).data, 20, 1
+
+
+def bench_presence(users, rng):
+    presence = get_presence()
+    consumer = LobbyConsumer()
+    # the undecorated method, so the thread hop of database_sync_to_async is not timed
+    lobby_data = LobbyConsumer.__dict__['_get_lobby_data'].func
+    for count in USER_COUNTS:
+        presence.clear()
+        for user in users[:count]:
+            presence.add(user.id, f'bench.{user.id}')
+        request = MockRequest(users[0])
+        yield f'logged_in_users_{count}_online', lambda: list(get_logged_in_users_excluding_current(request)), 20, 1
+        yield f'lobby_data_{count}_online', lambda: lobby_data(consumer, users[0]), 10, 1
+    presence.clear()
+
+
+def bench_make_move(users, rng):
+    white, black = users[-2], users[-1]
+    game = Game.objects.create(white_player=white, black_player=black)
+    clients = {}
+    for user in (white, black):
+        clients[user.id] = Client()
+        clients[user.id].force_login(user)
+    # knights out and back: the game never ends and the board keeps changing
+    cycle = [('g1', 'f3', white), ('g8', 'f6', black), ('f3', 'g1', white), ('f6', 'g8', black)]
+    url = f'/api/games/{game.id}/make_move/'
+    state = {'ply': 0}
+
+    def move():
+        from_square, to_square, user = cycle[state['ply'] % 4]
+        response = clients[user.id].post(url, {'from_square': from_square, 'to_square': to_square})
+        assert response.status_code == 200, response.content
+        state['ply'] += 1
+
+    yield 'make_move_request', move, 20, 1
+
+
+# each case sets up its data and yields (name, function, number, calls per run),
+# so main only times the cases it was asked for
+CASES = [bench_render, bench_serializer, bench_presence, bench_make_move]
+
+
+def compare(results, baselines, threshold):
+    failed = []
+    print(f'{"case":34} {"current":>12} {"baseline":>12} {"ratio":>7}')
+    for name, seconds in results.items():
+        baseline = baselines.get(name)
+        if baseline:
+            ratio = seconds / baseline
+            verdict = 'REGRESSED' if ratio > 1 + threshold else ''
+            if verdict:
+                failed.append(name)
+            print(f'{name:34} {seconds * 1e6:10.1f}us {baseline * 1e6:10.1f}us {ratio:6.2f}x {verdict}')
+        else:
+            print(f'{name:34} {seconds * 1e6:10.1f}us {"(none)":>12}')
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--update', action='store_true', help='Store the results as the new baselines')
+    parser.add_argument('--threshold', type=float, default=0.3, help='Allowed slowdown (0.3 = 30%%)')
+    parser.add_argument('-k', dest='keyword', help='Only time cases whose name contains this')
+    options = parser.parse_args()
+
+    users, rng = seed()
+    results = {}
+    for case in CASES:
+        for name, func, number, calls in case(users, rng):
+            if not options.keyword or options.keyword in name:
+                results[name] = measure(func, number) / calls
+
+    baselines = {}
+    if os.path.exists(BASELINES):
+        with open(BASELINES) as baseline_file:
+            baselines = json.load(baseline_file)
+
+    if options.update:
+        baselines.update({name: float(f'{seconds:.4g}') for name, seconds in results.items()})
+        with open(BASELINES, 'w') as baseline_file:
+            json.dump(dict(sorted(baselines.items())), baseline_file, indent=2)
+            baseline_file.write('\n')
+        print(f'Stored {len(results)} baselines in {os.path.relpath(BASELINES, APP_DIR)}')
+        return
+
+    failed = compare(results, baselines, options.threshold)
+    if failed:
+        print(f'{len(failed)} case(s) slower than baseline by more than {options.threshold:.0%}: {", ".join(failed)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Post-game analysis backed by a site-wide evaluation cache.
+
+Every position of a game is looked up in PositionEvaluation by its Zobrist
+hash and an evaluation at the requested depth or deeper is reused, so
+common positions (openings above all) are searched once for the whole
+database. Misses are evaluated together on the engine pool and stored.
+When the table outgrows EVALUATION_CACHE_SIZE the least recently used rows
+are deleted down to 90% of it, so eviction runs in batches rather than on
+every stored game.
+"""
+
+import chess
+from django.conf import settings
+from django.utils import timezone
+
+from .models import PositionEvaluation
+from .packing import unpack_moves
+from .positions import position_key
+
+
+def game_positions(game):
+    """(zobrist key, FEN) of every ply of game, ply 0 included"""
+    board = chess.Board()
+    positions = [(position_key(board), board.fen())]
+    for move in unpack_moves(game.packed_moves):
+        board.push(move)
+        positions.append((position_key(board), board.fen()))
+    return positions
+
+
+def cached_evaluations(keys, depth):
+    """{zobrist: (score, best_move)} for keys stored at depth or deeper, marked as used"""
+    found, ids = {}, []
+    rows = (
+        PositionEvaluation.objects.filter(zobrist__in=set(keys), depth__gte=depth)
+        .order_by('depth')
+        .values_list('id', 'zobrist', 'score', 'best_move')
+    )
+    # ascending depth, so the deepest evaluation of a position wins
+    for row_id, zobrist, score, best_move in rows:
+        found[zobrist] = (score, best_move)
+        ids.append(row_id)
+    if ids:
+        PositionEvaluation.objects.filter(id__in=ids).update(last_used=timezone.now())
+    return found
+
+
+def store_evaluations(evaluations, depth):
+    """Save {zobrist: (score, best_move)} at depth, then evict if over capacity"""
+    PositionEvaluation.objects.bulk_create([
+        PositionEvaluation(zobrist=zobrist, depth=depth, score=score, best_move=best_move or '')
+        for zobrist, (score, best_move) in evaluations.items()
+    ], ignore_conflicts=True)
+    evict()
+
+
+def evict(capacity=None):
+    """Delete least recently used evaluations once there are more than capacity"""
+    capacity = capacity if capacity is not None else getattr(settings, 'EVALUATION_CACHE_SIZE', 200000)
+    count = PositionEvaluation.objects.count()
+    if count <= capacity:
+        return 0
+    excess = count - int(capacity * 0.9)
+    oldest = PositionEvaluation.objects.order_by('last_used', 'id').values('id')[:excess]
+    deleted, _ = PositionEvaluation.objects.filter(id__in=oldest).delete()
+    return deleted
@@ -1,4 +1,4 @@
-from django.urls import path, include
+from django.urls import path, re_path, include
 from rest_framework.routers import DefaultRouter
 from . import api_views
 
@@ -15,6 +15,9 @@ urlpatterns = [
     path('players/available/', api_views.api_available_players, name='api-available-players'),
     path('games/history/', api_views.api_game_history, name='api-game-history'),
     path('solo/', api_views.api_solo_play, name='api-solo-play'),
+    path('solo/engine/', api_views.api_solo_engine, name='api-solo-engine'),
+    path('games/<int:pk>/analyze/', api_views.api_game_analyze, name='api-game-analyze'),
+    re_path(r'^positions/(?P<fen>.+)/games/?$', api_views.api_position_games, name='api-position-games'),
     
     path('', include(router.urls)),
 ]
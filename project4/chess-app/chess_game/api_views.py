@@ -1,25 +1,40 @@
 from rest_framework import viewsets, status
-from rest_framework.decorators import api_view, permission_classes, action
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, action
+from rest_framework.exceptions import NotFound
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from django.contrib.auth import authenticate, login, logout
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.contrib.sessions.models import Session
 from django.db import models
 from django.db.models import Q
-from django.utils.timezone import now
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from asgiref.sync import sync_to_async
 import chess
+import json
 
-from .models import Game, GameChallenge, Move
+from .analysis import cached_evaluations, game_positions, store_evaluations
+from .engine import analyse, evaluate_many
+from .models import Game, GameChallenge, PositionIndex
+from .packing import unpack_moves
+from .pagination import GameKeysetPagination
+from .pgn import aiter_pgn, iter_pgn
+from .positions import position_key
+from .solo import InvalidToken, board_from_token, make_token
 from .serializers import (
     UserSerializer, GameSerializer, GameChallengeSerializer,
-    MoveSerializer, BoardStateSerializer
+    MoveSerializer, BoardStateSerializer,
+    GameSummarySerializer, GameSummaryWithMovesSerializer
 )
-from .views import (
-    get_logged_in_users_excluding_current, get_active_game,
-    board_to_dict, broadcast_lobby_reload, broadcast_game_reload
+from .rendering import board_checksum, board_state, is_legal, render_board
+from .replay import all_positions, board_at_ply
+from .services import (
+    MoveResult, apply_move, broadcast_game_reload, broadcast_lobby_reload, get_available_players,
+    parse_ply, pieces_at_ply, record_resignation, wants_legal_moves
 )
+from .views import get_active_game, start_game
 
 
 @api_view(['POST'])
@@ -102,6 +117,20 @@ def api_current_user(request):
     })
 
 
+def paginated_games(request, games):
+    # one page of game summaries, ?include=moves adds the moves from the packed columns
+    games = games.select_related('white_player', 'black_player', 'winner')
+    if 'moves' in request.query_params.get('include', '').split(','):
+        serializer_class = GameSummaryWithMovesSerializer
+    else:
+        games = games.defer('board_state', 'packed_moves', 'packed_times')
+        serializer_class = GameSummarySerializer
+
+    paginator = GameKeysetPagination()
+    page = paginator.paginate_queryset(games, request)
+    return paginator.get_paginated_response(serializer_class(page, many=True).data)
+
+
 class GameViewSet(viewsets.ModelViewSet):
     # viewset for game operations
     serializer_class = GameSerializer
@@ -115,10 +144,8 @@ class GameViewSet(viewsets.ModelViewSet):
         ).order_by('-updated_at')
     
     def list(self, request):
-        # list user's games
-        games = self.get_queryset()
-        serializer = self.get_serializer(games, many=True)
-        return Response(serializer.data)
+        # list user's games, newest first, a page at a time
+        return paginated_games(request, self.get_queryset())
     
     def retrieve(self, request, pk=None):
         # get a specific game
@@ -135,76 +162,40 @@ class GameViewSet(viewsets.ModelViewSet):
             return Response(serializer.data)
         return Response({'detail': 'No active game'}, status=status.HTTP_404_NOT_FOUND)
     
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        # stream the user's finished games as PGN; ASGI buffers sync iterators, so it gets an async one
+        games = self.get_queryset()
+        content = aiter_pgn(games) if isinstance(request._request, ASGIRequest) else iter_pgn(games)
+        response = StreamingHttpResponse(content, content_type='application/x-chess-pgn')
+        response['Content-Disposition'] = f'attachment; filename="{request.user.username}-games.pgn"'
+        return response
+    
     @action(detail=True, methods=['post'])
     def make_move(self, request, pk=None):
         # make a chess move
         game = get_object_or_404(self.get_queryset(), pk=pk)
         
-        if game.status != 'active':
-            return Response({
-                'error': 'Game is not active'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        if not game.is_players_turn(request.user):
-            return Response({
-                'error': 'Not your turn'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
         from_square = request.data.get('from_square')
         to_square = request.data.get('to_square')
-        
-        if not from_square or not to_square:
-            return Response({
-                'error': 'from_square and to_square are required'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        board = game.get_board()
-        try:
-            move = chess.Move.from_uci(f"{from_square}{to_square}")
-            if move in board.legal_moves:
-                piece = board.piece_at(chess.parse_square(from_square))
-                board.push(move)
-                game.update_board(board)
-                
-                Move.objects.create(
-                    game=game,
-                    player=request.user,
-                    from_square=from_square,
-                    to_square=to_square,
-                    piece=piece.symbol() if piece else '',
-                    notation=str(move)
-                )
-                
-                game.current_turn = 'black' if game.current_turn == 'white' else 'white'
-                game.move_count += 1
-                
-                if board.is_checkmate():
-                    game.status = 'completed'
-                    game.winner = request.user
-                    game.outcome = 'white_wins' if request.user == game.white_player else 'black_wins'
-                elif board.is_stalemate() or board.is_insufficient_material():
-                    game.status = 'completed'
-                    game.outcome = 'draw'
-                
-                game.save()
-                broadcast_game_reload(game.id)
-                if game.status != 'active':
-                    broadcast_lobby_reload()
-                
-                serializer = self.get_serializer(game)
-                return Response({
-                    'success': True,
-                    'game': serializer.data,
-                    'message': f'Move made: {from_square} to {to_square}'
-                })
+        result = apply_move(game, request.user, from_square, to_square, request.data.get('promotion'))
+        if not result.ok:
+            # a concurrent move on the same ply is a conflict, not a bad request
+            if result.status == MoveResult.CONFLICT:
+                code = status.HTTP_409_CONFLICT
             else:
-                return Response({
-                    'error': 'Invalid move'
-                }, status=status.HTTP_400_BAD_REQUEST)
-        except Exception as e:
+                code = status.HTTP_400_BAD_REQUEST
             return Response({
-                'error': f'Invalid move: {str(e)}'
-            }, status=status.HTTP_400_BAD_REQUEST)
+                'error': result.error,
+                'reason': result.status
+            }, status=code)
+        
+        serializer = self.get_serializer(game)
+        return Response({
+            'success': True,
+            'game': serializer.data,
+            'message': f'Move made: {from_square} to {to_square}'
+        })
     
     @action(detail=True, methods=['post'])
     def resign(self, request, pk=None):
@@ -216,17 +207,13 @@ class GameViewSet(viewsets.ModelViewSet):
                 'error': 'Game is not active'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        if request.user == game.white_player:
-            game.winner = game.black_player
-            game.outcome = 'white_resigned'
-        else:
-            game.winner = game.white_player
-            game.outcome = 'black_resigned'
-        
-        game.status = 'resigned'
-        game.save()
-        broadcast_game_reload(game.id)
-        broadcast_lobby_reload()
+        result = record_resignation(game, request.user)
+        if not result.ok:
+            # the game ended (a mate, the opponent resigning) since it was loaded
+            return Response({
+                'error': result.error,
+                'reason': result.status
+            }, status=status.HTTP_409_CONFLICT)
         
         opponent = game.get_opponent(request.user)
         serializer = self.get_serializer(game)
@@ -239,34 +226,54 @@ class GameViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def board_state(self, request, pk=None):
         # get board state for the current user
+        # ?base_ply=N sends only the squares changed since ply N
+        # ?legal_moves=1 adds the legal move map for client-side validation
         game = get_object_or_404(self.get_queryset(), pk=pk)
-        board = game.get_board()
-        board_dict = board_to_dict(board, request.user, game)
-        
-        is_my_turn = game.is_players_turn(request.user)
-        is_game_over = board.is_game_over()
-        result = None
-        
-        if is_game_over:
-            if board.is_checkmate():
-                winner = 'Black' if board.turn else 'White'
-                result = f'{winner} wins by checkmate!'
-            elif board.is_stalemate():
-                result = 'Draw by stalemate!'
-            elif board.is_insufficient_material():
-                result = 'Draw by insufficient material!'
-        
-        data = {
-            'board_dict': board_dict,
-            'current_turn': game.current_turn,
-            'is_my_turn': is_my_turn,
-            'is_game_over': is_game_over,
-            'result': result
-        }
+        base_ply = parse_ply(request.query_params.get('base_ply'))
+        with game.cached_board() as board:
+            base_pieces = pieces_at_ply(game, board, base_ply) if base_ply is not None else None
+            data = board_state(
+                board, game.current_turn, game.is_players_turn(request.user),
+                flipped=request.user.id == game.black_player_id,
+                ply=game.move_count, base_ply=base_ply, base_pieces=base_pieces,
+                legal_moves=wants_legal_moves(request.query_params.get('legal_moves'))
+            )
         
         serializer = BoardStateSerializer(data)
         return Response(serializer.data)
 
+    
+    @action(detail=True, methods=['get'])
+    def position(self, request, pk=None):
+        # board of the game at ?ply=N, rebuilt from the nearest checkpoint
+        game = get_object_or_404(self.get_queryset(), pk=pk)
+        ply = parse_ply(request.query_params.get('ply'))
+        moves = unpack_moves(game.packed_moves)
+        board = board_at_ply(game, ply, moves) if ply is not None else None
+        if board is None:
+            return Response({
+                'error': f'ply must be between 0 and {game.move_count}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        # a board rebuilt from a checkpoint has no move stack, so take the move
+        # from the game and its SAN from the position before it
+        last_move = moves[ply - 1] if ply else None
+        san = board_at_ply(game, ply - 1, moves).san(last_move) if last_move else None
+        return Response({
+            'ply': ply,
+            'fen': board.fen(),
+            'uci': last_move.uci() if last_move else None,
+            'san': san,
+            'board_dict': render_board(board, flipped=request.user.id == game.black_player_id),
+            'checksum': board_checksum(board),
+        })
+    
+    @action(detail=True, methods=['get'])
+    def positions(self, request, pk=None):
+        # every position of the game in one response, for scrubbing through it
+        game = get_object_or_404(self.get_queryset(), pk=pk)
+        return Response({'id': game.id, 'positions': all_positions(game)})
+
 
 class GameChallengeViewSet(viewsets.ModelViewSet):
     # viewset for game challenges
@@ -339,7 +346,7 @@ class GameChallengeViewSet(viewsets.ModelViewSet):
             challenger=request.user,
             challenged=challenged_user
         )
-        broadcast_lobby_reload()
+        broadcast_lobby_reload([request.user.id, challenged_user.id])
         serializer = self.get_serializer(challenge)
         return Response({
             'success': True,
@@ -362,15 +369,13 @@ class GameChallengeViewSet(viewsets.ModelViewSet):
                 'error': 'You already have an active game'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        game = Game.objects.create(
-            white_player=challenge.challenger,
-            black_player=challenge.challenged
-        )
-        
-        challenge.status = 'accepted'
-        challenge.save()
+        game = start_game(challenge)
+        if game is None:
+            return Response({
+                'error': f'{challenge.challenger.username} is already in a game'
+            }, status=status.HTTP_400_BAD_REQUEST)
         
-        broadcast_lobby_reload()
+        broadcast_lobby_reload([challenge.challenger_id, challenge.challenged_id])
         broadcast_game_reload(game.id)
         
         game_serializer = GameSerializer(game)
@@ -393,7 +398,7 @@ class GameChallengeViewSet(viewsets.ModelViewSet):
         challenge.status = 'declined'
         challenge.save()
         
-        broadcast_lobby_reload()
+        broadcast_lobby_reload([challenge.challenger_id, challenge.challenged_id])
         serializer = self.get_serializer(challenge)
         return Response({
             'success': True,
@@ -406,14 +411,7 @@ class GameChallengeViewSet(viewsets.ModelViewSet):
 @permission_classes([IsAuthenticated])
 def api_available_players(request):
     # get list of available players
-    class MockRequest:
-        def __init__(self, user):
-            self.user = user
-    
-    mock_request = MockRequest(request.user)
-    available_players = get_logged_in_users_excluding_current(mock_request)
-    available_players = [user for user in available_players if not get_active_game(user)]
-    
+    available_players = get_available_players(request.user)
     serializer = UserSerializer(available_players, many=True)
     return Response(serializer.data)
 
@@ -421,19 +419,18 @@ def api_available_players(request):
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def api_game_history(request):
-    # get game history
+    # get finished games, newest first, a page at a time
     try:
         if request.user.is_authenticated:
             games = Game.objects.filter(
                 Q(white_player=request.user) | Q(black_player=request.user)
-            ).filter(status__in=['completed', 'resigned']).order_by('-updated_at')
+            ).filter(status__in=['completed', 'resigned'])
         else:
-            games = Game.objects.filter(
-                status__in=['completed', 'resigned']
-            ).order_by('-updated_at')[:20]
+            games = Game.objects.filter(status__in=['completed', 'resigned'])
         
-        serializer = GameSerializer(games, many=True)
-        return Response(serializer.data)
+        return paginated_games(request, games)
+    except NotFound:
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -443,147 +440,176 @@ def api_game_history(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def api_position_games(request, fen):
+    # games that reached a position (full FEN, so castling and en passant count), via the Zobrist index
+    try:
+        board = chess.Board(fen)
+    except ValueError:
+        return Response({
+            'error': 'Invalid FEN'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    positions = PositionIndex.objects.filter(zobrist=position_key(board))
+    response = paginated_games(request, Game.objects.filter(id__in=positions.values('game_id')))
+    # no total: counting every occurrence of a popular position would scan its whole index range,
+    # `next` says whether more games follow
+    response.data['fen'] = board.fen()
+    return response
+
+
 from django.views.decorators.csrf import csrf_exempt
 
 @api_view(['GET', 'POST'])
+@authentication_classes([])
 @permission_classes([AllowAny])
 @csrf_exempt
 def api_solo_play(request):
-    # guest single player mode starts a new game every time
-    if request.method == 'GET':
-        request.session.pop('solo_board', None)
-        request.session.pop('solo_turn', None)
-        
-        board_fen = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
-        solo_turn = 'white'
-        request.session['solo_board'] = board_fen
-        request.session['solo_turn'] = solo_turn
-        
-        board = chess.Board(board_fen)
-        board_dict = {}
-        
-        piece_symbols = {
-            'K': '&#9812;', 'Q': '&#9813;', 'R': '&#9814;', 'B': '&#9815;', 'N': '&#9816;', 'P': '&#9817;',
-            'k': '&#9818;', 'q': '&#9819;', 'r': '&#9820;', 'b': '&#9821;', 'n': '&#9822;', 'p': '&#9823;'
-        }
-        
-        for row in range(8):
-            for col in range(8):
-                square = chess.square(col, 7 - row)
-                piece = board.piece_at(square)
-                
-                file_letter = chr(ord('a') + col)
-                rank_number = str(8 - row)
-                square_name = f"{file_letter}{rank_number}"
-                
-                if piece:
-                    board_dict[square_name] = piece_symbols.get(piece.symbol(), '')
-                else:
-                    board_dict[square_name] = '&nbsp;'
-        
-        is_game_over = board.is_game_over()
-        result = None
-        
-        if is_game_over:
-            if board.is_checkmate():
-                winner = 'Black' if board.turn else 'White'
-                result = f'{winner} wins by checkmate!'
-            elif board.is_stalemate():
-                result = 'Draw by stalemate!'
-            elif board.is_insufficient_material():
-                result = 'Draw by insufficient material!'
-        
-        data = {
-            'board_dict': board_dict,
-            'current_turn': solo_turn,
-            'is_my_turn': True,
-            'is_game_over': is_game_over,
-            'result': result
-        }
-        
+    # guest single player mode; the game travels as a signed token (see solo.py),
+    # so no session is read or written: GET and reset start a new game
+    if request.method == 'GET' or request.data.get('reset'):
+        board = chess.Board()
+        data = board_state(
+            board, 'white', True,
+            legal_moves=wants_legal_moves(request.query_params.get('legal_moves'))
+        )
         serializer = BoardStateSerializer(data)
-        return Response(serializer.data)
+        if request.method == 'GET':
+            return Response({**serializer.data, 'token': make_token(board)})
+        return Response({
+            'success': True,
+            'board_state': serializer.data,
+            'token': make_token(board),
+            'message': 'Board reset!'
+        })
     
-    elif request.method == 'POST':
-        if request.data.get('reset'):
-            request.session['solo_board'] = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
-            request.session['solo_turn'] = 'white'
-            return Response({
-                'success': True,
-                'message': 'Board reset!'
-            })
-        
-        from_square = request.data.get('from_square')
-        to_square = request.data.get('to_square')
-        
-        if not from_square or not to_square:
-            return Response({
-                'error': 'from_square and to_square are required'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        board_fen = request.session.get('solo_board', 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1')
-        
-        try:
-            board = chess.Board(board_fen)
-            move = chess.Move.from_uci(f"{from_square}{to_square}")
-            
-            if move in board.legal_moves:
-                board.push(move)
-                request.session['solo_board'] = board.fen()
-                request.session['solo_turn'] = 'black' if request.session.get('solo_turn', 'white') == 'white' else 'white'
-                
-                board_dict = {}
-                piece_symbols = {
-                    'K': '&#9812;', 'Q': '&#9813;', 'R': '&#9814;', 'B': '&#9815;', 'N': '&#9816;', 'P': '&#9817;',
-                    'k': '&#9818;', 'q': '&#9819;', 'r': '&#9820;', 'b': '&#9821;', 'n': '&#9822;', 'p': '&#9823;'
-                }
-                
-                for row in range(8):
-                    for col in range(8):
-                        square = chess.square(col, 7 - row)
-                        piece = board.piece_at(square)
-                        
-                        file_letter = chr(ord('a') + col)
-                        rank_number = str(8 - row)
-                        square_name = f"{file_letter}{rank_number}"
-                        
-                        if piece:
-                            board_dict[square_name] = piece_symbols.get(piece.symbol(), '')
-                        else:
-                            board_dict[square_name] = '&nbsp;'
-                
-                is_game_over = board.is_game_over()
-                result = None
-                
-                if is_game_over:
-                    if board.is_checkmate():
-                        winner = 'Black' if board.turn else 'White'
-                        result = f'{winner} wins by checkmate!'
-                    elif board.is_stalemate():
-                        result = 'Draw by stalemate!'
-                    elif board.is_insufficient_material():
-                        result = 'Draw by insufficient material!'
-                
-                data = {
-                    'board_dict': board_dict,
-                    'current_turn': request.session.get('solo_turn', 'white'),
-                    'is_my_turn': True,
-                    'is_game_over': is_game_over,
-                    'result': result
-                }
-                
-                serializer = BoardStateSerializer(data)
-                return Response({
-                    'success': True,
-                    'board_state': serializer.data,
-                    'message': f'Move: {from_square} to {to_square}'
-                })
-            else:
-                return Response({
-                    'error': 'Invalid move!'
-                }, status=status.HTTP_400_BAD_REQUEST)
-        except Exception as e:
-            return Response({
-                'error': f'Invalid move: {str(e)}'
-            }, status=status.HTTP_400_BAD_REQUEST)
+    from_square = request.data.get('from_square')
+    to_square = request.data.get('to_square')
+    
+    if not from_square or not to_square:
+        return Response({
+            'error': 'from_square and to_square are required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        board = board_from_token(request.data.get('token'))
+    except InvalidToken as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        move = chess.Move.from_uci(f"{from_square}{to_square}{request.data.get('promotion') or ''}")
+    except ValueError as e:
+        return Response({
+            'error': f'Invalid move: {str(e)}'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if not is_legal(board, move):
+        return Response({
+            'error': 'Invalid move!'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    # a client at the pre-move ply only needs the changed squares
+    base_ply = parse_ply(request.data.get('base_ply'))
+    base_pieces = board.piece_map() if base_ply == board.ply() else None
+    board.push(move)
+    
+    data = board_state(
+        board, 'white' if board.turn else 'black', True,
+        base_ply=base_ply, base_pieces=base_pieces,
+        legal_moves=wants_legal_moves(request.data.get('legal_moves'))
+    )
+    
+    serializer = BoardStateSerializer(data)
+    return Response({
+        'success': True,
+        'board_state': serializer.data,
+        'token': make_token(board),
+        'message': f'Move: {from_square} to {to_square}'
+    })
+
+
+async def api_solo_engine(request):
+    # the computer plays the side to move in the guest's solo game (token in a JSON body)
+    # async so the search (on the engine process pool) holds no server thread;
+    # plain Django view as DRF and the csrf_exempt decorator only wrap sync views on 4.2
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    
+    try:
+        body = json.loads(request.body or b'{}')
+        board = board_from_token(body.get('token'))
+    except InvalidToken as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except (ValueError, AttributeError):
+        return JsonResponse({'error': 'Invalid request body'}, status=400)
+    if board.is_game_over():
+        return JsonResponse({'error': 'Game is over'}, status=400)
+    
+    result = await analyse(board.fen())
+    board.push_uci(result['move'])
+    
+    data = board_state(
+        board, 'white' if board.turn else 'black', True,
+        legal_moves=wants_legal_moves(body.get('legal_moves'))
+    )
+    return JsonResponse({
+        'success': True,
+        'board_state': BoardStateSerializer(data).data,
+        'token': make_token(board),
+        'engine': result,
+        'message': f"Computer played {result['san']} (depth {result['depth']}, {result['nps']} nodes/s)"
+    })
+
+
+# guests have no CSRF cookie and the view reads no session, like api_solo_play;
+# set by hand since the decorator would hide that the view is async
+api_solo_engine.csrf_exempt = True
 
+
+def _analysis_request(request, pk, depth):
+    # the finished game's positions and the evaluations already cached for them
+    if not request.user.is_authenticated:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=403), None, None
+    game = Game.objects.filter(
+        models.Q(white_player=request.user) | models.Q(black_player=request.user), pk=pk
+    ).only('id', 'status', 'packed_moves').first()
+    if game is None:
+        return JsonResponse({'detail': 'Not found.'}, status=404), None, None
+    if game.status not in ('completed', 'resigned'):
+        return JsonResponse({'error': 'Only finished games can be analyzed'}, status=400), None, None
+    positions = game_positions(game)
+    return None, positions, cached_evaluations([key for key, _ in positions], depth)
+
+
+async def api_game_analyze(request, pk):
+    # evaluate every ply of a finished game; cached positions are not searched again
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    max_depth = getattr(settings, 'ANALYSIS_DEPTH', 3)
+    try:
+        depth = min(max(int(request.GET.get('depth', max_depth)), 1), max_depth)
+    except ValueError:
+        return JsonResponse({'error': 'depth must be a number'}, status=400)
+    
+    error, positions, cached = await sync_to_async(_analysis_request)(request, pk, depth)
+    if error is not None:
+        return error
+    
+    missing = {key: fen for key, fen in positions if key not in cached}
+    if missing:
+        results = await evaluate_many(list(missing.values()), depth)
+        evaluated = dict(zip(missing, results))
+        await sync_to_async(store_evaluations)(evaluated, depth)
+        cached.update(evaluated)
+    
+    return JsonResponse({
+        'id': pk,
+        'depth': depth,
+        'cached': len({key for key, _ in positions}) - len(missing),
+        'computed': len(missing),
+        'evaluations': [
+            {'ply': ply, 'score': cached[key][0], 'best_move': cached[key][1] or None}
+            for ply, (key, _) in enumerate(positions)
+        ],
+    })
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ChessGameConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chess_game'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,119 @@
+"""
+Per-process LRU cache of live python-chess boards for active games.
+
+Entries are keyed by game id and validated against the game's version
+(move_count plus FEN), so a move made by another worker process simply
+turns into a miss. A miss replays the game's packed moves, so every board
+carries the whole game on its move stack, which python-chess needs for
+repetition detection: a hit and a miss (on any worker) judge fivefold
+repetition and the 75-move rule alike. Hot games skip the replay.
+"""
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import chess
+from django.conf import settings
+
+from .packing import unpack_moves
+
+
+def game_version(game):
+    return game.move_count, game.board_state
+
+
+def build_board(game):
+    """Board of game with its full move stack"""
+    board = chess.Board()
+    for move in unpack_moves(game.packed_moves):
+        board.push(move)
+    if board.fen() != game.board_state:
+        # a row whose moves were never packed only has its FEN
+        return chess.Board(game.board_state)
+    return board
+
+
+class _Entry:
+    __slots__ = ('version', 'board', 'lock')
+
+    def __init__(self, version, board):
+        self.version = version
+        self.board = board
+        self.lock = threading.Lock()
+
+
+class BoardCache:
+    def __init__(self, maxsize=None):
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def maxsize(self):
+        if self._maxsize is not None:
+            return self._maxsize
+        return getattr(settings, 'BOARD_CACHE_SIZE', 1024)
+
+    @contextmanager
+    def borrow(self, game):
+        """Yield the live board for game, locked against other threads.
+
+        The caller may push moves onto the board as long as it updates game
+        to match before leaving the block; the entry is then stored under
+        the new version. An exception evicts the entry.
+        """
+        version = game_version(game)
+        with self._lock:
+            entry = self._entries.get(game.id)
+            if entry is not None and entry.version == version:
+                self.hits += 1
+                self._entries.move_to_end(game.id)
+            else:
+                self.misses += 1
+                # built below under the entry lock, not while holding the cache
+                entry = _Entry(version, None)
+                self._entries[game.id] = entry
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+
+        with entry.lock:
+            if entry.version != version:
+                # another thread moved on while we waited, use a private board
+                yield build_board(game)
+                return
+            try:
+                if entry.board is None:
+                    entry.board = build_board(game)
+                yield entry.board
+            except BaseException:
+                with self._lock:
+                    if self._entries.get(game.id) is entry:
+                        del self._entries[game.id]
+                raise
+            entry.version = game_version(game)
+
+    def invalidate(self, game_id):
+        with self._lock:
+            self._entries.pop(game_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+board_cache = BoardCache()
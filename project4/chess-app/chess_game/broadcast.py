@@ -0,0 +1,164 @@
+"""
+Coalescing scheduler for channel-layer broadcasts.
+
+Views call schedule() instead of sending to the channel layer directly. The
+first event for a group is sent straight away and opens a window
+(BROADCAST_COALESCE_WINDOW seconds); later events for the same group inside
+that window are merged into one pending event, sent when the window closes
+(which opens the next window). A lone event therefore never waits, and a
+burst costs at most one message per window. Messages are built at send
+time, so a merged refresh always reflects the latest state and superseded
+events are simply dropped.
+
+Sending happens on a background thread, so the request thread only pays for
+a dict update. A window of 0 sends synchronously, as before.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections
+
+from .metrics import FANOUT_SECONDS, group_label
+
+logger = logging.getLogger(__name__)
+
+
+class _Pending:
+    __slots__ = ('deadline', 'build', 'payload', 'merge')
+
+    def __init__(self, deadline, build, payload, merge):
+        self.deadline = deadline
+        self.build = build
+        self.payload = payload
+        self.merge = merge
+
+
+class BroadcastScheduler:
+    def __init__(self):
+        self._pending = {}
+        # group -> monotonic time until which new events are held back
+        self._quiet_until = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._loop = None
+        self.received = 0
+        self.emitted = 0
+        self.superseded = 0
+
+    @property
+    def window(self):
+        return getattr(settings, 'BROADCAST_COALESCE_WINDOW', 0)
+
+    def attach_loop(self, loop):
+        """Remember the event loop that serves websocket consumers in this process"""
+        self._loop = loop
+
+    def schedule(self, group, build, payload=None, merge=None, delay=None):
+        """Queue a broadcast to group.
+
+        build(payload) returns the channel-layer message. When an event for
+        the same group is already pending, merge(old, new) combines the
+        payloads (the newer payload wins when merge is None). delay
+        overrides the window for this event, e.g. 0 for moves that must go
+        out at once; it can only bring a pending deadline forward.
+        """
+        with self._cond:
+            self.received += 1
+            window = self.window
+            if window <= 0:
+                pending = _Pending(0, build, payload, merge)
+            else:
+                current = time.monotonic()
+                # leading edge: due now unless the group sent within the window
+                deadline = max(current, self._quiet_until.get(group, 0))
+                if delay is not None:
+                    deadline = min(deadline, current + delay)
+                pending = self._pending.get(group)
+                if pending is not None:
+                    self.superseded += 1
+                    pending.payload = merge(pending.payload, payload) if merge else payload
+                    pending.deadline = min(pending.deadline, deadline)
+                else:
+                    self._pending[group] = _Pending(deadline, build, payload, merge)
+                    self._quiet_until[group] = deadline + window
+                    self._ensure_thread()
+                self._cond.notify()
+                return
+        self._emit(group, pending)
+
+    def flush(self):
+        """Send everything that is pending right now"""
+        with self._cond:
+            batch = list(self._pending.items())
+            self._pending.clear()
+        for group, pending in batch:
+            self._emit(group, pending)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'received': self.received,
+                'emitted': self.emitted,
+                'superseded': self.superseded,
+                'pending': len(self._pending),
+            }
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='broadcast-scheduler', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                current = time.monotonic()
+                due = [group for group, pending in self._pending.items() if pending.deadline <= current]
+                if not due:
+                    self._cond.wait(min(p.deadline for p in self._pending.values()) - current)
+                    continue
+                batch = [(group, self._pending.pop(group)) for group in due]
+                self._quiet_until = {
+                    group: until for group, until in self._quiet_until.items() if until > current
+                }
+            for group, pending in batch:
+                self._emit(group, pending)
+            close_old_connections()
+
+    def _emit(self, group, pending):
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        try:
+            with FANOUT_SECONDS.time(group=group_label(group)):
+                message = pending.build(pending.payload)
+                self._send(channel_layer, group, message)
+        except Exception:
+            logger.exception('Broadcast to %s failed', group)
+            return
+        with self._cond:
+            self.emitted += 1
+
+    def _send(self, channel_layer, group, message):
+        loop = self._loop
+        on_worker = threading.current_thread() is self._thread
+        if on_worker and loop is not None and loop.is_running():
+            # hand the send to the consumers' loop, in-memory layers are not thread-safe
+            future = asyncio.run_coroutine_threadsafe(channel_layer.group_send(group, message), loop)
+            future.result()
+        else:
+            async_to_sync(channel_layer.group_send)(group, message)
+
+
+_scheduler = BroadcastScheduler()
+
+
+def get_broadcaster():
+    return _scheduler
@@ -0,0 +1,296 @@
+"""
+Channel layer shared by every worker process on one host through SQLite.
+
+InMemoryChannelLayer only delivers inside one process, so a move handled by
+one Daphne worker never reached sockets held by another. This layer keeps
+messages and group memberships in a small SQLite file (WAL mode) that every
+worker on the host opens, so no broker process is needed.
+
+Process-specific channels (the ones consumers get from new_channel) share
+one poller per process: it drains every message addressed to the process
+in a single query and hands them to per-channel buffers, so the polling cost
+does not grow with the number of open sockets. Messages must be JSON
+serializable.
+"""
+
+import asyncio
+import json
+import random
+import sqlite3
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS channel_messages ('
+    'id INTEGER PRIMARY KEY AUTOINCREMENT, inbox TEXT NOT NULL, channel TEXT NOT NULL, '
+    'expires_at REAL NOT NULL, body TEXT NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS channel_messages_inbox ON channel_messages (inbox, id)',
+    'CREATE INDEX IF NOT EXISTS channel_messages_channel ON channel_messages (channel, expires_at)',
+    'CREATE INDEX IF NOT EXISTS channel_messages_expiry ON channel_messages (expires_at)',
+    'CREATE TABLE IF NOT EXISTS channel_groups ('
+    'group_name TEXT NOT NULL, channel TEXT NOT NULL, joined_at REAL NOT NULL, '
+    'PRIMARY KEY (group_name, channel))',
+    'CREATE INDEX IF NOT EXISTS channel_groups_channel ON channel_groups (channel)',
+)
+
+INSERT_MESSAGE = 'INSERT INTO channel_messages (inbox, channel, expires_at, body) VALUES (?, ?, ?, ?)'
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    """Channel layer stored in a SQLite file shared by all workers on a host"""
+
+    extensions = ['groups', 'flush']
+
+    def __init__(
+        self,
+        path,
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        poll_interval=0.005,
+        max_poll_interval=0.05,
+        timeout=5.0,
+        **kwargs
+    ):
+        super().__init__(expiry=expiry, capacity=capacity)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.path = str(path)
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.timeout = timeout
+        self.client_prefix = ''.join(random.choice(string.ascii_letters) for _ in range(12))
+        # all SQLite work happens on one thread per process, off the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='channel-layer')
+        self._local = threading.local()
+        self._cleaned_at = 0
+        self._loop = None
+        self._buffers = {}  # channel -> asyncio.Queue of (expires_at, message)
+        self._pollers = {}  # inbox -> poller task
+        self._waiting = {}  # inbox -> number of pending receive() calls
+
+    # SQLite access, run on the executor thread
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _send_sync(self, channel, body):
+        current = time.time()
+        with self._transaction() as conn:
+            queued = conn.execute(
+                'SELECT COUNT(*) FROM channel_messages WHERE channel = ? AND expires_at > ?',
+                (channel, current),
+            ).fetchone()[0]
+            if queued >= self.get_capacity(channel):
+                raise ChannelFull(channel)
+            conn.execute(INSERT_MESSAGE, (self.non_local_name(channel), channel, current + self.expiry, body))
+
+    def _group_send_sync(self, group, body):
+        current = time.time()
+        with self._transaction() as conn:
+            members = conn.execute(
+                'SELECT g.channel, COUNT(m.id) FROM channel_groups g '
+                'LEFT JOIN channel_messages m ON m.channel = g.channel AND m.expires_at > ? '
+                'WHERE g.group_name = ? AND g.joined_at > ? GROUP BY g.channel',
+                (current, group, current - self.group_expiry),
+            ).fetchall()
+            # full channels are skipped, like the other layers do for groups
+            conn.executemany(INSERT_MESSAGE, [
+                (self.non_local_name(channel), channel, current + self.expiry, body)
+                for channel, queued in members if queued < self.get_capacity(channel)
+            ])
+
+    def _fetch_sync(self, inbox, limit):
+        """Take up to limit messages addressed to inbox, oldest first"""
+        conn = self._connection()
+        # cheap read first, so idle polls never take the write lock
+        if conn.execute('SELECT 1 FROM channel_messages WHERE inbox = ? LIMIT 1', (inbox,)).fetchone() is None:
+            return []
+        current = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute(
+                'SELECT id, channel, expires_at, body FROM channel_messages WHERE inbox = ? ORDER BY id LIMIT ?',
+                (inbox, limit),
+            ).fetchall()
+            if rows:
+                conn.execute('DELETE FROM channel_messages WHERE inbox = ? AND id <= ?', (inbox, rows[-1][0]))
+        return [(channel, expires_at, body) for _, channel, expires_at, body in rows if expires_at > current]
+
+    def _clean_sync(self):
+        """Drop expired messages and memberships.
+
+        A channel with an expired message is not being read any more, so it
+        also leaves all of its groups.
+        """
+        current = time.time()
+        with self._transaction() as conn:
+            expired = conn.execute(
+                'SELECT DISTINCT channel FROM channel_messages WHERE expires_at <= ?', (current,)
+            ).fetchall()
+            if expired:
+                conn.execute('DELETE FROM channel_messages WHERE expires_at <= ?', (current,))
+                conn.executemany('DELETE FROM channel_groups WHERE channel = ?', expired)
+            conn.execute('DELETE FROM channel_groups WHERE joined_at <= ?', (current - self.group_expiry,))
+
+    def _group_add_sync(self, group, channel):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO channel_groups (group_name, channel, joined_at) VALUES (?, ?, ?)',
+            (group, channel, time.time()),
+        )
+
+    def _group_discard_sync(self, group, channel):
+        self._connection().execute(
+            'DELETE FROM channel_groups WHERE group_name = ? AND channel = ?', (group, channel)
+        )
+
+    def _flush_sync(self):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM channel_messages')
+            conn.execute('DELETE FROM channel_groups')
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        """Send a message onto a (general or specific) channel"""
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        assert '__asgi_channel__' not in message
+        await self._run(self._send_sync, channel, json.dumps(message))
+
+    async def receive(self, channel):
+        """Receive the first message that arrives on the channel"""
+        assert self.valid_channel_name(channel)
+        if '!' not in channel:
+            return await self._receive_direct(channel)
+
+        self._bind_loop()
+        inbox = self.non_local_name(channel)
+        queue = self._buffers.setdefault(channel, asyncio.Queue())
+        self._waiting[inbox] = self._waiting.get(inbox, 0) + 1
+        self._ensure_poller(inbox)
+        try:
+            while True:
+                expires_at, message = await queue.get()
+                if expires_at > time.time():
+                    return message
+        finally:
+            self._waiting[inbox] = self._waiting.get(inbox, 1) - 1
+            if queue.empty() and self._buffers.get(channel) is queue:
+                del self._buffers[channel]
+
+    async def new_channel(self, prefix='specific.'):
+        """A new channel name that only this process receives on"""
+        return '%s.%s!%s' % (
+            prefix,
+            self.client_prefix,
+            ''.join(random.choice(string.ascii_letters) for _ in range(12)),
+        )
+
+    async def _receive_direct(self, channel):
+        # general channels may be read by any process, poll them one message at a time
+        delay = self.poll_interval
+        while True:
+            rows = await self._run(self._fetch_sync, channel, 1)
+            if rows:
+                return json.loads(rows[0][2])
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_poll_interval)
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # buffers and pollers belong to one event loop
+            self._loop = loop
+            self._buffers = {}
+            self._pollers = {}
+            self._waiting = {}
+
+    def _ensure_poller(self, inbox):
+        poller = self._pollers.get(inbox)
+        if poller is None or poller.done():
+            self._pollers[inbox] = asyncio.ensure_future(self._poll(inbox))
+
+    async def _poll(self, inbox, batch_size=100):
+        delay = self.poll_interval
+        while self._waiting.get(inbox):
+            rows = await self._run(self._fetch_sync, inbox, batch_size)
+            for channel, expires_at, body in rows:
+                self._buffers.setdefault(channel, asyncio.Queue()).put_nowait((expires_at, json.loads(body)))
+
+            if time.time() - self._cleaned_at > 1:
+                self._cleaned_at = time.time()
+                await self._run(self._clean_sync)
+                self._clean_buffers()
+
+            if len(rows) == batch_size:
+                continue
+            if rows:
+                delay = self.poll_interval
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_poll_interval)
+
+    def _clean_buffers(self):
+        # messages fetched for channels whose consumer has gone away
+        current = time.time()
+        for channel, queue in list(self._buffers.items()):
+            while not queue.empty() and queue._queue[0][0] <= current:
+                queue.get_nowait()
+            if queue.empty() and not queue._getters:
+                del self._buffers[channel]
+
+    # Flush extension
+
+    async def flush(self):
+        self._buffers = {}
+        await self._run(self._flush_sync)
+
+    async def close(self):
+        # Nothing to do, the connection lives on the executor thread
+        pass
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        """Adds the channel name to a group"""
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        await self._run(self._group_add_sync, group, channel)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_channel_name(channel), 'Invalid channel name'
+        assert self.valid_group_name(group), 'Invalid group name'
+        await self._run(self._group_discard_sync, group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'Message is not a dict'
+        assert self.valid_group_name(group), 'Invalid group name'
+        await self._run(self._group_send_sync, group, json.dumps(message))
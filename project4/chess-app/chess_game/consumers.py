@@ -1,17 +1,47 @@
-from channels.db import database_sync_to_async
+import asyncio
+import bisect
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from django.db.models import Q
-from django.contrib.sessions.models import Session
-from django.utils.timezone import now
-from django.contrib.auth.models import User
 
+from .broadcast import get_broadcaster
+from .metrics import FANOUT_SECONDS, OPEN_SOCKETS, database_sync_to_async, timed_event
 from .models import Game, GameChallenge
-from .serializers import UserSerializer, GameSerializer, GameChallengeSerializer, BoardStateSerializer
-from .views import get_logged_in_users_excluding_current, get_active_game, board_to_dict
+from .presence import mark_socket_offline, mark_socket_online
+from .rendering import board_state
+from .serializers import (
+    UserSerializer, GameSerializer, GameChallengeSerializer, BoardStateSerializer, GameSummarySerializer
+)
+from .services import (
+    MoveResult, apply_move, get_available_players, parse_ply, pieces_at_ply, wants_legal_moves
+)
+
+
+class SocketMetricsMixin:
+    # counted in the open-sockets gauge once accepted
+    metrics_group = None
+    _counted = False
+
+    async def accept(self, *args, **kwargs):
+        await super().accept(*args, **kwargs)
+        OPEN_SOCKETS.inc(group=self.metrics_group)
+        self._counted = True
 
+    async def websocket_disconnect(self, message):
+        if self._counted:
+            OPEN_SOCKETS.dec(group=self.metrics_group)
+            self._counted = False
+        await super().websocket_disconnect(message)
 
-class LobbyConsumer(AsyncJsonWebsocketConsumer):
+
+class LobbyConsumer(SocketMetricsMixin, AsyncJsonWebsocketConsumer):
     group_name = "lobby"
+    metrics_group = "lobby"
+    # cached "pending_challenges"/"game_history" JSON members for this socket
+    _private_json = None
 
     async def connect(self):
         user = self.scope.get("user")
@@ -20,53 +50,102 @@ class LobbyConsumer(AsyncJsonWebsocketConsumer):
             return
 
         await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await sync_to_async(mark_socket_online)(user, self.channel_name)
+        get_broadcaster().attach_loop(asyncio.get_running_loop())
         await self.accept()
 
     async def disconnect(self, code):
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        await sync_to_async(mark_socket_offline)(self.channel_name)
 
+    @timed_event("lobby.refresh")
     async def lobby_refresh(self, event):
         # send lobby data update
         user = self.scope.get("user")
-        if user and not user.is_anonymous:
+        if not user or user.is_anonymous:
+            return
+
+        players_json = event.get("players")
+        if players_json is None:
+            # event without a precomputed snapshot, build everything here
             lobby_data = await self._get_lobby_data(user)
             await self.send_json({
                 "action": "lobby_refresh",
                 "data": lobby_data
             })
-    
+            return
+
+        # the player list is shared, only challenges and history are per user
+        if self._private_json is None or user.id in event.get("affected", ()):
+            self._private_json = await self._get_private_json(user)
+
+        await self.send(text_data=(
+            '{"action":"lobby_refresh","data":{"available_players":%s,%s}}'
+            % (
+                exclude_player(players_json, event["player_ids"], event["player_offsets"], user.id),
+                self._private_json,
+            )
+        ))
+
     @database_sync_to_async
-    def _get_lobby_data(self, user):
-        # get lobby data for the user
-        class MockRequest:
-            def __init__(self, user):
-                self.user = user
-        
-        mock_request = MockRequest(user)
-        available_players = get_logged_in_users_excluding_current(mock_request)
-        available_players = [u for u in available_players if not get_active_game(u)]
-        available_players_data = UserSerializer(available_players, many=True).data
-        
+    def _get_private_json(self, user):
+        # encoded pending challenges and game history for the user
+        data = self._get_private_data(user)
+        return '"pending_challenges":%s,"game_history":%s' % (
+            json.dumps(data["pending_challenges"], separators=(',', ':')),
+            json.dumps(data["game_history"], separators=(',', ':')),
+        )
+
+    def _get_private_data(self, user):
         pending_challenges = GameChallenge.objects.filter(
             challenged=user,
             status='pending'
-        )
+        ).select_related('challenger', 'challenged')
         pending_challenges_data = GameChallengeSerializer(pending_challenges, many=True).data
         
         user_games = Game.objects.filter(
             Q(white_player=user) | Q(black_player=user),
             status__in=['completed', 'resigned']
-        ).order_by('-updated_at')[:10]
-        game_history_data = GameSerializer(user_games, many=True).data
+        ).select_related('white_player', 'black_player', 'winner').order_by('-updated_at', '-id')[:10]
+        game_history_data = GameSummarySerializer(user_games, many=True).data
         
         return {
-            "available_players": available_players_data,
             "pending_challenges": pending_challenges_data,
             "game_history": game_history_data
         }
 
+    @database_sync_to_async
+    def _get_lobby_data(self, user):
+        # get lobby data for the user
+        available_players = get_available_players(user)
+        available_players_data = UserSerializer(available_players, many=True).data
+        
+        return {
+            "available_players": available_players_data,
+            **self._get_private_data(user)
+        }
+
+
+def exclude_player(players_json, player_ids, offsets, user_id):
+    """Drop the viewer's own entry from an encoded lobby snapshot (see build_lobby_snapshot)"""
+    index = bisect.bisect_left(player_ids, user_id)
+    if index == len(player_ids) or player_ids[index] != user_id:
+        return players_json
+    start = offsets[index]
+    if index + 1 < len(offsets):
+        # the entry and the comma after it
+        end = offsets[index + 1]
+    else:
+        # the last entry and the comma before it, if any
+        end = len(players_json) - 1
+        if index:
+            start -= 1
+    return players_json[:start] + players_json[end:]
+
+
+class GameConsumer(SocketMetricsMixin, AsyncJsonWebsocketConsumer):
+    metrics_group = "game"
 
-class GameConsumer(AsyncJsonWebsocketConsumer):
     async def connect(self):
         user = self.scope.get("user")
         if user is None or user.is_anonymous:
@@ -76,29 +155,91 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
         self.game_id = self.scope["url_route"]["kwargs"]["game_id"]
         self.group_name = f"game_{self.game_id}"
 
-        if not await self._user_in_game(user.id, self.game_id):
+        seat = await self._get_seat(user.id, self.game_id)
+        if seat is None:
             await self.close()
             return
+        # colour of this socket's player and the last ply it has seen
+        self.color, self.ply = seat
+        # ?legal_moves=1 on the socket URL adds the legal move map to every update
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        self.legal_moves = wants_legal_moves(query.get("legal_moves", [""])[0])
 
         await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await sync_to_async(mark_socket_online)(user, self.channel_name)
+        get_broadcaster().attach_loop(asyncio.get_running_loop())
         await self.accept()
 
     async def disconnect(self, code):
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        await sync_to_async(mark_socket_offline)(self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        if not isinstance(content, dict):
+            # valid JSON that is not an object ([], "x", 1) is no message at all
+            await self.send_json({
+                "action": "move_rejected",
+                "data": {"id": None, "reason": "invalid_message", "error": "Messages must be JSON objects"}
+            })
+            return
+        action = content.get("action")
+        if action == "move":
+            await self._handle_move(content)
+        elif action == "resync":
+            # clients that lost track of the game ask for a resync, as a
+            # diff when they declare the ply they still hold
+            await self.game_refresh({"base_ply": parse_ply(content.get("base_ply"))})
+
+    async def _handle_move(self, content):
+        # moves over the open socket skip the HTTP round trip entirely
+        result = await self._apply_move(self.scope["user"], content)
+        if not result.ok:
+            await self.send_json({
+                "action": "move_rejected",
+                "data": {"id": content.get("id"), "reason": result.status, "error": result.error}
+            })
+            return
 
+        await self.send_json({
+            "action": "move_ack",
+            "data": {"id": content.get("id"), "ply": result.ply}
+        })
+        with FANOUT_SECONDS.time(group="game"):
+            await self.channel_layer.group_send(self.group_name, {"type": "game.move", "moves": [result.event]})
+
+    @timed_event("game.refresh")
     async def game_refresh(self, event):
         # send game state update
         user = self.scope.get("user")
         if user and not user.is_anonymous:
-            game_data = await self._get_game_data(user, self.game_id)
+            game_data = await self._get_game_data(user, self.game_id, event.get("base_ply"), self.legal_moves)
             if game_data:
+                self.ply = game_data["game"]["move_count"]
                 await self.send_json({
                     "action": "game_refresh",
                     "data": game_data
                 })
+
+    @timed_event("game.move")
+    async def game_move(self, event):
+        # send only the new move(s), falling back to a full refresh on a gap
+        for move in event["moves"]:
+            if move["ply"] <= self.ply:
+                continue
+            if move["ply"] != self.ply + 1:
+                await self.game_refresh(event)
+                return
+            self.ply = move["ply"]
+            data = {**move, "is_my_turn": move["current_turn"] == self.color}
+            if not self.legal_moves:
+                data.pop("legal_moves", None)
+            await self.send_json({
+                "action": "game_move",
+                "data": data
+            })
     
     @database_sync_to_async
-    def _get_game_data(self, user, game_id):
+    def _get_game_data(self, user, game_id, base_ply=None, legal_moves=False):
         # get game data for the user
         try:
             game = Game.objects.filter(
@@ -110,28 +251,14 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
             game_serializer = GameSerializer(game)
             game_data = game_serializer.data
             
-            board = game.get_board()
-            board_dict = board_to_dict(board, user, game)
-            is_my_turn = game.is_players_turn(user)
-            is_game_over = board.is_game_over()
-            result = None
-            
-            if is_game_over:
-                if board.is_checkmate():
-                    winner = 'Black' if board.turn else 'White'
-                    result = f'{winner} wins by checkmate!'
-                elif board.is_stalemate():
-                    result = 'Draw by stalemate!'
-                elif board.is_insufficient_material():
-                    result = 'Draw by insufficient material!'
-            
-            board_state_data = {
-                'board_dict': board_dict,
-                'current_turn': game.current_turn,
-                'is_my_turn': is_my_turn,
-                'is_game_over': is_game_over,
-                'result': result
-            }
+            with game.cached_board() as board:
+                base_pieces = pieces_at_ply(game, board, base_ply) if base_ply is not None else None
+                board_state_data = board_state(
+                    board, game.current_turn, game.is_players_turn(user),
+                    flipped=user.id == game.black_player_id,
+                    ply=game.move_count, base_ply=base_ply, base_pieces=base_pieces,
+                    legal_moves=legal_moves
+                )
             
             return {
                 "game": game_data,
@@ -141,9 +268,24 @@ class GameConsumer(AsyncJsonWebsocketConsumer):
             return None
 
     @database_sync_to_async
-    def _user_in_game(self, user_id, game_id):
-        return Game.objects.filter(
+    def _apply_move(self, user, content):
+        game = Game.objects.select_related('white_player', 'black_player').filter(id=self.game_id).first()
+        if game is None:
+            return MoveResult(MoveResult.NOT_ACTIVE, 'Game not found')
+        return apply_move(
+            game, user, content.get("from_square"), content.get("to_square"),
+            content.get("promotion"), broadcast=False
+        )
+
+    @database_sync_to_async
+    def _get_seat(self, user_id, game_id):
+        # (colour, move_count) for a player of the game, None for anyone else
+        game = Game.objects.filter(
             Q(id=game_id),
             Q(white_player_id=user_id) | Q(black_player_id=user_id),
-        ).exists()
+        ).values('white_player_id', 'move_count').first()
+        if game is None:
+            return None
+        color = 'white' if game['white_player_id'] == user_id else 'black'
+        return color, game['move_count']
 
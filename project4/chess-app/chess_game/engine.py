@@ -0,0 +1,299 @@
+"""
+Computer opponent for solo play.
+
+search() is an iterative-deepening negamax alpha-beta with a transposition
+table, MVV-LVA move ordering and a capture-only quiescence search, stopped
+by a time budget. It is plain python-chess with no Django access, so it runs
+in a ProcessPoolExecutor (see analyse) and a search never holds the event
+loop, the GIL of the serving process or a thread of the ORM pool.
+"""
+
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import chess
+import chess.polyglot
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+MATE = 100000
+PIECE_VALUES = {
+    chess.PAWN: 100, chess.KNIGHT: 320, chess.BISHOP: 330,
+    chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 0,
+}
+
+# piece-square tables from white's side, a8 first (the usual printed layout)
+_PST_ROWS = {
+    chess.PAWN: [
+        0, 0, 0, 0, 0, 0, 0, 0,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        10, 10, 20, 30, 30, 20, 10, 10,
+        5, 5, 10, 25, 25, 10, 5, 5,
+        0, 0, 0, 20, 20, 0, 0, 0,
+        5, -5, -10, 0, 0, -10, -5, 5,
+        5, 10, 10, -20, -20, 10, 10, 5,
+        0, 0, 0, 0, 0, 0, 0, 0,
+    ],
+    chess.KNIGHT: [
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20, 0, 0, 0, 0, -20, -40,
+        -30, 0, 10, 15, 15, 10, 0, -30,
+        -30, 5, 15, 20, 20, 15, 5, -30,
+        -30, 0, 15, 20, 20, 15, 0, -30,
+        -30, 5, 10, 15, 15, 10, 5, -30,
+        -40, -20, 0, 5, 5, 0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50,
+    ],
+    chess.BISHOP: [
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 10, 10, 5, 0, -10,
+        -10, 5, 5, 10, 10, 5, 5, -10,
+        -10, 0, 10, 10, 10, 10, 0, -10,
+        -10, 10, 10, 10, 10, 10, 10, -10,
+        -10, 5, 0, 0, 0, 0, 5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20,
+    ],
+    chess.ROOK: [
+        0, 0, 0, 0, 0, 0, 0, 0,
+        5, 10, 10, 10, 10, 10, 10, 5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        0, 0, 0, 5, 5, 0, 0, 0,
+    ],
+    chess.QUEEN: [
+        -20, -10, -10, -5, -5, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 5, 5, 5, 0, -10,
+        -5, 0, 5, 5, 5, 5, 0, -5,
+        0, 0, 5, 5, 5, 5, 0, -5,
+        -10, 5, 5, 5, 5, 5, 0, -10,
+        -10, 0, 5, 0, 0, 0, 0, -10,
+        -20, -10, -10, -5, -5, -10, -10, -20,
+    ],
+    chess.KING: [
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+        20, 20, 0, 0, 0, 0, 20, 20,
+        20, 30, 10, 0, 0, 10, 30, 20,
+    ],
+}
+# (piece type, color) -> value per square (a1 = 0), material included;
+# square ^ 56 flips the rank, black reads the white table mirrored
+PIECE_SQUARE = {
+    (piece_type, color): [
+        PIECE_VALUES[piece_type] + rows[square ^ 56 if color else square]
+        for square in chess.SQUARES
+    ]
+    for piece_type, rows in _PST_ROWS.items()
+    for color in chess.COLORS
+}
+
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class _Timeout(Exception):
+    pass
+
+
+def evaluate(board):
+    """Static score in centipawns from the side to move's point of view"""
+    score = 0
+    for square, piece in board.piece_map().items():
+        value = PIECE_SQUARE[piece.piece_type, piece.color][square]
+        score += value if piece.color else -value
+    return score if board.turn else -score
+
+
+class _Search:
+    def __init__(self, board, deadline):
+        self.board = board
+        self.deadline = deadline
+        self.nodes = 0
+        self.table = {}
+
+    def tick(self):
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and time.monotonic() > self.deadline:
+            raise _Timeout
+
+    def ordered(self, moves, first=None):
+        board = self.board
+
+        def key(move):
+            if move == first:
+                return -MATE
+            if board.is_capture(move):
+                victim = board.piece_type_at(move.to_square) or chess.PAWN
+                return -10 * PIECE_VALUES[victim] + board.piece_type_at(move.from_square)
+            return -PIECE_VALUES[move.promotion] if move.promotion else 0
+
+        return sorted(moves, key=key)
+
+    def quiesce(self, alpha, beta):
+        self.tick()
+        stand_pat = evaluate(self.board)
+        if stand_pat >= beta:
+            return stand_pat
+        alpha = max(alpha, stand_pat)
+        for move in self.ordered(self.board.generate_legal_captures()):
+            self.board.push(move)
+            score = -self.quiesce(-beta, -alpha)
+            self.board.pop()
+            if score >= beta:
+                return score
+            alpha = max(alpha, score)
+        return alpha
+
+    def negamax(self, depth, alpha, beta, ply):
+        self.tick()
+        board = self.board
+        if ply and (board.is_repetition(2) or board.halfmove_clock >= 100 or board.is_insufficient_material()):
+            return 0, None
+
+        key = chess.polyglot.zobrist_hash(board)
+        entry = self.table.get(key)
+        tt_move = None
+        if entry is not None:
+            entry_depth, entry_score, flag, tt_move = entry
+            if ply and entry_depth >= depth and (
+                flag == EXACT
+                or flag == LOWER and entry_score >= beta
+                or flag == UPPER and entry_score <= alpha
+            ):
+                return entry_score, tt_move
+
+        moves = list(board.legal_moves)
+        if not moves:
+            return (-MATE + ply if board.is_check() else 0), None
+        if depth <= 0:
+            return self.quiesce(alpha, beta), None
+
+        original_alpha = alpha
+        best_score, best_move = -MATE - 1, None
+        for move in self.ordered(moves, tt_move):
+            board.push(move)
+            score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)[0]
+            board.pop()
+            if score > best_score:
+                best_score, best_move = score, move
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+
+        if best_score <= original_alpha:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table[key] = (depth, best_score, flag, best_move)
+        return best_score, best_move
+
+
+def search(fen, time_limit=1.0, max_depth=64):
+    """Best move for the side to move in fen within about time_limit seconds.
+
+    Returns a dict with the move (UCI and SAN), its score in centipawns for
+    the side to move, the last fully searched depth, nodes visited, elapsed
+    seconds and nodes per second. move is None when the game is over.
+    A time_limit of None searches exactly to max_depth.
+    """
+    board = chess.Board(fen)
+    started = time.monotonic()
+    deadline = float('inf') if time_limit is None else started + time_limit
+    searcher = _Search(board, deadline)
+    best_move, depth_reached = None, 0
+    best_score = -MATE if board.is_checkmate() else 0
+
+    legal = list(board.legal_moves)
+    if legal:
+        best_move = legal[0]
+        for depth in range(1, max_depth + 1):
+            try:
+                score, move = searcher.negamax(depth, -MATE - 1, MATE + 1, 0)
+            except _Timeout:
+                # the unfinished iteration is discarded
+                while board.move_stack:
+                    board.pop()
+                break
+            if move is not None:
+                best_move, best_score, depth_reached = move, score, depth
+            if abs(score) >= MATE - max_depth:
+                break
+
+    elapsed = time.monotonic() - started
+    return {
+        'move': best_move.uci() if best_move else None,
+        'san': board.san(best_move) if best_move else None,
+        'score': best_score,
+        'depth': depth_reached,
+        'nodes': searcher.nodes,
+        'time': round(elapsed, 4),
+        'nps': round(searcher.nodes / elapsed) if elapsed > 0 else 0,
+    }
+
+
+def evaluate_fen(fen, depth):
+    """Fixed-depth evaluation of fen: (centipawns for white, best move UCI or None)"""
+    result = search(fen, time_limit=None, max_depth=depth)
+    white_to_move = fen.split()[1] == 'w'
+    return result['score'] if white_to_move else -result['score'], result['move']
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """The process's shared search pool, None when ENGINE_WORKERS is 0"""
+    global _pool
+    workers = getattr(settings, 'ENGINE_WORKERS', 2)
+    if workers <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawned workers do not inherit the server's threads or sockets
+            _pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+async def analyse(fen, time_limit=None):
+    """Await search() on the pool (on a worker thread without one)"""
+    if time_limit is None:
+        time_limit = getattr(settings, 'ENGINE_TIME_LIMIT', 1.0)
+    max_depth = getattr(settings, 'ENGINE_MAX_DEPTH', 64)
+    pool = get_pool()
+    if pool is None:
+        return await sync_to_async(search, thread_sensitive=False)(fen, time_limit, max_depth)
+    return await asyncio.wrap_future(pool.submit(search, fen, time_limit, max_depth))
+
+
+async def evaluate_many(fens, depth):
+    """Await evaluate_fen() for every fen, spread over the pool's processes"""
+    pool = get_pool()
+    if pool is None:
+        return await sync_to_async(
+            lambda: [evaluate_fen(fen, depth) for fen in fens], thread_sensitive=False
+        )()
+    return await asyncio.gather(*(
+        asyncio.wrap_future(pool.submit(evaluate_fen, fen, depth)) for fen in fens
+    ))
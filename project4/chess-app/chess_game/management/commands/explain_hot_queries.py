@@ -0,0 +1,64 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+
+from chess_game.models import ActivePlayer, Game, GameChallenge, Move
+
+
+def hot_queries(user, opponent):
+    """(label, queryset) for every query on a request or websocket hot path"""
+    players = Q(white_player=user) | Q(black_player=user)
+    # services.get_available_players with fixed ids instead of the presence registry
+    seated = ActivePlayer.objects.filter(user=OuterRef('pk'))
+    available = User.objects.filter(id__in=[2, 3]).exclude(Exists(seated))
+    return [
+        ('active game of a player', Game.objects.filter(players, status='active').order_by('pk')[:1]),
+        ('available players', available),
+        ('finished games page', Game.objects.filter(
+            players, status__in=['completed', 'resigned']
+        ).order_by('-updated_at', '-id')[:21]),
+        ('game list page', Game.objects.filter(players).order_by('-updated_at', '-id')[:21]),
+        ('pending challenges', GameChallenge.objects.filter(challenged=user, status='pending')),
+        ('existing challenge', GameChallenge.objects.filter(
+            challenger=user, challenged=opponent, status='pending'
+        )[:1]),
+        ('moves of a game', Move.objects.filter(game_id=1).order_by('id')),
+    ]
+
+
+def added_index_names():
+    # everything added by 0002_hot_query_indexes, partial unique constraints are indexes in SQLite
+    return [
+        item.name
+        for model in (Game, GameChallenge)
+        for item in model._meta.indexes + model._meta.constraints
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Print the SQLite query plan of each hot query without and with the 0002 indexes'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN output is only supported on SQLite')
+
+        user, opponent = User(pk=1), User(pk=2)
+        with transaction.atomic():
+            # drop the indexes inside a transaction that is rolled back afterwards
+            with connection.cursor() as cursor:
+                for name in added_index_names():
+                    cursor.execute(f'DROP INDEX IF EXISTS "{name}"')
+            before = [queryset.explain() for _, queryset in hot_queries(user, opponent)]
+            transaction.set_rollback(True)
+        after = [queryset.explain() for _, queryset in hot_queries(user, opponent)]
+
+        for (label, _), plan_before, plan_after in zip(hot_queries(user, opponent), before, after):
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            self.stdout.write('  before:')
+            self.stdout.write(self._indent(plan_before))
+            self.stdout.write('  after:')
+            self.stdout.write(self._indent(plan_after))
+
+    def _indent(self, plan):
+        return '\n'.join(f'    {line}' for line in plan.splitlines())
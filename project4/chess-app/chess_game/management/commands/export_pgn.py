@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from chess_game.models import Game
+from chess_game.pgn import iter_pgn
+
+
+class Command(BaseCommand):
+    help = 'Write every finished game as PGN, streaming so memory stays flat'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-o', '--output', help='File to write to (default: stdout)')
+        parser.add_argument('--user', help='Only games played by this username')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Rows fetched per database round trip')
+
+    def handle(self, *args, **options):
+        games = Game.objects.all()
+        if options['user']:
+            games = games.filter(
+                Q(white_player__username=options['user']) | Q(black_player__username=options['user'])
+            )
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as out:
+                count = self.export(games, out.write, options['chunk_size'])
+        else:
+            count = self.export(games, lambda text: self.stdout.write(text, ending=''), options['chunk_size'])
+        self.stderr.write(f'Exported {count} games')
+
+    def export(self, games, write, chunk_size):
+        count = 0
+        for text in iter_pgn(games, chunk_size=chunk_size):
+            write(text)
+            count += 1
+        return count
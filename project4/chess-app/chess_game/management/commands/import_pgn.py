@@ -0,0 +1,160 @@
+import functools
+import itertools
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from chess_game.models import Game, Move, PositionIndex
+from chess_game.pgn import parse_game, split_games
+from chess_game.positions import index_rows
+from chess_game.replay import checkpoint_interval
+
+
+# imported players live under this prefix, in accounts that cannot log in
+IMPORTED_PREFIX = 'pgn-'
+validate_username = UnicodeUsernameValidator()
+
+
+def imported_username(name, suffix=''):
+    """Username of the account standing for a PGN player name, e.g. "Carlsen, Magnus" -> pgn-Carlsen-Magnus"""
+    slug = re.sub(r'[^\w.@+-]+', '-', name).strip('-') or 'unknown'
+    username = IMPORTED_PREFIX + slug[:150 - len(IMPORTED_PREFIX) - len(suffix)] + suffix
+    validate_username(username)
+    return username
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = 'Import finished games from a PGN file, parsed in worker processes and written in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='PGN file to import')
+        parser.add_argument('--batch-size', type=int, default=500, help='Games per transaction')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Parser processes (0 parses in this process)'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        self.users = {}
+        self.store_move_rows = getattr(settings, 'STORE_MOVE_ROWS', True)
+        imported = skipped = moves = 0
+        started = time.monotonic()
+
+        parse = functools.partial(parse_game, checkpoint_interval=checkpoint_interval())
+        pool = None
+        if options['workers']:
+            # spawned workers set Django up before they import chess_game.pgn to run parse_game
+            pool = ProcessPoolExecutor(
+                options['workers'], mp_context=multiprocessing.get_context('spawn'), initializer=django.setup
+            )
+        try:
+            with open(options['path'], encoding='utf-8', errors='replace') as pgn_file:
+                for texts in batches(split_games(pgn_file), options['batch_size']):
+                    if pool is None:
+                        parsed = [parse(text) for text in texts]
+                    else:
+                        chunksize = max(1, len(texts) // (options['workers'] * 4))
+                        parsed = list(pool.map(parse, texts, chunksize=chunksize))
+                    valid = [data for data in parsed if data is not None]
+                    skipped += len(parsed) - len(valid)
+                    moves += self.write_batch(valid)
+                    imported += len(valid)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        elapsed = max(time.monotonic() - started, 1e-9)
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} games ({moves} moves), skipped {skipped} invalid, in {elapsed:.2f}s: '
+            f'{imported / elapsed:.1f} games/s, {moves / elapsed:.1f} moves/s'
+        ))
+
+    def write_batch(self, games):
+        """Create the players, games, (optional) Move rows and positions of one batch in one transaction"""
+        with transaction.atomic():
+            players = self.get_players({data['white'] for data in games} | {data['black'] for data in games})
+            rows = Game.objects.bulk_create([
+                Game(
+                    white_player=players[data['white']],
+                    black_player=players[data['black']],
+                    board_state=data['board_state'],
+                    current_turn=data['current_turn'],
+                    status='completed',
+                    outcome=data['outcome'],
+                    winner=(
+                        players[data['white']] if data['outcome'] == 'white_wins'
+                        else players[data['black']] if data['outcome'] == 'black_wins'
+                        else None
+                    ),
+                    move_count=data['move_count'],
+                    packed_moves=data['packed_moves'],
+                    checkpoints=data['checkpoints'],
+                )
+                for data in games
+            ])
+            if self.store_move_rows:
+                Move.objects.bulk_create([
+                    Move(
+                        game=game,
+                        player=players[data['white'] if ply % 2 == 0 else data['black']],
+                        from_square=uci[:2],
+                        to_square=uci[2:4],
+                        piece=piece,
+                        notation=uci,
+                    )
+                    for game, data in zip(rows, games)
+                    for ply, (uci, piece) in enumerate(data['moves'])
+                ], batch_size=2000)
+            PositionIndex.objects.bulk_create([
+                row for game, data in zip(rows, games) for row in index_rows(game.id, data['positions'])
+            ], batch_size=2000)
+        return sum(data['move_count'] for data in games)
+
+    def get_players(self, names):
+        """{PGN name: user}, never attaching games to a registered account"""
+        missing = names - self.users.keys()
+        if not missing:
+            return self.users
+        usernames = {name: imported_username(name) for name in missing}
+        accounts = {user.username: user for user in User.objects.filter(username__in=usernames.values())}
+        new = {}
+        for name, username in usernames.items():
+            user = accounts.get(username) or new.get(username)
+            if user is None:
+                user = new[username] = User(username=username)
+                user.set_unusable_password()
+            elif user.has_usable_password():
+                user = self.unclaimed_account(name)
+            self.users[name] = user
+        User.objects.bulk_create(new.values())
+        return self.users
+
+    def unclaimed_account(self, name):
+        # someone registered the prefixed name, so the import numbers its own account
+        for number in itertools.count(2):
+            username = imported_username(name, f'-{number}')
+            user = User.objects.filter(username=username).first()
+            if user is None:
+                user = User(username=username)
+                user.set_unusable_password()
+                user.save()
+                return user
+            if not user.has_usable_password():
+                return user
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from chess_game.models import Game, PositionIndex
+from chess_game.packing import unpack_moves
+from chess_game.positions import game_position_keys, index_rows
+
+
+class Command(BaseCommand):
+    help = 'Fill the position index for stored games that are not indexed yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Drop and rebuild the whole index')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Games per transaction')
+
+    def handle(self, *args, **options):
+        games = Game.objects.filter(move_count__gt=0)
+        if options['rebuild']:
+            PositionIndex.objects.all().delete()
+        else:
+            # apply_move indexes new plies of a game that is not backfilled yet, but
+            # only its first move writes ply 0; the conflicting rows are skipped
+            games = games.exclude(Exists(PositionIndex.objects.filter(game=OuterRef('pk'), ply=0)))
+
+        rows = []
+        indexed = 0
+        for game in games.only('id', 'packed_moves').iterator(chunk_size=options['chunk_size']):
+            rows.extend(index_rows(game.id, game_position_keys(unpack_moves(game.packed_moves))))
+            indexed += 1
+            if indexed % options['chunk_size'] == 0:
+                self.write(rows)
+                rows = []
+        self.write(rows)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} games'))
+
+    def write(self, rows):
+        with transaction.atomic():
+            PositionIndex.objects.bulk_create(rows, batch_size=2000, ignore_conflicts=True)
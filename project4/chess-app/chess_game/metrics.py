@@ -0,0 +1,301 @@
+"""
+In-process metrics, scraped at /metrics in the Prometheus text format.
+
+Counters, gauges and histograms live in one registry per server process and
+are fed by:
+
+- MetricsMiddleware: latency and database queries of every HTTP request,
+  labelled by the name of the view it resolved to;
+- the consumers: open sockets per group (lobby or game) and the time each
+  channel-layer event handler takes to send to its socket;
+- the broadcaster: time to build and fan out one group message;
+- database_sync_to_async below: how long a consumer's ORM call waits for
+  the database thread before it starts.
+
+With several Daphne workers each process serves its own numbers, so scrape
+every worker port. Scrapes need METRICS_TOKEN as a bearer token; without a
+token the endpoint is only served with DEBUG on.
+"""
+
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from channels.db import database_sync_to_async as _database_sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# any other verb a client sends is counted as "other", so it cannot add series
+HTTP_METHODS = frozenset({'GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'HEAD', 'OPTIONS'})
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Metric {metric.name} is already registered')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            for metric in self._metrics.values():
+                metric.reset()
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError(f'{self.name} takes labels {self.labels}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _format(self, name, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return name
+        return '%s{%s}' % (name, ','.join(f'{label}="{_escape(value)}"' for label, value in pairs))
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self._format(self.name, key)} {_number(value)}' for key, value in values]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(float(bound) for bound in buckets))
+        super().__init__(name, documentation, labels, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # per-bucket counts (the last one is +Inf), then sum and count
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent in the with block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        series = self._values.get(self._key(labels))
+        return series[2] if series else 0
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, list(counts), total, count) for key, (counts, total, count) in self._values.items())
+        lines = []
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{self._format(self.name + "_bucket", key, [("le", _number(bound))])} {cumulative}')
+            lines.append(f'{self._format(self.name + "_sum", key)} {_number(total)}')
+            lines.append(f'{self._format(self.name + "_count", key)} {count}')
+        return lines
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REQUEST_SECONDS = Histogram(
+    'chess_http_request_duration_seconds', 'HTTP request latency by view', ['route', 'method']
+)
+REQUEST_QUERIES = Histogram(
+    'chess_http_request_queries', 'Database queries per HTTP request by view', ['route', 'method'],
+    buckets=QUERY_BUCKETS,
+)
+RESPONSES = Counter('chess_http_responses_total', 'HTTP responses by view and status', ['route', 'status'])
+OPEN_SOCKETS = Gauge('chess_websocket_open_sockets', 'Open websockets per group', ['group'])
+EVENT_SECONDS = Histogram(
+    'chess_websocket_event_seconds', 'Time a consumer takes to handle and send one event', ['event']
+)
+FANOUT_SECONDS = Histogram(
+    'chess_broadcast_fanout_seconds', 'Time to build and send one message to a group', ['group']
+)
+DB_QUEUE_SECONDS = Histogram(
+    'chess_database_sync_to_async_wait_seconds',
+    'Time a consumer database call waits for the database thread before running',
+)
+
+# [queries] of the request being served; copied into sync_to_async threads
+_request_queries = ContextVar('request_queries', default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    """Connection execute wrapper counting queries for MetricsMiddleware"""
+    counter = _request_queries.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def group_label(group):
+    """Group family for labels, so game_12 and game_13 share one series"""
+    return group.split('_', 1)[0]
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self._acall(request)
+        queries = [0]
+        token = _request_queries.set(queries)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+        self._record(request, response, time.perf_counter() - started, queries[0])
+        return response
+
+    async def _acall(self, request):
+        queries = [0]
+        token = _request_queries.set(queries)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+        self._record(request, response, time.perf_counter() - started, queries[0])
+        return response
+
+    def _record(self, request, response, seconds, queries):
+        match = getattr(request, 'resolver_match', None)
+        # labels are bounded: view names, not paths, and the standard methods
+        route = match.view_name if match is not None and match.view_name else 'other'
+        method = request.method if request.method in HTTP_METHODS else 'other'
+        REQUEST_SECONDS.observe(seconds, route=route, method=method)
+        REQUEST_QUERIES.observe(queries, route=route, method=method)
+        RESPONSES.inc(route=route, status=response.status_code)
+
+
+def timed_event(event):
+    """Record the run time of a consumer's channel-layer event handler"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def timed(self, *args, **kwargs):
+            with EVENT_SECONDS.time(event=event):
+                return await handler(self, *args, **kwargs)
+        return timed
+    return decorator
+
+
+def database_sync_to_async(func):
+    """channels' database_sync_to_async, also recording the wait for the database thread.
+
+    Like the SyncToAsync it wraps, the result keeps the plain function as .func.
+    """
+    def run(queued, *args, **kwargs):
+        DB_QUEUE_SECONDS.observe(time.perf_counter() - queued)
+        return func(*args, **kwargs)
+
+    run_in_thread = _database_sync_to_async(run)
+
+    @functools.wraps(func)
+    async def call(*args, **kwargs):
+        return await run_in_thread(time.perf_counter(), *args, **kwargs)
+
+    call.func = func
+    return call
+
+
+def metrics_view(request):
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if not token and not settings.DEBUG:
+        return HttpResponse('Not Found', status=404, content_type='text/plain')
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    return HttpResponse(REGISTRY.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.25 on 2026-10-17 07:30
+
+import logging
+
+from django.db import migrations, models
+
+logger = logging.getLogger(__name__)
+
+
+def close_duplicate_active_games(apps, schema_editor):
+    # keep each player's newest active game per colour so the constraints can be created;
+    # the others end as aborted (no winner), and each one is logged
+    Game = apps.get_model('chess_game', 'Game')
+    for seat in ('white_player', 'black_player'):
+        seen = set()
+        for game in Game.objects.filter(status='active').order_by('-updated_at', '-id'):
+            player_id = getattr(game, f'{seat}_id')
+            if player_id in seen:
+                logger.warning('Aborting game %s: player %s has a newer active game', game.pk, player_id)
+                Game.objects.filter(pk=game.pk).update(status='completed', outcome='aborted')
+            else:
+                seen.add(player_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_game', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['white_player', 'status', 'updated_at'], name='game_white_status_updated'),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['black_player', 'status', 'updated_at'], name='game_black_status_updated'),
+        ),
+        migrations.AddIndex(
+            model_name='gamechallenge',
+            index=models.Index(fields=['challenged', 'status'], name='challenge_challenged_status'),
+        ),
+        migrations.AddIndex(
+            model_name='gamechallenge',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['challenger', 'challenged'], name='challenge_pending_pair'),
+        ),
+        migrations.RunPython(close_duplicate_active_games, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='game',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'active')), fields=('white_player',), name='one_active_game_as_white'),
+        ),
+        migrations.AddConstraint(
+            model_name='game',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'active')), fields=('black_player',), name='one_active_game_as_black'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 4.2.25 on 2026-10-17 07:32
+
+import struct
+
+import chess
+from django.db import migrations, models
+
+# frozen copies of chess_game.packing as of this migration, so later changes
+# to the live helpers cannot change what it writes
+PROMOTIONS = [None, chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN]
+
+
+def pack_moves(moves):
+    codes = [move.from_square | move.to_square << 6 | PROMOTIONS.index(move.promotion) << 12 for move in moves]
+    return struct.pack(f'<{len(codes)}H', *codes)
+
+
+def encode_varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def pack_times(start, timestamps):
+    out = bytearray()
+    previous = start
+    for timestamp in timestamps:
+        out += encode_varint(max(0, round((timestamp - previous).total_seconds() * 1000)))
+        previous = max(previous, timestamp)
+    return bytes(out)
+
+
+def backfill_packed_moves(apps, schema_editor):
+    Game = apps.get_model('chess_game', 'Game')
+    Move = apps.get_model('chess_game', 'Move')
+    for game in Game.objects.filter(move_count__gt=0).iterator():
+        rows = list(Move.objects.filter(game=game).order_by('id').values_list('notation', 'timestamp'))
+        Game.objects.filter(pk=game.pk).update(
+            packed_moves=pack_moves([chess.Move.from_uci(notation) for notation, _ in rows]),
+            packed_times=pack_times(game.created_at, [timestamp for _, timestamp in rows]),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_game', '0002_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='packed_moves',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='packed_times',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.RunPython(backfill_packed_moves, migrations.RunPython.noop),
+    ]
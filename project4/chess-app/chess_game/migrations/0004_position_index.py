@@ -0,0 +1,30 @@
+# Generated by Django 4.2.25 on 2026-10-17 07:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_game', '0003_packed_moves'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PositionIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zobrist', models.BigIntegerField()),
+                ('ply', models.PositiveIntegerField()),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='positions', to='chess_game.game')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['zobrist', 'game'], name='position_zobrist_game')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='positionindex',
+            constraint=models.UniqueConstraint(fields=('game', 'ply'), name='one_position_per_ply'),
+        ),
+    ]
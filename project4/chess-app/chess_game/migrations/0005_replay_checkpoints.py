@@ -0,0 +1,53 @@
+# Generated by Django 4.2.25 on 2026-10-17 07:38
+
+import struct
+
+import chess
+from django.conf import settings
+from django.db import migrations, models
+
+# frozen copies of chess_game.packing and chess_game.replay as of this migration
+PROMOTIONS = [None, chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN]
+
+
+def unpack_moves(data):
+    data = bytes(data or b'')
+    return [
+        chess.Move(code & 0x3f, code >> 6 & 0x3f, PROMOTIONS[code >> 12 & 0x7])
+        for code in struct.unpack(f'<{len(data) // 2}H', data)
+    ]
+
+
+def build_checkpoints(moves):
+    interval = max(1, getattr(settings, 'REPLAY_CHECKPOINT_INTERVAL', 16))
+    board = chess.Board()
+    checkpoints = []
+    for ply, move in enumerate(moves, start=1):
+        board.push(move)
+        if ply % interval == 0:
+            checkpoints.append(f'{ply} {board.fen()}\n')
+    return ''.join(checkpoints)
+
+
+def backfill_checkpoints(apps, schema_editor):
+    Game = apps.get_model('chess_game', 'Game')
+    for game in Game.objects.filter(move_count__gt=0).only('id', 'packed_moves').iterator():
+        Game.objects.filter(pk=game.pk).update(
+            checkpoints=build_checkpoints(unpack_moves(game.packed_moves))
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_game', '0004_position_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='checkpoints',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.RunPython(backfill_checkpoints, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.25 on 2026-10-17 07:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chess_game', '0005_replay_checkpoints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PositionEvaluation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zobrist', models.BigIntegerField()),
+                ('depth', models.PositiveSmallIntegerField()),
+                ('score', models.IntegerField()),
+                ('best_move', models.CharField(blank=True, max_length=5)),
+                ('last_used', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='positionevaluation',
+            constraint=models.UniqueConstraint(fields=('zobrist', 'depth'), name='one_evaluation_per_depth'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.25 on 2026-10-17 08:04
+
+import logging
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+logger = logging.getLogger(__name__)
+
+
+def seat_active_players(apps, schema_editor):
+    # seat the players of each player's newest active game; abort the older ones,
+    # where a player was also in another game as the other colour
+    Game = apps.get_model('chess_game', 'Game')
+    ActivePlayer = apps.get_model('chess_game', 'ActivePlayer')
+    seated = set()
+    for game in Game.objects.filter(status='active').order_by('-updated_at', '-id'):
+        players = {game.white_player_id, game.black_player_id}
+        if players & seated:
+            logger.warning('Aborting game %s: a player is also in a newer active game', game.pk)
+            Game.objects.filter(pk=game.pk).update(status='completed', outcome='aborted')
+            continue
+        seated |= players
+        ActivePlayer.objects.bulk_create([ActivePlayer(user_id=player, game_id=game.pk) for player in players])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('chess_game', '0006_position_evaluation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='game',
+            name='outcome',
+            field=models.CharField(blank=True, choices=[('white_wins', 'White Wins'), ('black_wins', 'Black Wins'), ('draw', 'Draw'), ('white_resigned', 'White Resigned'), ('black_resigned', 'Black Resigned'), ('aborted', 'Aborted')], max_length=15, null=True),
+        ),
+        migrations.CreateModel(
+            name='ActivePlayer',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='active_seat', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='active_players', to='chess_game.game')),
+            ],
+        ),
+        migrations.RunPython(seat_active_players, migrations.RunPython.noop),
+    ]
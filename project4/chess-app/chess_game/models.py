@@ -16,6 +16,7 @@ class Game(models.Model):
         ('draw', 'Draw'),
         ('white_resigned', 'White Resigned'),
         ('black_resigned', 'Black Resigned'),
+        ('aborted', 'Aborted'),
     ]
     
     white_player = models.ForeignKey(User, on_delete=models.CASCADE, related_name='white_games')
@@ -28,6 +29,27 @@ class Game(models.Model):
     outcome = models.CharField(max_length=15, choices=OUTCOME_CHOICES, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # every move as a 16-bit code and its time as a varint delta, see packing.py
+    packed_moves = models.BinaryField(default=b'', editable=False)
+    packed_times = models.BinaryField(default=b'', editable=False)
+    # "<ply> <fen>" lines every REPLAY_CHECKPOINT_INTERVAL plies, see replay.py
+    checkpoints = models.TextField(default='', editable=False)
+    
+    class Meta:
+        indexes = [
+            # a player's games by status, newest first (history, game lists)
+            models.Index(fields=['white_player', 'status', 'updated_at'], name='game_white_status_updated'),
+            models.Index(fields=['black_player', 'status', 'updated_at'], name='game_black_status_updated'),
+        ]
+        constraints = [
+            # indexes behind get_active_game; ActivePlayer covers a player in both colours
+            models.UniqueConstraint(
+                fields=['white_player'], condition=models.Q(status='active'), name='one_active_game_as_white'
+            ),
+            models.UniqueConstraint(
+                fields=['black_player'], condition=models.Q(status='active'), name='one_active_game_as_black'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.white_player.username} vs {self.black_player.username} - {self.status}"
@@ -36,6 +58,11 @@ class Game(models.Model):
         """Get python-chess board object from FEN string"""
         return chess.Board(self.board_state)
     
+    def cached_board(self):
+        """Context manager yielding the shared, cached board for this game"""
+        from .board_cache import board_cache
+        return board_cache.borrow(self)
+    
     def update_board(self, board):
         """Update board state from python-chess board object"""
         self.board_state = board.fen()
@@ -58,6 +85,20 @@ class Game(models.Model):
         return None
 
 
+class ActivePlayer(models.Model):
+    """A player seated in an active game.
+
+    The user is the primary key, so a player can be in one active game at a
+    time whatever their colour. start_game writes both rows in the game's
+    transaction and finishing a game deletes them.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='active_seat')
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='active_players')
+
+    def __str__(self):
+        return f"{self.user_id} in game {self.game_id}"
+
+
 class GameChallenge(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -71,6 +112,16 @@ class GameChallenge(models.Model):
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['challenged', 'status'], name='challenge_challenged_status'),
+            # only pending challenges are looked up by challenger
+            models.Index(
+                fields=['challenger', 'challenged'], condition=models.Q(status='pending'),
+                name='challenge_pending_pair'
+            ),
+        ]
+    
     def __str__(self):
         return f"{self.challenger.username} challenges {self.challenged.username} - {self.status}"
 
@@ -85,4 +136,48 @@ class Move(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
-        return f"{self.game} - {self.notation} by {self.player.username}"
\ No newline at end of file
+        return f"{self.game} - {self.notation} by {self.player.username}"
+
+
+class PositionIndex(models.Model):
+    """One row per position reached in a game, keyed by its Zobrist hash.
+
+    The hash is python-chess's polyglot hash stored as a signed 64-bit
+    integer; see positions.py.
+    """
+    zobrist = models.BigIntegerField()
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='positions')
+    ply = models.PositiveIntegerField()  # 0 is the starting position
+
+    class Meta:
+        indexes = [
+            # covers "games that reached a position" without touching the table
+            models.Index(fields=['zobrist', 'game'], name='position_zobrist_game'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['game', 'ply'], name='one_position_per_ply'),
+        ]
+
+    def __str__(self):
+        return f"{self.game_id} ply {self.ply}: {self.zobrist:x}"
+
+
+class PositionEvaluation(models.Model):
+    """Engine evaluation of one position at one search depth, shared by every game.
+
+    Keyed like PositionIndex by the signed Zobrist hash; last_used drives
+    eviction once the table outgrows EVALUATION_CACHE_SIZE (see analysis.py).
+    """
+    zobrist = models.BigIntegerField()
+    depth = models.PositiveSmallIntegerField()
+    score = models.IntegerField()  # centipawns for white
+    best_move = models.CharField(max_length=5, blank=True)
+    last_used = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['zobrist', 'depth'], name='one_evaluation_per_depth'),
+        ]
+
+    def __str__(self):
+        return f"{self.zobrist:x} depth {self.depth}: {self.score}"
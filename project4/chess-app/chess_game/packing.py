@@ -0,0 +1,118 @@
+"""
+Compact per-game move storage.
+
+A game's moves live in Game.packed_moves as little-endian 16-bit codes
+(from square | to square << 6 | promotion << 12) and their times in
+Game.packed_times as varint millisecond deltas, each from the previous move
+and the first from the game's creation. Reading a whole game is then one
+row fetch instead of a join per ply.
+"""
+
+import struct
+from datetime import timedelta
+
+import chess
+
+# promotion code -> piece type, 0 is no promotion
+PROMOTIONS = [None, chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN]
+
+
+def encode_move(move):
+    return move.from_square | move.to_square << 6 | PROMOTIONS.index(move.promotion) << 12
+
+
+def decode_move(code):
+    return chess.Move(code & 0x3f, code >> 6 & 0x3f, PROMOTIONS[code >> 12 & 0x7])
+
+
+def pack_moves(moves):
+    return struct.pack(f'<{len(moves)}H', *(encode_move(move) for move in moves))
+
+
+def unpack_moves(data):
+    data = bytes(data or b'')
+    return [decode_move(code) for code in struct.unpack(f'<{len(data) // 2}H', data)]
+
+
+def encode_varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def decode_varints(data):
+    values = []
+    value = shift = 0
+    for byte in bytes(data or b''):
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+    return values
+
+
+def pack_times(start, timestamps):
+    """Varint deltas in milliseconds for timestamps, the first one from start"""
+    out = bytearray()
+    previous = start
+    for timestamp in timestamps:
+        out += encode_varint(max(0, round((timestamp - previous).total_seconds() * 1000)))
+        previous = max(previous, timestamp)
+    return bytes(out)
+
+
+def unpack_times(start, data):
+    timestamps = []
+    current = start
+    for delta in decode_varints(data):
+        current += timedelta(milliseconds=delta)
+        timestamps.append(current)
+    return timestamps
+
+
+def appended(game, move, timestamp):
+    """New (packed_moves, packed_times) values for game after move at timestamp.
+
+    apply_move stores each move's time as the game's updated_at, so the
+    previous move's time is read from there instead of decoding every delta.
+    The delta is taken between millisecond offsets from created_at, which
+    keeps rounding from accumulating over a long game.
+    """
+    previous = game.updated_at if game.packed_times else game.created_at
+    delta = _offset_ms(game, timestamp) - _offset_ms(game, previous)
+    return (
+        bytes(game.packed_moves or b'') + pack_moves([move]),
+        bytes(game.packed_times or b'') + encode_varint(max(0, delta)),
+    )
+
+
+def _offset_ms(game, timestamp):
+    return round((timestamp - game.created_at).total_seconds() * 1000)
+
+
+def game_moves(game):
+    """Move dicts for a game (the shape MoveSerializer used to give), from the packed columns"""
+    board = chess.Board()
+    times = unpack_times(game.created_at, game.packed_times)
+    moves = []
+    for ply, move in enumerate(unpack_moves(game.packed_moves)):
+        piece = board.piece_at(move.from_square)
+        moves.append({
+            'ply': ply + 1,
+            'player': game.white_player if ply % 2 == 0 else game.black_player,
+            'from_square': chess.SQUARE_NAMES[move.from_square],
+            'to_square': chess.SQUARE_NAMES[move.to_square],
+            'piece': piece.symbol() if piece else '',
+            'notation': move.uci(),
+            'timestamp': times[ply] if ply < len(times) else None,
+        })
+        board.push(move)
+    return moves
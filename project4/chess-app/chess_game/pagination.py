@@ -0,0 +1,88 @@
+"""
+Keyset pagination for game lists.
+
+Pages are ordered newest first on (updated_at, id) and the cursor is the
+key of the last game on the previous page, so fetching page N costs the
+same as fetching page 1 and a game finishing meanwhile never shifts rows
+between pages the way OFFSET does.
+"""
+
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class GameKeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 20
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by('-updated_at', '-id')
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            updated_at, game_id = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(updated_at__lt=updated_at) | Q(updated_at=updated_at, id__lt=game_id)
+            )
+
+        # one extra row tells whether there is a next page
+        page = list(queryset[:self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        self.page = page[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def encode_cursor(self, game):
+        key = json.dumps([game.updated_at.isoformat(), game.id], separators=(',', ':'))
+        return base64.urlsafe_b64encode(key.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            updated_at, game_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            updated_at = parse_datetime(updated_at)
+            game_id = int(game_id)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if updated_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return updated_at, game_id
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
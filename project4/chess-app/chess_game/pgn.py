@@ -0,0 +1,149 @@
+"""
+PGN export and import of games.
+
+Exports read games with QuerySet.iterator(), so only one chunk of rows is
+held at a time, and each game is turned into PGN text on its own from the
+packed moves in its row. Memory use does not depend on how many games are
+exported. Under ASGI, Django buffers a plain iterator given to a
+StreamingHttpResponse, so the API streams aiter_pgn instead.
+
+Imports split the input into per-game texts without parsing it
+(split_games) and parse each text with parse_game, which has no database
+access and can run in worker processes.
+"""
+
+import io
+import itertools
+
+import chess
+import chess.pgn
+from asgiref.sync import sync_to_async
+
+from .models import Game
+from .packing import pack_moves, unpack_moves
+from .positions import position_key
+from .replay import checkpoint_due
+
+FINISHED = ['completed', 'resigned']
+
+RESULTS = {
+    'white_wins': '1-0',
+    'black_resigned': '1-0',
+    'black_wins': '0-1',
+    'white_resigned': '0-1',
+    'draw': '1/2-1/2',
+}
+OUTCOMES = {'1-0': 'white_wins', '0-1': 'black_wins', '1/2-1/2': 'draw'}
+
+
+def game_to_pgn(game):
+    """PGN text for a game, SAN rebuilt from its packed moves"""
+    pgn_game = chess.pgn.Game()
+    pgn_game.headers['Event'] = 'Multiplayer Chess'
+    pgn_game.headers['Site'] = '?'
+    pgn_game.headers['Date'] = game.created_at.strftime('%Y.%m.%d')
+    pgn_game.headers['Round'] = '-'
+    pgn_game.headers['White'] = game.white_player.username
+    pgn_game.headers['Black'] = game.black_player.username
+    pgn_game.headers['Result'] = RESULTS.get(game.outcome, '*')
+    if game.status == 'resigned':
+        pgn_game.headers['Termination'] = 'resignation'
+    pgn_game.add_line(unpack_moves(game.packed_moves))
+
+    exporter = chess.pgn.StringExporter(headers=True, variations=False, comments=False)
+    return pgn_game.accept(exporter) + '\n\n'
+
+
+def finished_games(queryset=None):
+    queryset = Game.objects.all() if queryset is None else queryset
+    return (
+        queryset.filter(status__in=FINISHED)
+        .select_related('white_player', 'black_player')
+        .only(
+            'id', 'status', 'outcome', 'created_at', 'packed_moves',
+            'white_player__username', 'black_player__username'
+        )
+        .order_by('id')
+    )
+
+
+def iter_pgn(queryset=None, chunk_size=500):
+    """Yield PGN text for every finished game in queryset, one game at a time"""
+    for game in finished_games(queryset).iterator(chunk_size=chunk_size):
+        yield game_to_pgn(game)
+
+
+async def aiter_pgn(queryset=None, chunk_size=500):
+    """iter_pgn for ASGI responses, rendering one chunk of games at a time in a thread"""
+    games = iter_pgn(queryset, chunk_size)
+    next_chunk = sync_to_async(lambda: ''.join(itertools.islice(games, chunk_size)))
+    while True:
+        text = await next_chunk()
+        if not text:
+            return
+        yield text
+
+
+def split_games(lines):
+    """Yield the raw text of each game in an iterable of PGN lines"""
+    buffer = []
+    in_movetext = False
+    for line in lines:
+        if line.startswith('[') and in_movetext:
+            yield ''.join(buffer)
+            buffer = []
+            in_movetext = False
+        elif line.strip() and not line.startswith(('[', '%')):
+            in_movetext = True
+        buffer.append(line)
+    if in_movetext:
+        yield ''.join(buffer)
+
+
+class _QuietGameBuilder(chess.pgn.GameBuilder):
+    # collect errors on the game instead of logging each one
+    def handle_error(self, error):
+        self.game.errors.append(error)
+
+
+def parse_game(text, checkpoint_interval=16):
+    """Fields of a Game (plus its moves) for one game's PGN text, None when invalid.
+
+    Only the main line is imported and every move is checked for legality.
+    checkpoint_interval is passed in so every worker process uses the
+    importing process's setting. This module imports the models, so worker
+    processes must run django.setup() first (see the import_pgn command).
+    """
+    try:
+        pgn_game = chess.pgn.read_game(io.StringIO(text), Visitor=_QuietGameBuilder)
+    except (ValueError, KeyError):
+        return None
+    if pgn_game is None or pgn_game.errors:
+        return None
+    board = pgn_game.board()
+    if board.fen() != chess.STARTING_FEN:
+        return None
+
+    moves = []
+    positions = [position_key(board)]
+    checkpoints = []
+    for move in pgn_game.mainline_moves():
+        piece = board.piece_at(move.from_square)
+        moves.append((move, piece.symbol() if piece else ''))
+        board.push(move)
+        positions.append(position_key(board))
+        if checkpoint_due(len(moves), checkpoint_interval):
+            checkpoints.append(f'{len(moves)} {board.fen()}\n')
+    headers = pgn_game.headers
+    return {
+        'white': headers.get('White', '?')[:150],
+        'black': headers.get('Black', '?')[:150],
+        'outcome': OUTCOMES.get(headers.get('Result')),
+        'board_state': board.fen(),
+        'current_turn': 'white' if board.turn else 'black',
+        'move_count': len(moves),
+        'packed_moves': pack_moves([move for move, _ in moves]),
+        'checkpoints': ''.join(checkpoints),
+        'moves': [(move.uci(), piece) for move, piece in moves],
+        'positions': positions,
+    }
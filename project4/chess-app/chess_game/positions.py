@@ -0,0 +1,38 @@
+"""
+Position index helpers.
+
+Positions are identified by chess.polyglot.zobrist_hash, which covers piece
+placement, side to move, castling rights and en passant. The unsigned
+64-bit hash is stored shifted into the signed range of a BigIntegerField.
+"""
+
+import chess
+import chess.polyglot
+
+from .models import PositionIndex
+
+
+def position_key(board):
+    """Signed 64-bit Zobrist hash of board"""
+    value = chess.polyglot.zobrist_hash(board)
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+STARTING_KEY = position_key(chess.Board())
+
+
+def game_position_keys(moves):
+    """position_key for every ply of a game from the start, ply 0 included"""
+    board = chess.Board()
+    keys = [STARTING_KEY]
+    for move in moves:
+        board.push(move)
+        keys.append(position_key(board))
+    return keys
+
+
+def index_rows(game_id, keys, first_ply=0):
+    return [
+        PositionIndex(zobrist=key, game_id=game_id, ply=ply)
+        for ply, key in enumerate(keys, start=first_ply)
+    ]
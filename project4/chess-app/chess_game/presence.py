@@ -0,0 +1,234 @@
+"""
+Presence registry for online users.
+
+Every login session and every open websocket registers an entry keyed by
+the session key or channel name. A user is online while at least one of
+their entries is alive, so "who is online" costs O(online entries) instead
+of decoding every row of the Session table.
+
+Socket entries expire after PRESENCE_SOCKET_TTL seconds unless refreshed.
+A heartbeat thread in each worker process refreshes the sockets that
+process holds, so the entries of a crashed or killed worker lapse on their
+own instead of keeping its users online forever.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class BasePresenceBackend:
+    """Interface shared by presence backends"""
+
+    def add(self, user_id, key, expires_at=None):
+        """Register an entry for user_id; expires_at is a unix timestamp or None"""
+        raise NotImplementedError
+
+    def remove(self, key):
+        """Drop a single entry (session or socket)"""
+        raise NotImplementedError
+
+    def touch(self, keys, expires_at):
+        """Move the expiry of existing entries; removed keys stay removed"""
+        raise NotImplementedError
+
+    def online_user_ids(self):
+        """Set of user ids that have at least one live entry"""
+        raise NotImplementedError
+
+    def clear(self):
+        """Forget every entry"""
+        raise NotImplementedError
+
+
+class MemoryPresenceBackend(BasePresenceBackend):
+    """Process-local backend, only correct for a single worker process"""
+
+    def __init__(self, **options):
+        self._entries = {}  # key -> (user_id, expires_at)
+        self._lock = threading.Lock()
+
+    def add(self, user_id, key, expires_at=None):
+        with self._lock:
+            self._entries[key] = (int(user_id), expires_at)
+
+    def remove(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def touch(self, keys, expires_at):
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries[key] = (self._entries[key][0], expires_at)
+
+    def online_user_ids(self):
+        current = time.time()
+        with self._lock:
+            return {
+                user_id for user_id, expires_at in self._entries.values()
+                if expires_at is None or expires_at > current
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLitePresenceBackend(BasePresenceBackend):
+    """Backend stored in a small SQLite file shared by all workers on a host"""
+
+    def __init__(self, path, timeout=5.0, **options):
+        self.path = str(path)
+        self.timeout = timeout
+        self._local = threading.local()
+        self._writes = 0
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS presence ('
+            'key TEXT PRIMARY KEY, user_id INTEGER NOT NULL, expires_at REAL)'
+        )
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def add(self, user_id, key, expires_at=None):
+        conn = self._connection()
+        conn.execute(
+            'INSERT OR REPLACE INTO presence (key, user_id, expires_at) VALUES (?, ?, ?)',
+            (key, int(user_id), expires_at),
+        )
+        # purge expired sessions now and then so the table tracks online users
+        self._writes += 1
+        if self._writes % 100 == 0:
+            conn.execute('DELETE FROM presence WHERE expires_at <= ?', (time.time(),))
+
+    def remove(self, key):
+        self._connection().execute('DELETE FROM presence WHERE key = ?', (key,))
+
+    def touch(self, keys, expires_at):
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN')
+            conn.executemany(
+                'UPDATE presence SET expires_at = ? WHERE key = ?', [(expires_at, key) for key in keys]
+            )
+
+    def online_user_ids(self):
+        rows = self._connection().execute(
+            'SELECT DISTINCT user_id FROM presence WHERE expires_at IS NULL OR expires_at > ?',
+            (time.time(),),
+        )
+        return {row[0] for row in rows}
+
+    def clear(self):
+        self._connection().execute('DELETE FROM presence')
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_presence():
+    """Return the configured presence backend (created once per process)"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend_class = import_string(
+                    getattr(settings, 'PRESENCE_BACKEND', 'chess_game.presence.MemoryPresenceBackend')
+                )
+                _backend = backend_class(**getattr(settings, 'PRESENCE_OPTIONS', {}))
+    return _backend
+
+
+@receiver(setting_changed)
+def _reset_presence(setting, **kwargs):
+    global _backend
+    if setting in ('PRESENCE_BACKEND', 'PRESENCE_OPTIONS'):
+        _backend = None
+
+
+def session_key_for(session):
+    return f'session:{session.session_key}'
+
+
+def socket_key_for(channel_name):
+    return f'socket:{channel_name}'
+
+
+def mark_session_online(user, session):
+    """Register a logged-in session until it expires"""
+    if session.session_key is None:
+        session.save()
+    expires_at = session.get_expiry_date().timestamp()
+    get_presence().add(user.id, session_key_for(session), expires_at)
+
+
+def mark_session_offline(session):
+    if session.session_key is not None:
+        get_presence().remove(session_key_for(session))
+
+
+def socket_ttl():
+    return getattr(settings, 'PRESENCE_SOCKET_TTL', 60)
+
+
+# socket keys registered by this process, refreshed by the heartbeat
+_local_sockets = set()
+_heartbeat_lock = threading.Lock()
+_heartbeat = None
+
+
+def mark_socket_online(user, channel_name):
+    """Register an open websocket until it disconnects (or its process stops refreshing it)"""
+    global _heartbeat
+    key = socket_key_for(channel_name)
+    get_presence().add(user.id, key, time.time() + socket_ttl())
+    with _heartbeat_lock:
+        _local_sockets.add(key)
+        if _heartbeat is None or not _heartbeat.is_alive():
+            _heartbeat = threading.Thread(target=_run_heartbeat, name='presence-heartbeat', daemon=True)
+            _heartbeat.start()
+
+
+def mark_socket_offline(channel_name):
+    key = socket_key_for(channel_name)
+    with _heartbeat_lock:
+        _local_sockets.discard(key)
+    get_presence().remove(key)
+
+
+def refresh_sockets():
+    """Push back the expiry of every socket this process holds"""
+    with _heartbeat_lock:
+        keys = list(_local_sockets)
+    if keys:
+        get_presence().touch(keys, time.time() + socket_ttl())
+
+
+def _run_heartbeat():
+    while True:
+        # three refreshes per TTL, so one slow round does not drop anyone
+        time.sleep(socket_ttl() / 3)
+        try:
+            refresh_sockets()
+        except Exception:
+            logger.exception('Presence heartbeat failed')
+
+
+def online_user_ids():
+    return get_presence().online_user_ids()
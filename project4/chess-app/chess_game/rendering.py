@@ -0,0 +1,173 @@
+"""
+Board rendering shared by the HTML views, the REST API and the consumers.
+
+A rendered board is a dict of square name -> HTML entity in display order
+(rank 8 to 1 for white, rank 1 to 8 and mirrored files for black). It only
+depends on piece placement and perspective, so renders are memoized on the
+board's bitboards, which identify the placement exactly like the placement
+part of the FEN but cost nothing to read.
+"""
+
+import zlib
+from functools import lru_cache
+
+import chess
+
+PIECE_SYMBOLS = {
+    'K': '&#9812;', 'Q': '&#9813;', 'R': '&#9814;', 'B': '&#9815;', 'N': '&#9816;', 'P': '&#9817;',
+    'k': '&#9818;', 'q': '&#9819;', 'r': '&#9820;', 'b': '&#9821;', 'n': '&#9822;', 'p': '&#9823;'
+}
+EMPTY_SQUARE = '&nbsp;'
+
+# display order of the squares for each perspective
+WHITE_ORDER = [chess.square(col, 7 - row) for row in range(8) for col in range(8)]
+BLACK_ORDER = [chess.square(7 - col, row) for row in range(8) for col in range(8)]
+
+
+def _bitboards(board):
+    return (
+        board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+        board.occupied_co[chess.WHITE]
+    )
+
+
+def render_board(board, flipped=False):
+    """Square dict for board, seen from black when flipped.
+
+    The dict is shared between callers through the memo cache and must not
+    be modified.
+    """
+    return _render(*_bitboards(board), flipped)
+
+
+@lru_cache(maxsize=4096)
+def _render(pawns, knights, bishops, rooks, queens, kings, white, flipped):
+    symbols = [EMPTY_SQUARE] * 64
+    for mask, letter in zip((pawns, knights, bishops, rooks, queens, kings), 'pnbrqk'):
+        for square in chess.scan_forward(mask & white):
+            symbols[square] = PIECE_SYMBOLS[letter.upper()]
+        for square in chess.scan_forward(mask & ~white):
+            symbols[square] = PIECE_SYMBOLS[letter]
+    order = BLACK_ORDER if flipped else WHITE_ORDER
+    return {chess.SQUARE_NAMES[square]: symbols[square] for square in order}
+
+
+def render_cache_info():
+    return _render.cache_info()
+
+
+def board_checksum(board):
+    """CRC32 (8 hex digits) of the rendered squares joined by '|' in a1..h8 order.
+
+    Clients compute the same value over their own square dict to detect
+    drift after applying a diff.
+    """
+    return _checksum(*_bitboards(board))
+
+
+class _Position:
+    # hashable stand-in for a board, equal to any board with the same legal moves
+    __slots__ = ('key', 'board')
+
+    def __init__(self, board):
+        self.key = (
+            *_bitboards(board), board.turn, board.clean_castling_rights(),
+            board.ep_square if board.has_legal_en_passant() else None
+        )
+        self.board = board
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+@lru_cache(maxsize=4096)
+def _legal_moves(position):
+    # (from square -> concatenated to squares, set of UCI strings)
+    targets = {}
+    ucis = set()
+    for move in position.board.legal_moves:
+        ucis.add(move.uci())
+        name = chess.SQUARE_NAMES[move.from_square]
+        to_name = chess.SQUARE_NAMES[move.to_square]
+        if to_name not in targets.get(name, ''):
+            targets[name] = targets.get(name, '') + to_name
+    position.board = None  # keep only the key alive in the cache
+    return targets, frozenset(ucis)
+
+
+def legal_move_map(board):
+    """From square -> its legal target squares concatenated ("e2" -> "e3e4").
+
+    Memoized per position like the renders; the dict is shared and must not
+    be modified. Promotions appear once per target square.
+    """
+    return _legal_moves(_Position(board))[0]
+
+
+def is_legal(board, move):
+    """move in board.legal_moves, answered from the memoized legal move set"""
+    return move.uci() in _legal_moves(_Position(board))[1]
+
+
+def legal_moves_cache_info():
+    return _legal_moves.cache_info()
+
+
+@lru_cache(maxsize=4096)
+def _checksum(*bitboards):
+    rendered = _render(*bitboards, False)
+    text = '|'.join(rendered[name] for name in chess.SQUARE_NAMES)
+    return '%08x' % zlib.crc32(text.encode())
+
+
+def changed_squares(pieces_before, board):
+    """Rendered squares of board that differ from an earlier piece_map()"""
+    changed = {}
+    pieces_after = board.piece_map()
+    for square in pieces_before.keys() | pieces_after.keys():
+        piece = pieces_after.get(square)
+        if pieces_before.get(square) != piece:
+            changed[chess.SQUARE_NAMES[square]] = PIECE_SYMBOLS[piece.symbol()] if piece else EMPTY_SQUARE
+    return changed
+
+
+def describe_result(board):
+    """Human readable result of a finished board, None while the game goes on"""
+    if board.is_checkmate():
+        winner = 'Black' if board.turn else 'White'
+        return f'{winner} wins by checkmate!'
+    elif board.is_stalemate():
+        return 'Draw by stalemate!'
+    elif board.is_insufficient_material():
+        return 'Draw by insufficient material!'
+    return None
+
+
+def board_state(board, current_turn, is_my_turn, flipped=False, ply=None, base_ply=None, base_pieces=None,
+                legal_moves=False):
+    """Data for BoardStateSerializer.
+
+    With base_pieces (the piece_map() at base_ply) only the squares that
+    changed since then are sent, as `changed`, instead of `board_dict`.
+    With legal_moves the side to move's legal_move_map() is included.
+    """
+    is_game_over = board.is_game_over()
+    data = {
+        'current_turn': current_turn,
+        'is_my_turn': is_my_turn,
+        'is_game_over': is_game_over,
+        'result': describe_result(board) if is_game_over else None,
+        'ply': board.ply() if ply is None else ply,
+        'checksum': board_checksum(board),
+    }
+    if base_pieces is None:
+        data['board_dict'] = render_board(board, flipped)
+    else:
+        data['base_ply'] = base_ply
+        data['changed'] = changed_squares(base_pieces, board)
+    if legal_moves:
+        data['legal_moves'] = legal_move_map(board)
+    return data
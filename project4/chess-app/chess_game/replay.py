@@ -0,0 +1,72 @@
+"""
+Seeking to any ply of a stored game.
+
+Besides its packed moves, every game keeps a FEN checkpoint each
+REPLAY_CHECKPOINT_INTERVAL plies in Game.checkpoints, one "<ply> <fen>" per
+line. A past position is rebuilt from the nearest checkpoint at or before
+it, so at most one interval of moves is replayed whatever the game length.
+"""
+
+import chess
+from django.conf import settings
+
+from .packing import unpack_moves
+
+
+def checkpoint_interval():
+    return max(1, getattr(settings, 'REPLAY_CHECKPOINT_INTERVAL', 16))
+
+
+def checkpoint_due(ply, interval=None):
+    return ply > 0 and ply % (interval or checkpoint_interval()) == 0
+
+
+def build_checkpoints(moves, interval=None):
+    """Checkpoints text for a whole game, for backfills and imports"""
+    interval = interval or checkpoint_interval()
+    board = chess.Board()
+    checkpoints = []
+    for ply, move in enumerate(moves, start=1):
+        board.push(move)
+        if checkpoint_due(ply, interval):
+            checkpoints.append(f'{ply} {board.fen()}\n')
+    return ''.join(checkpoints)
+
+
+def nearest_checkpoint(checkpoints, ply):
+    """(ply, fen) of the last checkpoint at or before ply, the start position without one"""
+    best = (0, chess.STARTING_FEN)
+    for line in (checkpoints or '').splitlines():
+        checkpoint_ply, fen = line.split(' ', 1)
+        checkpoint_ply = int(checkpoint_ply)
+        if checkpoint_ply > ply:
+            break
+        best = (checkpoint_ply, fen)
+    return best
+
+
+def board_at_ply(game, ply, moves=None):
+    """Board of game after ply moves, or None for a ply the game never had.
+
+    The board carries the replayed moves (at most one checkpoint interval)
+    on its move stack.
+    """
+    moves = unpack_moves(game.packed_moves) if moves is None else moves
+    if ply < 0 or ply > len(moves):
+        return None
+    start, fen = nearest_checkpoint(game.checkpoints, ply)
+    board = chess.Board(fen)
+    for move in moves[start:ply]:
+        board.push(move)
+    return board
+
+
+def all_positions(game):
+    """FEN of every ply from 0 with the move (UCI and SAN) that led to it"""
+    board = chess.Board()
+    positions = [{'ply': 0, 'fen': board.fen(), 'uci': None, 'san': None}]
+    for move in unpack_moves(game.packed_moves):
+        san = board.san(move)
+        board.push(move)
+        positions.append({'ply': board.ply(), 'fen': board.fen(), 'uci': move.uci(), 'san': san})
+    return positions
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from .models import Game, GameChallenge, Move
+from .packing import game_moves
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -21,12 +22,34 @@ class MoveSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'player', 'timestamp']
 
 
+class PackedMoveSerializer(serializers.Serializer):
+    # a move decoded from the game's packed columns
+    ply = serializers.IntegerField()
+    player = UserSerializer()
+    from_square = serializers.CharField()
+    to_square = serializers.CharField()
+    piece = serializers.CharField()
+    notation = serializers.CharField()
+    timestamp = serializers.DateTimeField(allow_null=True)
+
+
+class PackedMovesField(serializers.Field):
+    # all moves of a game, read from the game row itself
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, game):
+        return PackedMoveSerializer(game_moves(game), many=True).data
+
+
 class GameSerializer(serializers.ModelSerializer):
     # full game state serializer
     white_player = UserSerializer(read_only=True)
     black_player = UserSerializer(read_only=True)
     winner = UserSerializer(read_only=True)
-    moves = MoveSerializer(many=True, read_only=True)
+    moves = PackedMovesField()
     
     class Meta:
         model = Game
@@ -40,6 +63,30 @@ class GameSerializer(serializers.ModelSerializer):
         ]
 
 
+class GameSummarySerializer(serializers.ModelSerializer):
+    # lightweight game serializer for lists, no board or moves
+    white_player = UserSerializer(read_only=True)
+    black_player = UserSerializer(read_only=True)
+    winner = UserSerializer(read_only=True)
+
+    class Meta:
+        model = Game
+        fields = [
+            'id', 'white_player', 'black_player', 'current_turn', 'status',
+            'move_count', 'winner', 'outcome', 'created_at', 'updated_at'
+        ]
+        read_only_fields = fields
+
+
+class GameSummaryWithMovesSerializer(GameSummarySerializer):
+    # game list entries with their moves, for ?include=moves
+    moves = PackedMovesField()
+
+    class Meta(GameSummarySerializer.Meta):
+        fields = GameSummarySerializer.Meta.fields + ['moves']
+        read_only_fields = fields
+
+
 class GameChallengeSerializer(serializers.ModelSerializer):
     # serializer for game challenges
     challenger = UserSerializer(read_only=True)
@@ -53,9 +100,16 @@ class GameChallengeSerializer(serializers.ModelSerializer):
 
 class BoardStateSerializer(serializers.Serializer):
     # serializer for board state representation
-    board_dict = serializers.DictField()
+    # either the full board_dict or, in diff mode, the squares changed since base_ply
+    board_dict = serializers.DictField(required=False)
     current_turn = serializers.CharField()
     is_my_turn = serializers.BooleanField()
     is_game_over = serializers.BooleanField()
     result = serializers.CharField(required=False, allow_null=True)
+    ply = serializers.IntegerField(required=False)
+    checksum = serializers.CharField(required=False)
+    base_ply = serializers.IntegerField(required=False)
+    changed = serializers.DictField(required=False)
+    # from square -> concatenated legal target squares, when asked for
+    legal_moves = serializers.DictField(child=serializers.CharField(), required=False)
 
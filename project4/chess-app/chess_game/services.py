@@ -0,0 +1,294 @@
+"""
+Game services shared by the HTML views, the REST API and the websocket consumers.
+"""
+
+import json
+
+import chess
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import models, transaction
+from django.utils import timezone
+
+from .broadcast import get_broadcaster
+from .models import ActivePlayer, Game, Move, PositionIndex
+from .packing import appended
+from .positions import STARTING_KEY, index_rows, position_key
+from .presence import online_user_ids
+from .rendering import board_checksum, changed_squares, describe_result, is_legal, legal_move_map
+from .replay import board_at_ply, checkpoint_due
+
+
+class MoveResult:
+    """Outcome of apply_move; `status` is one of the constants below"""
+
+    OK = 'ok'
+    NOT_ACTIVE = 'not_active'
+    NOT_YOUR_TURN = 'not_your_turn'
+    MISSING_SQUARES = 'missing_squares'
+    ILLEGAL = 'illegal'
+    CONFLICT = 'conflict'
+
+    def __init__(self, status, error=None, event=None):
+        self.status = status
+        self.error = error
+        self.event = event  # game.move payload when the move was made
+
+    @property
+    def ok(self):
+        return self.status == self.OK
+
+    @property
+    def ply(self):
+        return self.event['ply'] if self.event else None
+
+
+def apply_move(game, user, from_square, to_square, promotion=None, broadcast=True):
+    """Validate and persist a move by user, then notify both players.
+
+    The game row, with the move appended to its packed columns, is updated
+    with a single UPDATE conditioned on the move_count the caller loaded, in
+    one transaction with the Move INSERT (skipped without STORE_MOVE_ROWS)
+    and the INSERT of the new position into the position index.
+    When another request committed a move (or a resignation) first, nothing
+    is written and the result is CONFLICT.
+
+    With broadcast=False the caller sends result.event to the game group
+    itself (the websocket consumer does this on its own event loop).
+    """
+    if game.status != 'active':
+        return MoveResult(MoveResult.NOT_ACTIVE, 'Game is not active')
+
+    if not game.is_players_turn(user):
+        return MoveResult(MoveResult.NOT_YOUR_TURN, 'Not your turn')
+
+    if not from_square or not to_square:
+        return MoveResult(MoveResult.MISSING_SQUARES, 'from_square and to_square are required')
+
+    # the cached board is pushed in place and stored under the new version
+    with game.cached_board() as board:
+        try:
+            move = chess.Move.from_uci(f"{from_square}{to_square}{promotion or ''}")
+        except ValueError as e:
+            return MoveResult(MoveResult.ILLEGAL, f'Invalid move: {str(e)}')
+
+        if not is_legal(board, move):
+            return MoveResult(MoveResult.ILLEGAL, 'Invalid move')
+
+        piece = board.piece_at(move.from_square)
+        san = board.san(move)
+        pieces_before = board.piece_map()
+        board.push(move)
+
+        changes = {
+            'board_state': board.fen(),
+            'current_turn': 'black' if game.current_turn == 'white' else 'white',
+            'move_count': game.move_count + 1,
+        }
+        if board.is_checkmate():
+            changes.update(
+                status='completed', winner=user,
+                outcome='white_wins' if user == game.white_player else 'black_wins'
+            )
+        elif board.is_stalemate() or board.is_insufficient_material():
+            changes.update(status='completed', outcome='draw')
+        changes['updated_at'] = timezone.now()
+        changes['packed_moves'], changes['packed_times'] = appended(game, move, changes['updated_at'])
+        if checkpoint_due(changes['move_count']):
+            changes['checkpoints'] = f"{game.checkpoints}{changes['move_count']} {changes['board_state']}\n"
+
+        # one conditional UPDATE, so of two requests moving on the same ply only one wins
+        with transaction.atomic():
+            updated = Game.objects.filter(
+                pk=game.pk, move_count=game.move_count, status='active'
+            ).update(**changes)
+            if updated:
+                if getattr(settings, 'STORE_MOVE_ROWS', True):
+                    Move.objects.create(
+                        game=game,
+                        player=user,
+                        from_square=from_square,
+                        to_square=to_square,
+                        piece=piece.symbol() if piece else '',
+                        notation=str(move)
+                    )
+                # the first move also records the starting position
+                first_ply, keys = game.move_count + 1, [position_key(board)]
+                if game.move_count == 0:
+                    first_ply, keys = 0, [STARTING_KEY] + keys
+                # index_positions may be backfilling this game at the same time
+                PositionIndex.objects.bulk_create(index_rows(game.id, keys, first_ply), ignore_conflicts=True)
+                if changes.get('status', 'active') != 'active':
+                    release_players(game)
+        if not updated:
+            board.pop()
+            return MoveResult(MoveResult.CONFLICT, 'The game has moved on, reload and try again')
+
+        for field, value in changes.items():
+            setattr(game, field, value)
+        event = build_move_event(game, move, san, pieces_before, board)
+
+    if broadcast:
+        broadcast_game_move(game.id, event)
+    if game.status != 'active':
+        broadcast_lobby_reload([game.white_player_id, game.black_player_id])
+    return MoveResult(MoveResult.OK, event=event)
+
+
+def record_resignation(game, user):
+    """Resign an active game for user, freeing both players and notifying them.
+
+    Like apply_move, only the changed columns are written, with an UPDATE
+    conditioned on the game still being active: a move committed since the
+    caller loaded the game is kept, and a game that ended in the meantime
+    is left alone (the result is then NOT_ACTIVE).
+    """
+    if user.id == game.white_player_id:
+        changes = {'winner_id': game.black_player_id, 'outcome': 'white_resigned'}
+    else:
+        changes = {'winner_id': game.white_player_id, 'outcome': 'black_resigned'}
+    changes.update(status='resigned', updated_at=timezone.now())
+    with transaction.atomic():
+        updated = Game.objects.filter(pk=game.pk, status='active').update(**changes)
+        if updated:
+            release_players(game)
+    if not updated:
+        return MoveResult(MoveResult.NOT_ACTIVE, 'Game is not active')
+
+    game.refresh_from_db()
+    broadcast_game_reload(game.id)
+    broadcast_lobby_reload([game.white_player_id, game.black_player_id])
+    return MoveResult(MoveResult.OK)
+
+
+def release_players(game):
+    """Let the players of a game that just ended start another one"""
+    ActivePlayer.objects.filter(game=game).delete()
+
+
+def pieces_at_ply(game, board, ply):
+    """piece_map() of the game at an earlier ply, None for a ply it never had.
+
+    board is the game's current board (borrowed from the cache). Plies still
+    on its move stack are reached by undoing and redoing moves in place;
+    older ones are rebuilt from the nearest stored checkpoint.
+    """
+    back = game.move_count - ply
+    if ply < 0 or back < 0:
+        return None
+    if back <= len(board.move_stack):
+        undone = [board.pop() for _ in range(back)]
+        pieces = board.piece_map()
+        for move in reversed(undone):
+            board.push(move)
+        return pieces
+
+    return board_at_ply(game, ply).piece_map()
+
+
+def parse_ply(value):
+    """Client-declared ply as an int, None when absent or malformed"""
+    try:
+        ply = int(value)
+    except (TypeError, ValueError):
+        return None
+    return ply if ply >= 0 else None
+
+
+def wants_legal_moves(value):
+    """Whether a client asked for the legal move map (?legal_moves=1 and the like)"""
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def get_available_players(user=None):
+    """Logged-in users other than `user` who are not in an active game (one query)"""
+    user_ids = online_user_ids()
+    if user is not None:
+        user_ids.discard(user.id)
+    # ActivePlayer holds one row per seated player, keyed by the user
+    seated = ActivePlayer.objects.filter(user=models.OuterRef('pk'))
+    return User.objects.filter(id__in=user_ids).exclude(models.Exists(seated))
+
+
+def build_lobby_snapshot():
+    """Every available player, encoded once and shared by all lobby viewers.
+
+    Returns (players_json, player_ids, offsets): the ids are ascending and
+    offsets[i] is where the entry of player_ids[i] starts in players_json,
+    so each viewer can cut its own entry out by id (see exclude_player).
+    """
+    entries, player_ids, offsets = [], [], []
+    position = 1
+    for player in get_available_players().order_by('id').values('id', 'username'):
+        entry = json.dumps(player, separators=(',', ':'))
+        entries.append(entry)
+        player_ids.append(player['id'])
+        offsets.append(position)
+        position += len(entry) + 1
+    return '[%s]' % ','.join(entries), player_ids, offsets
+
+
+def broadcast_lobby_reload(user_ids=()):
+    """Notify lobby websocket clients to refresh.
+
+    The available-players list is built once per (coalesced) broadcast and
+    carried in the event. Consumers only refetch their own challenges and
+    history when their user is listed in user_ids.
+    """
+    get_broadcaster().schedule('lobby', _lobby_event, set(user_ids), merge=set.union)
+
+
+def _lobby_event(user_ids):
+    players, player_ids, offsets = build_lobby_snapshot()
+    return {
+        'type': 'lobby.refresh',  # project-3
+        'players': players,
+        'player_ids': player_ids,
+        'player_offsets': offsets,
+        'affected': sorted(int(user_id) for user_id in user_ids),
+    }
+
+
+def broadcast_game_reload(game_id):
+    """Notify game websocket clients to refresh."""
+    get_broadcaster().schedule(
+        f'game_{game_id}', _game_event, {'moves': [], 'refresh': True}, merge=_merge_game_events
+    )
+
+
+def broadcast_game_move(game_id, move_data):
+    """Send a single move to game websocket clients without delay."""
+    get_broadcaster().schedule(
+        f'game_{game_id}', _game_event, {'moves': [move_data], 'refresh': False},
+        merge=_merge_game_events, delay=0
+    )
+
+
+def _merge_game_events(pending, new):
+    # moves are never dropped, a pending full refresh covers them anyway
+    return {'moves': pending['moves'] + new['moves'], 'refresh': pending['refresh'] or new['refresh']}
+
+
+def _game_event(payload):
+    if payload['refresh']:
+        return {'type': 'game.refresh'}  # project-3
+    return {'type': 'game.move', 'moves': payload['moves']}
+
+
+def build_move_event(game, move, san, pieces_before, board):
+    """Payload for a game.move event: the move itself, never the whole game"""
+    return {
+        'ply': game.move_count,
+        'uci': move.uci(),
+        'san': san,
+        'fen': board.fen(),
+        'changed': changed_squares(pieces_before, board),
+        'checksum': board_checksum(board),
+        'current_turn': game.current_turn,
+        'status': game.status,
+        'outcome': game.outcome,
+        'winner_id': game.winner_id,
+        'is_game_over': board.is_game_over(),
+        'result': describe_result(board),
+        'legal_moves': legal_move_map(board),
+    }
@@ -0,0 +1,27 @@
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .metrics import count_queries
+from .presence import mark_session_offline, mark_session_online
+
+
+@receiver(user_logged_in)
+def track_login(sender, request, user, **kwargs):
+    # covers login_view, join_view, api_login, api_register and admin logins
+    if request is not None and hasattr(request, 'session'):
+        mark_session_online(user, request.session)
+
+
+@receiver(user_logged_out)
+def track_logout(sender, request, user, **kwargs):
+    # sent before logout() flushes the session, so the key is still valid
+    if request is not None and hasattr(request, 'session'):
+        mark_session_offline(request.session)
+
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs):
+    # feeds the per-request query histogram of MetricsMiddleware
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
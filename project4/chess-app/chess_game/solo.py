@@ -0,0 +1,51 @@
+"""
+Stateless solo play.
+
+A guest's game travels with every request as a signed token: the moves
+packed as in Game.packed_moves (see packing.py), urlsafe base64, plus an
+HMAC of them made with SECRET_KEY. The server rebuilds the board by
+replaying the moves and hands back a new token after each move, so solo
+play needs no session and writes nothing to the database.
+"""
+
+import base64
+
+import chess
+from django.core import signing
+
+from .packing import pack_moves, unpack_moves
+
+SALT = 'chess_game.solo'
+# longest game a token may hold; bounds the replay done per request
+MAX_PLIES = 1024
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def make_token(board):
+    """Signed token for board's game (its move stack from the start)"""
+    data = base64.urlsafe_b64encode(pack_moves(board.move_stack)).decode().rstrip('=')
+    return signing.Signer(salt=SALT).sign(data)
+
+
+def board_from_token(token):
+    """Board rebuilt from a token, the starting position for an empty one.
+
+    Raises InvalidToken for a token this server did not sign.
+    """
+    if not token:
+        return chess.Board()
+    try:
+        data = signing.Signer(salt=SALT).unsign(token)
+        moves = unpack_moves(base64.urlsafe_b64decode(data + '=' * (-len(data) % 4)))
+    except (signing.BadSignature, ValueError):
+        raise InvalidToken('Invalid solo game token')
+    if len(moves) > MAX_PLIES:
+        raise InvalidToken('Solo game is too long')
+
+    board = chess.Board()
+    for move in moves:
+        board.push(move)
+    return board
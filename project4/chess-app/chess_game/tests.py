@@ -1,3 +1,1259 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.exceptions import ChannelFull
+from django.apps import apps as django_apps
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+import chess
+
+from .board_cache import BoardCache, board_cache
+from .broadcast import BroadcastScheduler
+from .channel_layers import SQLiteChannelLayer
+from . import engine
+from .consumers import GameConsumer, LobbyConsumer, exclude_player
+from .analysis import evict
+from . import metrics
+from .models import ActivePlayer, Game, GameChallenge, Move, PositionEvaluation, PositionIndex
+from .packing import game_moves, pack_moves, unpack_moves, unpack_times
+from .pgn import game_to_pgn
+from .replay import board_at_ply, build_checkpoints
+from . import presence as presence_module
+from .presence import (
+    SQLitePresenceBackend, get_presence, mark_socket_offline, mark_socket_online, online_user_ids,
+    refresh_sockets, socket_key_for,
+)
+from .rendering import PIECE_SYMBOLS, is_legal, legal_move_map, legal_moves_cache_info, render_board
+from .services import (
+    MoveResult, apply_move, broadcast_lobby_reload, build_lobby_snapshot, get_available_players,
+    record_resignation
+)
+from .solo import board_from_token, make_token
+from .views import get_logged_in_users_excluding_current, start_game
+
+
+class MockRequest:
+    def __init__(self, user):
+        self.user = user
+
+
+@override_settings(
+    PRESENCE_BACKEND='chess_game.presence.MemoryPresenceBackend',
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    BROADCAST_COALESCE_WINDOW=0,
+)
+class ChessTestCase(TestCase):
+    # every test starts with an empty, process-local presence registry
+
+    def setUp(self):
+        get_presence().clear()
+
+
+@override_settings(
+    PRESENCE_BACKEND='chess_game.presence.MemoryPresenceBackend',
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    BROADCAST_COALESCE_WINDOW=0,
+)
+class ChessTransactionTestCase(TransactionTestCase):
+    # for consumer tests, where database_sync_to_async runs in another thread
+
+    def setUp(self):
+        get_presence().clear()
+
+
+class PresenceTests(ChessTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice', password='pass12345')
+        self.bob = User.objects.create_user('bob', password='pass12345')
+
+    def test_login_and_logout_update_registry(self):
+        self.client.post('/api/auth/login/', {'username': 'alice', 'password': 'pass12345'})
+        self.assertEqual(online_user_ids(), {self.alice.id})
+
+        self.client.post('/api/auth/logout/')
+        self.assertEqual(online_user_ids(), set())
+
+    def test_logged_in_users_excludes_current(self):
+        get_presence().add(self.alice.id, 'socket:a')
+        get_presence().add(self.bob.id, 'socket:b')
+
+        users = get_logged_in_users_excluding_current(MockRequest(self.alice))
+        self.assertEqual(list(users), [self.bob])
+
+    def test_expired_entries_are_offline(self):
+        get_presence().add(self.alice.id, 'session:old', expires_at=1.0)
+        self.assertEqual(online_user_ids(), set())
+
+    def test_sqlite_backend_is_shared_between_instances(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'presence.sqlite3')
+            worker_a = SQLitePresenceBackend(path)
+            worker_b = SQLitePresenceBackend(path)
+
+            worker_a.add(self.alice.id, 'socket:a')
+            self.assertEqual(worker_b.online_user_ids(), {self.alice.id})
+
+            worker_b.remove('socket:a')
+            self.assertEqual(worker_a.online_user_ids(), set())
+
+    @override_settings(PRESENCE_SOCKET_TTL=0.05)
+    def test_sockets_lapse_without_heartbeat(self):
+        mark_socket_online(self.alice, 'live')
+        mark_socket_online(self.bob, 'orphan')
+        # a crashed worker's socket: registered, but no longer held by any process
+        presence_module._local_sockets.discard(socket_key_for('orphan'))
+        self.assertEqual(online_user_ids(), {self.alice.id, self.bob.id})
+
+        time.sleep(0.03)
+        refresh_sockets()
+        time.sleep(0.03)
+        self.assertEqual(online_user_ids(), {self.alice.id})
+
+        mark_socket_offline('live')
+        refresh_sockets()
+        self.assertEqual(online_user_ids(), set())
+
+
+class AvailablePlayersTests(ChessTestCase):
+    def _bring_online(self, count):
+        users = User.objects.bulk_create(
+            User(username=f'player{i}') for i in range(len(self.online), len(self.online) + count)
+        )
+        for user in users:
+            get_presence().add(user.id, f'socket:{user.id}')
+        self.online.extend(users)
+
+    def _seat(self, white, black):
+        # an active game with its ActivePlayer rows, as start_game leaves it
+        game = Game.objects.create(white_player=white, black_player=black)
+        ActivePlayer.objects.bulk_create([ActivePlayer(user=white, game=game), ActivePlayer(user=black, game=game)])
+
+    def setUp(self):
+        super().setUp()
+        self.viewer = User.objects.create_user('viewer')
+        get_presence().add(self.viewer.id, 'socket:viewer')
+        self.online = []
+
+    def test_excludes_viewer_and_players_in_games(self):
+        self._bring_online(4)
+        self._seat(self.online[0], self.online[1])
+        Game.objects.create(white_player=self.online[2], black_player=self.viewer, status='completed')
+
+        available = set(get_available_players(self.viewer))
+        self.assertEqual(available, {self.online[2], self.online[3]})
+
+    def test_query_count_is_flat_in_online_users(self):
+        for total in (10, 10000):
+            self._bring_online(total - len(self.online))
+            self._seat(self.online[-1], self.online[-2])
+            with self.assertNumQueries(1):
+                available = list(get_available_players(self.viewer))
+            self.assertEqual(len(available), total - 2 * Game.objects.filter(status='active').count())
+
+
+class LobbySnapshotTests(ChessTransactionTestCase):
+    def test_exclude_player(self):
+        users = [User.objects.create_user(name) for name in ('alice', 'bob', 'carol')]
+        outsider = User.objects.create_user('dave')
+        for online in (users[:1], users[:2], users, users[1:]):
+            get_presence().clear()
+            for user in online:
+                get_presence().add(user.id, f'socket:{user.id}')
+            players_json, player_ids, offsets = build_lobby_snapshot()
+            for viewer in users + [outsider]:
+                expected = [{'id': user.id, 'username': user.username} for user in online if user != viewer]
+                self.assertEqual(json.loads(exclude_player(players_json, player_ids, offsets, viewer.id)), expected)
+
+    async def test_refresh_carries_shared_players_and_private_data(self):
+        alice = await sync_to_async(User.objects.create_user)('alice')
+        bob = await sync_to_async(User.objects.create_user)('bob')
+        await sync_to_async(GameChallenge.objects.create)(challenger=bob, challenged=alice)
+
+        communicator = WebsocketCommunicator(LobbyConsumer.as_asgi(), '/ws/lobby/')
+        communicator.scope['user'] = alice
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await sync_to_async(get_presence().add)(bob.id, 'socket:bob')
+
+        await sync_to_async(broadcast_lobby_reload)([alice.id])
+        message = json.loads(await communicator.receive_from())
+        self.assertEqual(message['action'], 'lobby_refresh')
+        self.assertEqual(message['data']['available_players'], [{'id': bob.id, 'username': 'bob'}])
+        self.assertEqual(len(message['data']['pending_challenges']), 1)
+        self.assertEqual(message['data']['game_history'], [])
+
+        await communicator.disconnect()
+
+    @override_settings(BROADCAST_COALESCE_WINDOW=0.05)
+    async def test_burst_of_logins_sends_first_refresh_and_one_merged(self):
+        alice = await sync_to_async(User.objects.create_user)('alice')
+        communicator = WebsocketCommunicator(LobbyConsumer.as_asgi(), '/ws/lobby/')
+        communicator.scope['user'] = alice
+        await communicator.connect()
+
+        for _ in range(5):
+            await sync_to_async(broadcast_lobby_reload)()
+        for _ in range(2):
+            message = json.loads(await communicator.receive_from(timeout=2))
+            self.assertEqual(message['action'], 'lobby_refresh')
+        self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+
+        await communicator.disconnect()
+
+
+class BroadcastSchedulerTests(ChessTestCase):
+    def setUp(self):
+        super().setUp()
+        self.scheduler = BroadcastScheduler()
+        self.built = []
+
+    def _build(self, payload):
+        self.built.append(payload)
+        return {'type': 'lobby.refresh'}
+
+    def _wait_for_emitted(self, count):
+        for _ in range(200):
+            if self.scheduler.stats()['emitted'] >= count:
+                return
+            time.sleep(0.01)
+        self.fail(f'{count} broadcasts were not sent')
+
+    @override_settings(BROADCAST_COALESCE_WINDOW=60)
+    def test_first_event_goes_out_at_once_and_later_ones_are_merged(self):
+        self.scheduler.schedule('lobby', self._build, {1}, merge=set.union)
+        self._wait_for_emitted(1)
+        self.assertEqual(self.built, [{1}])
+
+        self.scheduler.schedule('lobby', self._build, {2}, merge=set.union)
+        self.scheduler.schedule('lobby', self._build, {3}, merge=set.union)
+        self.scheduler.schedule('game_1', self._build, None)
+        self._wait_for_emitted(2)
+        self.assertCountEqual(self.built, [{1}, None])
+
+        # the merged lobby event waits for the end of the window
+        self.scheduler.flush()
+        self.assertCountEqual(self.built, [{1}, None, {2, 3}])
+        self.assertEqual(self.scheduler.stats(), {'received': 4, 'emitted': 3, 'superseded': 1, 'pending': 0})
+
+    def test_zero_window_sends_immediately(self):
+        self.scheduler.schedule('lobby', self._build, {1}, merge=set.union)
+        self.assertEqual(self.built, [{1}])
+        self.assertEqual(self.scheduler.stats()['emitted'], 1)
+
+
+class GameMoveEventTests(ChessTransactionTestCase):
+    async def _connect(self, user, game, query=''):
+        communicator = WebsocketCommunicator(GameConsumer.as_asgi(), f'/ws/game/{game.id}/{query}')
+        communicator.scope['user'] = user
+        communicator.scope['url_route'] = {'kwargs': {'game_id': str(game.id)}}
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_move_is_sent_as_incremental_event(self):
+        white = await sync_to_async(User.objects.create_user)('white')
+        black = await sync_to_async(User.objects.create_user)('black')
+        game = await sync_to_async(Game.objects.create)(white_player=white, black_player=black)
+        white_socket = await self._connect(white, game)
+        black_socket = await self._connect(black, game)
+
+        await sync_to_async(self.client.force_login)(white)
+        response = await sync_to_async(self.client.post)(
+            f'/api/games/{game.id}/make_move/', {'from_square': 'e2', 'to_square': 'e4'}
+        )
+        self.assertEqual(response.status_code, 200)
+
+        white_event = json.loads(await white_socket.receive_from())
+        black_event = json.loads(await black_socket.receive_from())
+        self.assertEqual(white_event['action'], 'game_move')
+        self.assertEqual(white_event['data']['ply'], 1)
+        self.assertEqual(white_event['data']['san'], 'e4')
+        self.assertEqual(white_event['data']['changed'], {'e2': '&nbsp;', 'e4': '&#9817;'})
+        self.assertFalse(white_event['data']['is_my_turn'])
+        self.assertTrue(black_event['data']['is_my_turn'])
+
+        await black_socket.send_json_to({'action': 'resync'})
+        resync = json.loads(await black_socket.receive_from())
+        self.assertEqual(resync['action'], 'game_refresh')
+        self.assertEqual(resync['data']['game']['move_count'], 1)
+
+        await white_socket.disconnect()
+        await black_socket.disconnect()
+
+    async def test_move_over_socket_is_acked_and_broadcast(self):
+        white = await sync_to_async(User.objects.create_user)('white')
+        black = await sync_to_async(User.objects.create_user)('black')
+        game = await sync_to_async(Game.objects.create)(white_player=white, black_player=black)
+        white_socket = await self._connect(white, game)
+        black_socket = await self._connect(black, game)
+
+        await black_socket.send_json_to({'action': 'move', 'id': 1, 'from_square': 'e7', 'to_square': 'e5'})
+        rejected = json.loads(await black_socket.receive_from())
+        self.assertEqual(rejected['action'], 'move_rejected')
+        self.assertEqual(rejected['data']['reason'], 'not_your_turn')
+
+        await white_socket.send_json_to({'action': 'move', 'id': 2, 'from_square': 'g1', 'to_square': 'f3'})
+        ack = json.loads(await white_socket.receive_from())
+        self.assertEqual(ack, {'action': 'move_ack', 'data': {'id': 2, 'ply': 1}})
+        black_event = json.loads(await black_socket.receive_from())
+        self.assertEqual(black_event['action'], 'game_move')
+        self.assertEqual(black_event['data']['san'], 'Nf3')
+
+        game = await sync_to_async(Game.objects.get)(id=game.id)
+        self.assertEqual(game.move_count, 1)
+        self.assertEqual(await sync_to_async(game.moves.count)(), 1)
+
+        await white_socket.disconnect()
+        await black_socket.disconnect()
+
+    async def test_message_that_is_not_an_object_is_rejected(self):
+        white = await sync_to_async(User.objects.create_user)('white')
+        black = await sync_to_async(User.objects.create_user)('black')
+        game = await sync_to_async(Game.objects.create)(white_player=white, black_player=black)
+        white_socket = await self._connect(white, game)
+
+        for frame in ([], 'x', 1):
+            await white_socket.send_json_to(frame)
+            rejected = json.loads(await white_socket.receive_from())
+            self.assertEqual(rejected['action'], 'move_rejected')
+            self.assertEqual(rejected['data']['reason'], 'invalid_message')
+
+        # the socket is still open and takes moves
+        await white_socket.send_json_to({'action': 'move', 'id': 1, 'from_square': 'e2', 'to_square': 'e4'})
+        self.assertEqual(json.loads(await white_socket.receive_from())['action'], 'move_ack')
+
+        await white_socket.disconnect()
+
+    async def test_legal_moves_only_for_sockets_that_ask(self):
+        white = await sync_to_async(User.objects.create_user)('white')
+        black = await sync_to_async(User.objects.create_user)('black')
+        game = await sync_to_async(Game.objects.create)(white_player=white, black_player=black)
+        white_socket = await self._connect(white, game)
+        black_socket = await self._connect(black, game, '?legal_moves=1')
+
+        await white_socket.send_json_to({'action': 'move', 'id': 1, 'from_square': 'e2', 'to_square': 'e4'})
+        await white_socket.receive_from()
+        white_event = json.loads(await white_socket.receive_from())
+        black_event = json.loads(await black_socket.receive_from())
+        self.assertNotIn('legal_moves', white_event['data'])
+        self.assertEqual(black_event['data']['legal_moves']['g8'], 'h6f6')
+
+        await black_socket.send_json_to({'action': 'resync'})
+        resync = json.loads(await black_socket.receive_from())
+        self.assertEqual(len(resync['data']['board_state']['legal_moves']), 10)
+
+        await white_socket.disconnect()
+        await black_socket.disconnect()
+
+
+class BoardCacheTests(ChessTestCase):
+    def setUp(self):
+        super().setUp()
+        self.games = [
+            Game.objects.create(
+                white_player=User.objects.create_user(f'white{i}'),
+                black_player=User.objects.create_user(f'black{i}'),
+            )
+            for i in range(3)
+        ]
+        self.cache = BoardCache(maxsize=2)
+
+    def test_hits_reuse_the_board_and_keep_its_move_stack(self):
+        game = self.games[0]
+        with self.cache.borrow(game) as board:
+            board.push_uci('e2e4')
+            game.board_state = board.fen()
+            game.move_count = 1
+        with self.cache.borrow(game) as board:
+            self.assertEqual([move.uci() for move in board.move_stack], ['e2e4'])
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_stale_version_is_a_miss(self):
+        game = self.games[0]
+        with self.cache.borrow(game):
+            pass
+        game.board_state = 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1'
+        game.move_count = 1
+        with self.cache.borrow(game) as board:
+            self.assertEqual(board.fen(), game.board_state)
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+    def test_miss_rebuilds_the_move_stack_from_packed_moves(self):
+        game = self.games[0]
+        board = chess.Board()
+        # knights out and back twice: the start position has occurred three times
+        for uci in ['g1f3', 'g8f6', 'f3g1', 'f6g8'] * 2:
+            board.push_uci(uci)
+        game.packed_moves = pack_moves(board.move_stack)
+        game.board_state = board.fen()
+        game.move_count = len(board.move_stack)
+
+        with self.cache.borrow(game) as cached:
+            self.assertEqual(cached.move_stack, board.move_stack)
+            self.assertTrue(cached.can_claim_threefold_repetition())
+
+    def test_least_recently_used_game_is_evicted(self):
+        for game in self.games:
+            with self.cache.borrow(game):
+                pass
+        stats = self.cache.stats()
+        self.assertEqual((stats['size'], stats['evictions']), (2, 1))
+
+    def test_exception_drops_the_entry(self):
+        with self.assertRaises(RuntimeError):
+            with self.cache.borrow(self.games[0]) as board:
+                board.push_uci('e2e4')
+                raise RuntimeError
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+
+class RenderBoardTests(ChessTestCase):
+    def test_matches_piece_placement_from_both_sides(self):
+        board = chess.Board()
+        for uci in ['e2e4', 'd7d5', 'e4d5', 'g8f6', 'f1b5', 'c7c6']:
+            board.push_uci(uci)
+
+        for flipped in (False, True):
+            rendered = render_board(board, flipped)
+            self.assertEqual(len(rendered), 64)
+            for name, symbol in rendered.items():
+                piece = board.piece_at(chess.parse_square(name))
+                self.assertEqual(symbol, PIECE_SYMBOLS[piece.symbol()] if piece else '&nbsp;')
+
+        self.assertEqual(list(render_board(board))[:2], ['a8', 'b8'])
+        self.assertEqual(list(render_board(board, flipped=True))[:2], ['h1', 'g1'])
+
+
+class LegalMoveMapTests(ChessTestCase):
+    def test_map_and_legality(self):
+        board = chess.Board()
+        moves = legal_move_map(board)
+        self.assertEqual(len(moves), 10)
+        self.assertEqual(moves['e2'], 'e3e4')
+        self.assertEqual(moves['g1'], 'h3f3')
+        self.assertTrue(is_legal(board, chess.Move.from_uci('e2e4')))
+        self.assertFalse(is_legal(board, chess.Move.from_uci('e2e5')))
+
+        promotion = chess.Board('8/4P3/8/8/8/8/k7/7K w - - 0 1')
+        self.assertEqual(legal_move_map(promotion)['e7'], 'e8')
+        self.assertTrue(is_legal(promotion, chess.Move.from_uci('e7e8q')))
+        self.assertFalse(is_legal(promotion, chess.Move.from_uci('e7e8')))
+
+    def test_transpositions_share_one_entry(self):
+        first, second = chess.Board(), chess.Board()
+        for uci in ('g1f3', 'g8f6', 'b1c3', 'b8c6'):
+            first.push_uci(uci)
+        for uci in ('b1c3', 'b8c6', 'g1f3', 'g8f6'):
+            second.push_uci(uci)
+        legal_move_map(first)
+        hits = legal_moves_cache_info().hits
+        self.assertIs(legal_move_map(second), legal_move_map(first))
+        self.assertEqual(legal_moves_cache_info().hits, hits + 2)
+
+    def test_board_state_api(self):
+        white = User.objects.create_user('white')
+        game = Game.objects.create(white_player=white, black_player=User.objects.create_user('black'))
+        self.client.force_login(white)
+        url = f'/api/games/{game.id}/board_state/'
+        self.assertNotIn('legal_moves', self.client.get(url).json())
+        self.assertEqual(self.client.get(f'{url}?legal_moves=1').json()['legal_moves']['b1'], 'c3a3')
+        self.assertIn('legal_moves', self.client.get('/api/solo/?legal_moves=1').json())
+
+
+class BoardDiffTests(ChessTestCase):
+    def setUp(self):
+        super().setUp()
+        self.white = User.objects.create_user('white')
+        self.black = User.objects.create_user('black')
+        self.game = Game.objects.create(white_player=self.white, black_player=self.black)
+        for player, uci in [(self.white, 'e2e4'), (self.black, 'e7e5'), (self.white, 'g1f3')]:
+            self.client.force_login(player)
+            self.client.post(f'/api/games/{self.game.id}/make_move/', {'from_square': uci[:2], 'to_square': uci[2:]})
+
+    def test_diff_contains_only_changed_squares(self):
+        full = self.client.get(f'/api/games/{self.game.id}/board_state/').json()
+        diff = self.client.get(f'/api/games/{self.game.id}/board_state/?base_ply=1').json()
+
+        self.assertNotIn('board_dict', diff)
+        self.assertEqual((diff['base_ply'], diff['ply']), (1, 3))
+        self.assertEqual(diff['changed'], {
+            'e7': '&nbsp;', 'e5': '&#9823;', 'g1': '&nbsp;', 'f3': '&#9816;'
+        })
+        self.assertEqual(diff['checksum'], full['checksum'])
+
+        squares = full['board_dict']
+        text = '|'.join(squares[name] for name in chess.SQUARE_NAMES)
+        self.assertEqual(full['checksum'], '%08x' % zlib.crc32(text.encode()))
+
+    def test_diff_for_plies_off_the_cached_stack_is_replayed(self):
+        board_cache.clear()
+        diff = self.client.get(f'/api/games/{self.game.id}/board_state/?base_ply=0').json()
+        self.assertEqual(set(diff['changed']), {'e2', 'e4', 'e7', 'e5', 'g1', 'f3'})
+
+
+class GameHistoryPaginationTests(ChessTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.client.force_login(self.alice)
+
+    def _finish_games(self, count, moves=2):
+        knights = [chess.Move.from_uci(uci) for uci in ('g1f3', 'g8f6', 'f3g1', 'f6g8')]
+        for _ in range(count):
+            Game.objects.create(
+                white_player=self.alice, black_player=self.bob,
+                status='resigned', outcome='black_resigned', winner=self.alice,
+                move_count=moves, packed_moves=pack_moves([knights[ply % 4] for ply in range(moves)]),
+            )
+
+    def _history_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_cursor_walks_every_game_once(self):
+        self._finish_games(7)
+        # identical timestamps must still be split on id
+        Game.objects.update(updated_at=Game.objects.first().updated_at)
+
+        seen = []
+        url = '/api/games/history/?page_size=3'
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page['results']), 3)
+            self.assertNotIn('moves', page['results'][0])
+            seen.extend(game['id'] for game in page['results'])
+            url = page['next']
+        self.assertEqual(seen, sorted(Game.objects.values_list('id', flat=True), reverse=True))
+
+    def test_query_count_is_flat_in_games_and_moves(self):
+        self._finish_games(2)
+        few = self._history_queries('/api/games/history/')
+        few_with_moves = self._history_queries('/api/games/history/?include=moves')
+        self._finish_games(15, moves=10)
+        self.assertEqual(self._history_queries('/api/games/history/'), few)
+        self.assertEqual(self._history_queries('/api/games/history/?include=moves'), few_with_moves)
+        self.assertEqual(few_with_moves, few)
+
+        page = self.client.get('/api/games/?include=moves').json()
+        self.assertEqual(len(page['results']), 17)
+        self.assertEqual(page['results'][0]['moves'][0]['player']['username'], 'alice')
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get('/api/games/history/?cursor=bogus')
+        self.assertEqual(response.status_code, 404)
+
+
+class ActiveGameConstraintTests(ChessTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.carol = User.objects.create_user('carol')
+
+    def test_second_active_game_in_the_same_seat_is_rejected(self):
+        Game.objects.create(white_player=self.alice, black_player=self.bob)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Game.objects.create(white_player=self.alice, black_player=self.carol)
+        # finished games do not count
+        Game.objects.update(status='completed')
+        Game.objects.create(white_player=self.alice, black_player=self.carol)
+
+    def test_player_cannot_be_seated_in_two_games_in_different_colours(self):
+        self.assertIsNotNone(start_game(GameChallenge.objects.create(challenger=self.alice, challenged=self.bob)))
+        # carol challenges alice: alice would be black here, white in her game with bob
+        self.assertIsNone(start_game(GameChallenge.objects.create(challenger=self.carol, challenged=self.alice)))
+        self.assertEqual(Game.objects.filter(status='active').count(), 1)
+
+    def test_finished_game_frees_its_players(self):
+        game = start_game(GameChallenge.objects.create(challenger=self.alice, challenged=self.bob))
+        self.client.force_login(self.bob)
+        self.assertEqual(self.client.post(f'/api/games/{game.id}/resign/').status_code, 200)
+        self.assertFalse(ActivePlayer.objects.exists())
+        self.assertIsNotNone(start_game(GameChallenge.objects.create(challenger=self.carol, challenged=self.alice)))
+
+    def test_accept_after_a_lost_race_leaves_the_challenge_pending(self):
+        challenge = GameChallenge.objects.create(challenger=self.alice, challenged=self.bob)
+        # alice's other challenge was accepted in the meantime
+        Game.objects.create(white_player=self.alice, black_player=self.carol)
+
+        self.client.force_login(self.bob)
+        response = self.client.post(f'/api/challenges/{challenge.id}/accept/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'alice is already in a game')
+        challenge.refresh_from_db()
+        self.assertEqual(challenge.status, 'pending')
+        self.assertEqual(Game.objects.filter(status='active').count(), 1)
+
+    def test_explain_hot_queries_shows_new_indexes(self):
+        out = io.StringIO()
+        call_command('explain_hot_queries', stdout=out)
+        before, after = out.getvalue().split('pending challenges')[1].split('after:')[:2]
+        self.assertNotIn('challenge_challenged_status', before)
+        self.assertIn('challenge_challenged_status', after)
+
+
+class MoveCommitTests(ChessTestCase):
+    def setUp(self):
+        super().setUp()
+        self.white = User.objects.create_user('white')
+        self.black = User.objects.create_user('black')
+        self.game = Game.objects.create(white_player=self.white, black_player=self.black)
+
+    def test_move_is_one_update_and_one_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            result = apply_move(self.game, self.white, 'e2', 'e4')
+        self.assertTrue(result.ok)
+        writes = [
+            q['sql'].replace(' OR IGNORE', '').split()[:3]
+            for q in queries if q['sql'].split()[0] in ('UPDATE', 'INSERT')
+        ]
+        # plus the position index rows, inserted OR IGNORE next to index_positions
+        self.assertEqual(writes, [
+            ['UPDATE', '"chess_game_game"', 'SET'],
+            ['INSERT', 'INTO', '"chess_game_move"'],
+            ['INSERT', 'INTO', '"chess_game_positionindex"'],
+        ])
+
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.move_count, self.game.current_turn), (1, 'black'))
+        self.assertIn('4P3', self.game.board_state)
+
+    def test_stale_copy_gets_a_conflict(self):
+        stale = Game.objects.get(pk=self.game.pk)
+        self.assertTrue(apply_move(self.game, self.white, 'e2', 'e4').ok)
+
+        result = apply_move(stale, self.white, 'd2', 'd4')
+        self.assertEqual(result.status, MoveResult.CONFLICT)
+        self.assertEqual(list(self.game.moves.values_list('notation', flat=True)), ['e2e4'])
+
+        # the cached board was rolled back, the game carries on from the stored position
+        self.game.refresh_from_db()
+        self.assertTrue(apply_move(self.game, self.black, 'e7', 'e5').ok)
+        with self.game.cached_board() as board:
+            self.assertEqual(board.fen(), self.game.board_state)
+
+    def test_resigning_a_stale_copy_keeps_the_last_move(self):
+        stale = Game.objects.get(pk=self.game.pk)
+        self.assertTrue(apply_move(self.game, self.white, 'e2', 'e4').ok)
+
+        self.assertTrue(record_resignation(stale, self.black).ok)
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.status, self.game.outcome), ('resigned', 'black_resigned'))
+        self.assertEqual(self.game.winner, self.white)
+        self.assertEqual((self.game.move_count, self.game.current_turn), (1, 'black'))
+        self.assertEqual(len(unpack_moves(self.game.packed_moves)), 1)
+
+    def test_resigning_a_finished_game_is_refused(self):
+        stale = Game.objects.get(pk=self.game.pk)
+        for from_square, to_square in (('f2', 'f3'), ('e7', 'e5'), ('g2', 'g4'), ('d8', 'h4')):
+            player = self.white if self.game.move_count % 2 == 0 else self.black
+            self.assertTrue(apply_move(self.game, player, from_square, to_square).ok)
+
+        self.assertEqual(record_resignation(stale, self.white).status, MoveResult.NOT_ACTIVE)
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.status, self.game.outcome), ('completed', 'black_wins'))
+
+
+class PackedMovesTests(ChessTestCase):
+    def setUp(self):
+        super().setUp()
+        self.white = User.objects.create_user('white')
+        self.black = User.objects.create_user('black')
+        self.game = Game.objects.create(white_player=self.white, black_player=self.black)
+
+    def test_codes_round_trip_with_promotions(self):
+        moves = [chess.Move.from_uci(uci) for uci in ('e2e4', 'a7a8q', 'h2h1n', 'b7c8r', 'g2g1b')]
+        self.assertEqual(len(pack_moves(moves)), 2 * len(moves))
+        self.assertEqual(unpack_moves(pack_moves(moves)), moves)
+
+    def test_moves_are_packed_into_the_game_row(self):
+        for player, uci in [(self.white, 'e2e4'), (self.black, 'e7e5'), (self.white, 'g1f3')]:
+            self.assertTrue(apply_move(self.game, player, uci[:2], uci[2:]).ok)
+
+        game = Game.objects.select_related('white_player', 'black_player').get(pk=self.game.pk)
+        with self.assertNumQueries(0):
+            moves = game_moves(game)
+        self.assertEqual([m['notation'] for m in moves], ['e2e4', 'e7e5', 'g1f3'])
+        self.assertEqual([m['piece'] for m in moves], ['P', 'p', 'N'])
+        self.assertEqual([m['player'] for m in moves], [self.white, self.black, self.white])
+        stored = list(game.moves.order_by('id').values_list('timestamp', flat=True))
+        for move, timestamp in zip(moves, stored):
+            self.assertLess(abs((move['timestamp'] - timestamp).total_seconds()), 0.01)
+
+    def test_move_times_stay_exact_to_the_millisecond(self):
+        line = ['g1f3', 'g8f6', 'f3g1', 'f6g8'] * 10
+        times = []
+        for ply, uci in enumerate(line):
+            self.assertTrue(apply_move(self.game, (self.white, self.black)[ply % 2], uci[:2], uci[2:]).ok)
+            times.append(self.game.updated_at)
+
+        game = Game.objects.get(pk=self.game.pk)
+        for decoded, timestamp in zip(unpack_times(game.created_at, game.packed_times), times):
+            self.assertLessEqual(abs((decoded - timestamp).total_seconds()), 0.0005)
+
+    @override_settings(STORE_MOVE_ROWS=False)
+    def test_move_rows_are_optional(self):
+        self.assertTrue(apply_move(self.game, self.white, 'e2', 'e4').ok)
+        self.assertFalse(self.game.moves.exists())
+        self.client.force_login(self.white)
+        response = self.client.get(f'/api/games/{self.game.id}/')
+        self.assertEqual(response.json()['moves'][0]['notation'], 'e2e4')
+
+    def test_backfill_packs_existing_move_rows(self):
+        migration = importlib.import_module('chess_game.migrations.0003_packed_moves')
+        for player, uci in [(self.white, 'e2e4'), (self.black, 'e7e5')]:
+            Move.objects.create(game=self.game, player=player, from_square=uci[:2], to_square=uci[2:],
+                                piece='P', notation=uci)
+        Game.objects.filter(pk=self.game.pk).update(move_count=2)
+
+        migration.backfill_packed_moves(django_apps, None)
+        self.game.refresh_from_db()
+        self.assertEqual([m.uci() for m in unpack_moves(self.game.packed_moves)], ['e2e4', 'e7e5'])
+
+
+class PgnExportTests(ChessTestCase):
+    def setUp(self):
+        super().setUp()
+        self.white = User.objects.create_user('white')
+        self.black = User.objects.create_user('black')
+        self.game = Game.objects.create(white_player=self.white, black_player=self.black)
+        # fool's mate
+        for player, uci in [(self.white, 'f2f3'), (self.black, 'e7e5'), (self.white, 'g2g4'), (self.black, 'd8h4')]:
+            self.assertTrue(apply_move(self.game, player, uci[:2], uci[2:]).ok)
+        Game.objects.create(white_player=self.white, black_player=self.black)  # still active, not exported
+
+    def test_game_to_pgn(self):
+        self.game.refresh_from_db()
+        text = game_to_pgn(self.game)
+        self.assertIn('[White "white"]', text)
+        self.assertIn('[Result "0-1"]', text)
+        self.assertIn('1. f3 e5 2. g4 Qh4# 0-1', text)
+
+    def test_export_endpoint_streams_finished_games(self):
+        self.client.force_login(self.white)
+        response = self.client.get('/api/games/export/')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-chess-pgn')
+        body = b''.join(response.streaming_content).decode()
+        self.assertEqual(body.count('[Event '), 1)
+
+    async def test_export_streams_asynchronously_under_asgi(self):
+        await sync_to_async(self.client.force_login)(self.white)
+        self.async_client.cookies = self.client.cookies
+        response = await self.async_client.get('/api/games/export/')
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(body, await sync_to_async(game_to_pgn)(await Game.objects.aget(pk=self.game.pk)))
+
+    def test_export_command(self):
+        out = io.StringIO()
+        call_command('export_pgn', '--chunk-size', '1', stdout=out, stderr=io.StringIO())
+        self.assertEqual(out.getvalue(), game_to_pgn(Game.objects.get(pk=self.game.pk)))
+
+
+IMPORT_PGN = """[Event "Casual"]
+[White "anna"]
+[Black "boris"]
+[Result "0-1"]
+
+1. f3 e5 2. g4 Qh4# 0-1
+
+[Event "Casual"]
+[White "boris"]
+[Black "anna"]
+[Result "1/2-1/2"]
+
+1. e4 e5 2. Nf3 Nc6 1/2-1/2
+
+[Event "Broken"]
+[White "anna"]
+[Black "boris"]
+[Result "1-0"]
+
+1. e4 e5 2. Ke3 1-0
+"""
+
+
+class PgnImportTests(ChessTestCase):
+    def _import(self, *args, text=IMPORT_PGN):
+        with tempfile.NamedTemporaryFile('w', suffix='.pgn', delete=False) as pgn_file:
+            pgn_file.write(text)
+        self.addCleanup(os.unlink, pgn_file.name)
+        out = io.StringIO()
+        call_command('import_pgn', pgn_file.name, *args, stdout=out)
+        return out.getvalue()
+
+    def test_import_in_worker_processes(self):
+        report = self._import('--workers', '2', '--batch-size', '1')
+        self.assertIn('Imported 2 games (8 moves), skipped 1 invalid', report)
+        self.assertIn('games/s', report)
+
+        anna = User.objects.get(username='pgn-anna')
+        self.assertFalse(anna.has_usable_password())
+        mate = Game.objects.get(white_player=anna)
+        self.assertEqual((mate.status, mate.outcome, mate.winner.username), ('completed', 'black_wins', 'pgn-boris'))
+        self.assertEqual([m.uci() for m in unpack_moves(mate.packed_moves)], ['f2f3', 'e7e5', 'g2g4', 'd8h4'])
+        self.assertEqual(Move.objects.filter(game=mate).count(), 4)
+        self.assertEqual(mate.positions.count(), 5)
+
+    def test_players_never_land_on_registered_accounts(self):
+        anna = User.objects.create_user('anna', password='pass12345')
+        squatter = User.objects.create_user('pgn-boris', password='pass12345')
+        self._import('--workers', '0', text=IMPORT_PGN.replace('"anna"', '"Carlsen, Magnus"'))
+        self._import('--workers', '0')
+
+        self.assertFalse(Game.objects.filter(white_player__in=[anna, squatter]).exists())
+        self.assertFalse(Game.objects.filter(black_player__in=[anna, squatter]).exists())
+        imported = User.objects.filter(username__startswith='pgn-').exclude(pk=squatter.pk)
+        self.assertCountEqual(imported.values_list('username', flat=True), ['pgn-Carlsen-Magnus', 'pgn-anna', 'pgn-boris-2'])
+        self.assertFalse(any(user.has_usable_password() for user in imported))
+        self.assertEqual(Game.objects.filter(white_player__username='pgn-boris-2').count(), 2)
+
+    def test_imported_games_export_again(self):
+        self._import('--workers', '0')
+        exported = ''.join(game_to_pgn(game) for game in Game.objects.order_by('id'))
+        self.assertIn('1. f3 e5 2. g4 Qh4# 0-1', exported)
+        self.assertIn('1. e4 e5 2. Nf3 Nc6 1/2-1/2', exported)
+
+
+class PositionIndexTests(ChessTestCase):
+    def setUp(self):
+        super().setUp()
+        self.players = [User.objects.create_user(name) for name in ('a', 'b', 'c', 'd')]
+
+    def _play(self, white, black, line):
+        game = Game.objects.create(white_player=white, black_player=black)
+        for ply, uci in enumerate(line.split()):
+            self.assertTrue(apply_move(game, white if ply % 2 == 0 else black, uci[:2], uci[2:]).ok)
+        return game
+
+    def test_transpositions_find_both_games(self):
+        a, b, c, d = self.players
+        first = self._play(a, b, 'g1f3 g8f6 b1c3')
+        second = self._play(c, d, 'b1c3 g8f6 g1f3')
+        self.assertEqual(PositionIndex.objects.filter(game=first).count(), 4)
+
+        self.client.force_login(a)
+        board = chess.Board()
+        for uci in ('g1f3', 'g8f6', 'b1c3'):
+            board.push_uci(uci)
+        response = self.client.get(f'/api/positions/{board.fen()}/games/')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual({game['id'] for game in data['results']}, {first.id, second.id})
+        self.assertIsNone(data['next'])
+
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(f'/api/positions/{chess.STARTING_FEN}/games/?page_size=1').json()
+        self.assertEqual(len(data['results']), 1)
+        self.assertIsNotNone(data['next'])
+        self.assertFalse([q for q in queries if 'COUNT(' in q['sql']])
+        self.assertEqual(self.client.get('/api/positions/not-a-fen/games/').status_code, 400)
+
+    def test_backfill_command(self):
+        a, b, _, _ = self.players
+        moves = [chess.Move.from_uci(uci) for uci in ('e2e4', 'e7e5')]
+        game = Game.objects.create(
+            white_player=a, black_player=b, status='completed', move_count=2, packed_moves=pack_moves(moves)
+        )
+        call_command('index_positions', stdout=io.StringIO())
+        self.assertEqual(list(game.positions.order_by('ply').values_list('ply', flat=True)), [0, 1, 2])
+        # already indexed games are skipped
+        out = io.StringIO()
+        call_command('index_positions', stdout=out)
+        self.assertIn('Indexed 0 games', out.getvalue())
+
+    def test_backfill_fills_games_indexed_mid_play(self):
+        a, b, _, _ = self.players
+        moves = [chess.Move.from_uci(uci) for uci in ('e2e4', 'e7e5')]
+        game = Game.objects.create(white_player=a, black_player=b, move_count=2, packed_moves=pack_moves(moves))
+        self.assertTrue(apply_move(game, a, 'g1', 'f3').ok)
+        call_command('index_positions', stdout=io.StringIO())
+        self.assertEqual(list(game.positions.order_by('ply').values_list('ply', flat=True)), [0, 1, 2, 3])
+        # a row the backfill already wrote does not break the next move
+        PositionIndex.objects.create(game=game, ply=4, zobrist=0)
+        self.assertTrue(apply_move(game, b, 'b8', 'c6').ok)
+        self.assertEqual(game.positions.count(), 5)
+
+
+@override_settings(REPLAY_CHECKPOINT_INTERVAL=4)
+class ReplayTests(ChessTestCase):
+    LINE = 'e2e4 e7e5 g1f3 b8c6 f1b5 a7a6 b5a4 g8f6 e1g1 f8e7 f1e1'
+
+    def setUp(self):
+        super().setUp()
+        self.white = User.objects.create_user('white')
+        self.black = User.objects.create_user('black')
+        self.game = Game.objects.create(white_player=self.white, black_player=self.black)
+        for ply, uci in enumerate(self.LINE.split()):
+            player = self.white if ply % 2 == 0 else self.black
+            self.assertTrue(apply_move(self.game, player, uci[:2], uci[2:]).ok)
+        self.game.refresh_from_db()
+
+    def test_checkpoints_every_interval(self):
+        self.assertEqual([line.split()[0] for line in self.game.checkpoints.splitlines()], ['4', '8'])
+        self.assertEqual(self.game.checkpoints, build_checkpoints(unpack_moves(self.game.packed_moves)))
+
+    def test_seek_replays_at_most_one_interval(self):
+        full = chess.Board()
+        for ply, move in enumerate([None] + unpack_moves(self.game.packed_moves)):
+            if move:
+                full.push(move)
+            board = board_at_ply(self.game, ply)
+            self.assertEqual(board.fen(), full.fen())
+            self.assertLess(len(board.move_stack), 4)
+        self.assertIsNone(board_at_ply(self.game, 12))
+
+    def test_position_endpoints(self):
+        self.client.force_login(self.black)
+        data = self.client.get(f'/api/games/{self.game.id}/position/?ply=9').json()
+        self.assertEqual((data['uci'], data['san']), ('e1g1', 'O-O'))
+        self.assertEqual(list(data['board_dict'])[0], 'h1')
+        # checkpoint plies rebuild the board with no move stack
+        checkpoint = self.client.get(f'/api/games/{self.game.id}/position/?ply=8').json()
+        self.assertEqual((checkpoint['uci'], checkpoint['san']), ('g8f6', 'Nf6'))
+        start = self.client.get(f'/api/games/{self.game.id}/position/?ply=0').json()
+        self.assertEqual((start['uci'], start['san']), (None, None))
+        self.assertEqual(self.client.get(f'/api/games/{self.game.id}/position/?ply=12').status_code, 400)
+        self.assertEqual(self.client.get(f'/api/games/{self.game.id}/position/').status_code, 400)
+
+        positions = self.client.get(f'/api/games/{self.game.id}/positions/').json()['positions']
+        self.assertEqual(len(positions), 12)
+        self.assertEqual(positions[9]['fen'], data['fen'])
+
+
+@override_settings(ENGINE_WORKERS=0, ENGINE_TIME_LIMIT=0.2)
+class EngineTests(ChessTestCase):
+    def test_finds_mate_in_one(self):
+        result = engine.search('6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1', time_limit=1.0)
+        self.assertEqual(result['san'], 'Ra8#')
+        self.assertEqual(result['score'], engine.MATE - 1)
+
+    def test_respects_time_budget(self):
+        result = engine.search(chess.STARTING_FEN, time_limit=0.2)
+        self.assertIn(chess.Move.from_uci(result['move']), chess.Board().legal_moves)
+        self.assertGreaterEqual(result['depth'], 1)
+        self.assertLess(result['time'], 1.0)
+        self.assertGreater(result['nps'], 0)
+
+    def test_game_over_has_no_move(self):
+        self.assertIsNone(engine.search('7k/5QQ1/8/8/8/8/8/K7 b - - 0 1')['move'])
+
+    def test_solo_engine_reply(self):
+        token = self.client.get('/api/solo/').json()['token']
+        token = self.client.post(
+            '/api/solo/', {'token': token, 'from_square': 'e2', 'to_square': 'e4'}, content_type='application/json'
+        ).json()['token']
+        data = self.client.post('/api/solo/engine/', {'token': token}, content_type='application/json').json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['board_state']['current_turn'], 'white')
+        self.assertIn('nps', data['engine'])
+        self.assertEqual(board_from_token(data['token']).fullmove_number, 2)
+        self.assertEqual(self.client.get('/api/solo/engine/').status_code, 405)
+
+    def test_solo_engine_needs_no_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        token = client.get('/api/solo/').json()['token']
+        response = client.post('/api/solo/engine/', {'token': token}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(ENGINE_WORKERS=1)
+    def test_searches_on_process_pool(self):
+        self.addCleanup(engine.shutdown_pool)
+        result = async_to_sync(engine.analyse)(chess.STARTING_FEN, 0.1)
+        self.assertIsNotNone(engine.get_pool())
+        self.assertIsNotNone(result['move'])
+
+
+@override_settings(ENGINE_WORKERS=0, ANALYSIS_DEPTH=2)
+class AnalysisTests(ChessTestCase):
+    def setUp(self):
+        super().setUp()
+        self.players = [User.objects.create_user(name) for name in ('a', 'b', 'c')]
+
+    def _finished(self, white, black, line):
+        moves = [chess.Move.from_uci(uci) for uci in line.split()]
+        return Game.objects.create(
+            white_player=white, black_player=black, status='completed',
+            move_count=len(moves), packed_moves=pack_moves(moves)
+        )
+
+    def test_analyze_reuses_shared_positions(self):
+        a, b, c = self.players
+        first = self._finished(a, b, 'f2f3 e7e5 g2g4 d8h4')
+        self.client.force_login(a)
+        data = self.client.post(f'/api/games/{first.id}/analyze/').json()
+        self.assertEqual((data['depth'], data['cached'], data['computed']), (2, 0, 5))
+        self.assertEqual(len(data['evaluations']), 5)
+        # black has mated white
+        self.assertLessEqual(data['evaluations'][-1]['score'], -engine.MATE + 1)
+        self.assertEqual(data['evaluations'][3]['best_move'], 'd8h4')
+
+        # same opening, different game: only the new position is searched
+        second = self._finished(c, a, 'f2f3 e7e5 g2g4 e5e4')
+        data = self.client.post(f'/api/games/{second.id}/analyze/?depth=1').json()
+        self.assertEqual((data['depth'], data['cached'], data['computed']), (1, 4, 1))
+        self.assertEqual(PositionEvaluation.objects.count(), 6)
+
+    def test_rejects_unfinished_and_foreign_games(self):
+        a, b, c = self.players
+        active = Game.objects.create(white_player=a, black_player=b)
+        self.client.force_login(a)
+        self.assertEqual(self.client.post(f'/api/games/{active.id}/analyze/').status_code, 400)
+        self.client.force_login(c)
+        self.assertEqual(self.client.post(f'/api/games/{active.id}/analyze/').status_code, 404)
+
+    def test_evicts_least_recently_used(self):
+        PositionEvaluation.objects.bulk_create([
+            PositionEvaluation(zobrist=key, depth=1, score=0) for key in range(12)
+        ])
+        PositionEvaluation.objects.filter(zobrist__lt=6).update(last_used='2000-01-01T00:00:00Z')
+        self.assertEqual(evict(capacity=10), 3)
+        self.assertFalse(PositionEvaluation.objects.filter(zobrist__lt=3).exists())
+        self.assertEqual(evict(capacity=10), 0)
+
+
+class SoloTokenTests(ChessTestCase):
+    def _move(self, token, uci):
+        return self.client.post('/api/solo/', {
+            'token': token, 'from_square': uci[:2], 'to_square': uci[2:4], 'promotion': uci[4:]
+        }, content_type='application/json')
+
+    def test_solo_game_runs_on_tokens_without_database_access(self):
+        with CaptureQueriesContext(connection) as queries:
+            token = self.client.get('/api/solo/').json()['token']
+            for uci in ('e2e4', 'e7e5', 'g1f3'):
+                response = self._move(token, uci)
+                self.assertEqual(response.status_code, 200)
+                token = response.json()['token']
+        self.assertEqual(len(queries), 0)
+        self.assertNotIn('sessionid', self.client.cookies)
+
+        board = board_from_token(token)
+        self.assertEqual([move.uci() for move in board.move_stack], ['e2e4', 'e7e5', 'g1f3'])
+        self.assertEqual(response.json()['board_state']['current_turn'], 'black')
+        self.assertEqual(self._move(token, 'e2e4').status_code, 400)
+
+    def test_tampered_token_is_rejected(self):
+        token = self._move(self.client.get('/api/solo/').json()['token'], 'e2e4').json()['token']
+        signature = token.split(':')[1]
+        forged = make_token(chess.Board()).split(':')[0] + ':' + signature
+        response = self._move(forged, 'e7e5')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Invalid solo game token')
+
+
+class MetricsTests(ChessTransactionTestCase):
+    def test_prometheus_text_format(self):
+        registry = metrics.Registry()
+        histogram = metrics.Histogram('t_seconds', 'Test', ['route'], buckets=(0.1, 1), registry=registry)
+        histogram.observe(0.05, route='a"b')
+        histogram.observe(0.5, route='a"b')
+        histogram.observe(5, route='a"b')
+        metrics.Gauge('t_open', 'Open', ['group'], registry=registry).inc(group='lobby')
+
+        self.assertEqual(registry.render().splitlines(), [
+            '# HELP t_seconds Test',
+            '# TYPE t_seconds histogram',
+            't_seconds_bucket{route="a\\"b",le="0.1"} 1',
+            't_seconds_bucket{route="a\\"b",le="1.0"} 2',
+            't_seconds_bucket{route="a\\"b",le="+Inf"} 3',
+            't_seconds_sum{route="a\\"b"} 5.55',
+            't_seconds_count{route="a\\"b"} 3',
+            '# HELP t_open Open',
+            '# TYPE t_open gauge',
+            't_open{group="lobby"} 1',
+        ])
+
+    def test_request_latency_and_queries_by_view(self):
+        white = User.objects.create_user('white')
+        black = User.objects.create_user('black')
+        game = Game.objects.create(white_player=white, black_player=black)
+        self.client.force_login(white)
+        labels = {'route': 'game-make-move', 'method': 'POST'}
+        before = metrics.REQUEST_SECONDS.count(**labels)
+
+        response = self.client.post(f'/api/games/{game.id}/make_move/', {'from_square': 'e2', 'to_square': 'e4'})
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(metrics.REQUEST_SECONDS.count(**labels), before + 1)
+        self.assertEqual(metrics.REQUEST_QUERIES.count(**labels), before + 1)
+        with self.settings(DEBUG=True):
+            body = self.client.get('/metrics').content.decode()
+        self.assertIn('chess_http_request_duration_seconds_count{route="game-make-move",method="POST"}', body)
+        # the query histogram saw this request's queries, not zero
+        zero_bucket = 'chess_http_request_queries_bucket{route="game-make-move",method="POST",le="0.0"} 0'
+        self.assertIn(zero_bucket, body)
+
+    def test_unknown_methods_and_paths_share_one_series(self):
+        unmatched = metrics.RESPONSES.value(route='other', status=404)
+        brewed = metrics.REQUEST_SECONDS.count(route='game-list', method='other')
+        for method, path in (('BREW', '/api/games/'), ('PROPFIND', '/api/nowhere/'), ('GET', '/api/nowhere/else/')):
+            self.client.generic(method, path)
+        self.assertEqual(metrics.RESPONSES.value(route='other', status=404), unmatched + 2)
+        self.assertEqual(metrics.REQUEST_SECONDS.count(route='game-list', method='other'), brewed + 1)
+        with self.settings(DEBUG=True):
+            body = self.client.get('/metrics').content.decode()
+        self.assertNotIn('BREW', body)
+        self.assertNotIn('PROPFIND', body)
+        self.assertNotIn('unmatched', body)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_scrape_requires_token_when_set(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+
+    @override_settings(METRICS_TOKEN='', DEBUG=False)
+    def test_scrape_without_token_is_refused_in_production(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    async def test_socket_gauge_event_time_and_database_wait(self):
+        white = await sync_to_async(User.objects.create_user)('white')
+        black = await sync_to_async(User.objects.create_user)('black')
+        game = await sync_to_async(Game.objects.create)(white_player=white, black_player=black)
+        open_before = metrics.OPEN_SOCKETS.value(group='game')
+        waits_before = metrics.DB_QUEUE_SECONDS.count()
+        events_before = metrics.EVENT_SECONDS.count(event='game.move')
+
+        communicator = WebsocketCommunicator(GameConsumer.as_asgi(), f'/ws/game/{game.id}/')
+        communicator.scope['user'] = white
+        communicator.scope['url_route'] = {'kwargs': {'game_id': str(game.id)}}
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(metrics.OPEN_SOCKETS.value(group='game'), open_before + 1)
+        self.assertGreater(metrics.DB_QUEUE_SECONDS.count(), waits_before)
+
+        await communicator.send_json_to({'action': 'move', 'id': 1, 'from_square': 'e2', 'to_square': 'e4'})
+        self.assertEqual((await communicator.receive_json_from())['action'], 'move_ack')
+        self.assertEqual((await communicator.receive_json_from())['action'], 'game_move')
+        self.assertEqual(metrics.EVENT_SECONDS.count(event='game.move'), events_before + 1)
+
+        await communicator.disconnect()
+        self.assertEqual(metrics.OPEN_SOCKETS.value(group='game'), open_before)
+
+
+# an ASGI worker process holding one websocket in the game_1 group
+CHANNEL_WORKER = """
+import json
+
+import django
+from asgiref.sync import async_to_sync
+
+django.setup()
+
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.testing import WebsocketCommunicator
+
+
+class GameSocket(AsyncJsonWebsocketConsumer):
+    async def connect(self):
+        await self.channel_layer.group_add('game_1', self.channel_name)
+        await self.accept()
+
+    async def game_move(self, event):
+        await self.send_json(event['moves'])
+
+
+async def main():
+    communicator = WebsocketCommunicator(GameSocket.as_asgi(), '/ws/game/1/')
+    await communicator.connect()
+    print('ready', flush=True)
+    print(json.dumps(await communicator.receive_json_from(timeout=10)), flush=True)
+    await communicator.disconnect()
+
+async_to_sync(main)()
+"""
+
+
+class SQLiteChannelLayerTests(ChessTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'channels.sqlite3')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    async def test_group_send_reaches_other_instance(self):
+        worker_a = SQLiteChannelLayer(self.path)
+        worker_b = SQLiteChannelLayer(self.path)
+        channel = await worker_a.new_channel()
+        await worker_a.group_add('lobby', channel)
+
+        await worker_b.group_send('lobby', {'type': 'lobby.refresh'})
+        self.assertEqual(await asyncio.wait_for(worker_a.receive(channel), 2), {'type': 'lobby.refresh'})
+
+        await worker_a.group_discard('lobby', channel)
+        await worker_b.group_send('lobby', {'type': 'lobby.refresh'})
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(worker_a.receive(channel), 0.2)
+
+    async def test_capacity_and_expiry(self):
+        layer = SQLiteChannelLayer(self.path, capacity=1, expiry=0.05)
+        channel = await layer.new_channel()
+        await layer.group_add('lobby', channel)
+        await layer.send(channel, {'type': 'first'})
+        with self.assertRaises(ChannelFull):
+            await layer.send(channel, {'type': 'second'})
+        # full members of a group are skipped instead of failing the send
+        await layer.group_send('lobby', {'type': 'third'})
+
+        await asyncio.sleep(0.1)
+        await layer._run(layer._clean_sync)
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(layer.receive(channel), 0.2)
+        # a channel whose messages expired unread has left its groups
+        await layer.group_send('lobby', {'type': 'fourth'})
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(layer.receive(channel), 0.2)
+
+    def test_delivery_across_worker_processes(self):
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE='chess_project.settings',
+            CHANNEL_LAYER_DB_PATH=self.path,
+        )
+        workers = [
+            subprocess.Popen(
+                [sys.executable, '-c', CHANNEL_WORKER], env=env, text=True,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            )
+            for _ in range(3)
+        ]
+        try:
+            for worker in workers:
+                self.assertEqual(worker.stdout.readline().strip(), 'ready')
+
+            # this test process is a fourth worker, handling the move
+            layer = SQLiteChannelLayer(self.path)
+            async_to_sync(layer.group_send)('game_1', {'type': 'game.move', 'moves': [{'uci': 'e2e4'}]})
+
+            for worker in workers:
+                out, err = worker.communicate(timeout=20)
+                self.assertEqual(worker.returncode, 0, err)
+                self.assertEqual(json.loads(out), [{'uci': 'e2e4'}])
+        finally:
+            for worker in workers:
+                if worker.poll() is None:
+                    worker.kill()
+                    worker.wait()
@@ -1,18 +1,20 @@
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
 from django.contrib.auth.models import User
-from django.contrib.sessions.models import Session
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.shortcuts import get_object_or_404, redirect, render
-from django.utils.timezone import now
 from django.views.decorators.http import require_http_methods
 import chess
 
-from .models import Game, GameChallenge, Move
+from .models import ActivePlayer, Game, GameChallenge
+from .presence import online_user_ids
+from .rendering import board_state, is_legal, render_board
+from .services import (
+    apply_move, broadcast_game_reload, broadcast_lobby_reload, get_available_players,
+    record_resignation
+)
 
 
 def home_view(request):
@@ -35,8 +37,7 @@ def new_game_view(request):
         return redirect('chess_game:login')
     
     # Get available players (logged in users without active games)
-    available_players = get_logged_in_users_excluding_current(request)
-    available_players = [user for user in available_players if not get_active_game(user)]
+    available_players = get_available_players(request.user)
     
     # Get user's game history
     user_games = Game.objects.filter(
@@ -140,7 +141,7 @@ def play_solo_view(request):
                 board = chess.Board(request.session['solo_board'])
                 move = chess.Move.from_uci(f"{from_square}{to_square}")
                 
-                if move in board.legal_moves:
+                if is_legal(board, move):
                     board.push(move)
                     request.session['solo_board'] = board.fen()
                     request.session['solo_turn'] = 'black' if request.session['solo_turn'] == 'white' else 'white'
@@ -160,45 +161,14 @@ def play_solo_view(request):
     
     # Get current board state
     board = chess.Board(request.session['solo_board'])
-    board_dict = {}
-    
-    # Chess piece Unicode symbols
-    piece_symbols = {
-        'K': '&#9812;', 'Q': '&#9813;', 'R': '&#9814;', 'B': '&#9815;', 'N': '&#9816;', 'P': '&#9817;',
-        'k': '&#9818;', 'q': '&#9819;', 'r': '&#9820;', 'b': '&#9821;', 'n': '&#9822;', 'p': '&#9823;'
-    }
-    
-    # Convert board to dictionary
-    for row in range(8):
-        for col in range(8):
-            square = chess.square(col, 7 - row)
-            piece = board.piece_at(square)
-            
-            file_letter = chr(ord('a') + col)
-            rank_number = str(8 - row)
-            square_name = f"{file_letter}{rank_number}"
-            
-            if piece:
-                board_dict[square_name] = piece_symbols.get(piece.symbol(), '')
-            else:
-                board_dict[square_name] = '&nbsp;'
-    
+    state = board_state(board, request.session['solo_turn'], True)
     context = {
-        'board_dict': board_dict,
-        'current_turn': request.session['solo_turn'],
-        'is_game_over': board.is_game_over(),
-        'result': None
+        'board_dict': state['board_dict'],
+        'current_turn': state['current_turn'],
+        'is_game_over': state['is_game_over'],
+        'result': state['result']
     }
     
-    if board.is_game_over():
-        if board.is_checkmate():
-            winner = 'Black' if board.turn else 'White'
-            context['result'] = f'{winner} wins by checkmate!'
-        elif board.is_stalemate():
-            context['result'] = 'Draw by stalemate!'
-        elif board.is_insufficient_material():
-            context['result'] = 'Draw by insufficient material!'
-    
     return render(request, 'chess_game/play_solo.html', context)
 
 
@@ -211,7 +181,8 @@ def game_view(request):
         return redirect('chess_game:home')
     
     # Convert board to template-friendly format
-    board_dict = board_to_dict(active_game.get_board(), request.user, active_game)
+    with active_game.cached_board() as board:
+        board_dict = board_to_dict(board, request.user, active_game)
     
     # Check if it's the user's turn
     is_my_turn = active_game.is_players_turn(request.user)
@@ -258,7 +229,7 @@ def challenge_user(request, user_id):
         )
         messages.success(request, f'Challenge sent to {challenged_user.username}!')
     
-    broadcast_lobby_reload()
+    broadcast_lobby_reload([request.user.id, challenged_user.id])
     return redirect('chess_game:home')
 
 
@@ -271,18 +242,13 @@ def accept_challenge(request, challenge_id):
         messages.error(request, 'You already have an active game.')
         return redirect('chess_game:home')
     
-    # Create new game
-    game = Game.objects.create(
-        white_player=challenge.challenger,
-        black_player=challenge.challenged
-    )
-    
-    # Update challenge status
-    challenge.status = 'accepted'
-    challenge.save()
+    game = start_game(challenge)
+    if game is None:
+        messages.error(request, f'{challenge.challenger.username} is already in a game.')
+        return redirect('chess_game:home')
     
     messages.success(request, f'Challenge accepted! Game started with {challenge.challenger.username}.')
-    broadcast_lobby_reload()
+    broadcast_lobby_reload([challenge.challenger_id, challenge.challenged_id])
     broadcast_game_reload(game.id)
     return redirect('chess_game:game')
 
@@ -296,7 +262,7 @@ def decline_challenge(request, challenge_id):
     challenge.save()
     
     messages.info(request, f'Challenge from {challenge.challenger.username} declined.')
-    broadcast_lobby_reload()
+    broadcast_lobby_reload([challenge.challenger_id, challenge.challenged_id])
     return redirect('chess_game:home')
 
 
@@ -309,64 +275,16 @@ def make_move(request):
         messages.error(request, 'No active game found.')
         return redirect('chess_game:home')
     
-    if not active_game.is_players_turn(request.user):
-        messages.error(request, 'Not your turn.')
-        return redirect('chess_game:game')
-    
     from_square = request.POST.get('from_square')
     to_square = request.POST.get('to_square')
-    
-    if not from_square or not to_square:
-        messages.error(request, 'Invalid move data.')
-        return redirect('chess_game:game')
-    
-    # Validate move using python-chess
-    board = active_game.get_board()
-    try:
-        move = chess.Move.from_uci(f"{from_square}{to_square}")
-        if move in board.legal_moves:
-            # Execute move
-            piece = board.piece_at(chess.parse_square(from_square))
-            board.push(move)
-            active_game.update_board(board)
-            
-            # Record move
-            Move.objects.create(
-                game=active_game,
-                player=request.user,
-                from_square=from_square,
-                to_square=to_square,
-                piece=piece.symbol() if piece else '',
-                notation=str(move)
-            )
-            
-            # Update game state
-            active_game.current_turn = 'black' if active_game.current_turn == 'white' else 'white'
-            active_game.move_count += 1
-            
-            # Check for game end conditions
-            if board.is_checkmate():
-                active_game.status = 'completed'
-                active_game.winner = request.user
-                active_game.outcome = 'white_wins' if request.user == active_game.white_player else 'black_wins'
-            elif board.is_stalemate() or board.is_insufficient_material():
-                active_game.status = 'completed'
-                active_game.outcome = 'draw'
-            
-            active_game.save()
-            broadcast_game_reload(active_game.id)
-            if active_game.status != 'active':
-                broadcast_lobby_reload()
-            
-            messages.success(request, f'Move made: {from_square} to {to_square}')
-            return redirect('chess_game:game')
-        else:
-            messages.error(request, 'Invalid move.')
-            return redirect('chess_game:game')
-    except Exception as e:
-        messages.error(request, f'Invalid move: {str(e)}')
+    result = apply_move(active_game, request.user, from_square, to_square, request.POST.get('promotion'))
+    if not result.ok:
+        messages.error(request, result.error)
         return redirect('chess_game:game')
 
+    messages.success(request, f'Move made: {from_square} to {to_square}')
+    return redirect('chess_game:game')
+
 
 @login_required
 def resign_game(request):
@@ -376,18 +294,10 @@ def resign_game(request):
         messages.error(request, 'No active game found.')
         return redirect('chess_game:home')
     
-    # Determine winner and outcome
-    if request.user == active_game.white_player:
-        active_game.winner = active_game.black_player
-        active_game.outcome = 'white_resigned'
-    else:
-        active_game.winner = active_game.white_player
-        active_game.outcome = 'black_resigned'
-    
-    active_game.status = 'resigned'
-    active_game.save()
-    broadcast_game_reload(active_game.id)
-    broadcast_lobby_reload()
+    result = record_resignation(active_game, request.user)
+    if not result.ok:
+        messages.error(request, result.error)
+        return redirect('chess_game:home')
     
     opponent = active_game.get_opponent(request.user)
     messages.info(request, f'You resigned. {opponent.username} wins!')
@@ -397,18 +307,10 @@ def resign_game(request):
 # Helper Functions
 def get_logged_in_users_excluding_current(request):
     """Get all logged-in users excluding the current user"""
-    active_sessions = Session.objects.filter(expire_date__gte=now())
-    user_ids = []
-    
-    for session in active_sessions:
-        session_data = session.get_decoded()
-        user_id = session_data.get('_auth_user_id')
-        if user_id:
-            user_ids.append(user_id)
-    
-    # Convert IDs to unique set and exclude the current user
-    logged_in_users = User.objects.filter(id__in=set(user_ids)).exclude(id=request.user.id)
-    return logged_in_users
+    # presence registry is kept up to date by login/logout signals and sockets
+    user_ids = online_user_ids()
+    user_ids.discard(request.user.id)
+    return User.objects.filter(id__in=user_ids)
 
 
 def get_active_game(user):
@@ -419,63 +321,31 @@ def get_active_game(user):
     ).first()
 
 
-def board_to_dict(chess_board, user, game):
-    """Convert python-chess board to template-friendly dictionary"""
-    board_dict = {}
-    
-    # Chess piece Unicode symbols
-    piece_symbols = {
-        'K': '&#9812;', 'Q': '&#9813;', 'R': '&#9814;', 'B': '&#9815;', 'N': '&#9816;', 'P': '&#9817;',
-        'k': '&#9818;', 'q': '&#9819;', 'r': '&#9820;', 'b': '&#9821;', 'n': '&#9822;', 'p': '&#9823;'
-    }
-    
-    # Determine perspective (flip board for black player)
-    is_black_player = user == game.black_player
-    
-    for row in range(8):
-        for col in range(8):
-            square = chess.square(col, 7 - row) if not is_black_player else chess.square(7 - col, row)
-            piece = chess_board.piece_at(square)
-            
-            # Adjust coordinates based on player perspective
-            if is_black_player:
-                # For black player, flip both file and rank
-                file_letter = chr(ord('h') - col)  # h,g,f,e,d,c,b,a
-                rank_number = str(row + 1)        # 1,2,3,4,5,6,7,8
-            else:
-                # For white player, standard coordinates
-                file_letter = chr(ord('a') + col)  # a,b,c,d,e,f,g,h
-                rank_number = str(8 - row)         # 8,7,6,5,4,3,2,1
-            
-            square_name = f"{file_letter}{rank_number}"
-            
-            if piece:
-                board_dict[square_name] = piece_symbols.get(piece.symbol(), '')
-            else:
-                board_dict[square_name] = '&nbsp;'
-    
-    return board_dict
-
-
-def broadcast_lobby_reload():
-    """Notify lobby websocket clients to refresh."""
-    channel_layer = get_channel_layer()
-    if channel_layer is None:
-        return
-
-    async_to_sync(channel_layer.group_send)(
-        'lobby',
-        {'type': 'lobby.refresh'},  # project-3
-    )
+def start_game(challenge):
+    """Create the game for an accepted challenge, None when a player is already playing.
 
+    Seating both players in ActivePlayer makes this safe against racing
+    accepts, whatever colours the players would get; get_active_game checks
+    beforehand only give the nicer error message.
+    """
+    try:
+        with transaction.atomic():
+            game = Game.objects.create(
+                white_player=challenge.challenger,
+                black_player=challenge.challenged
+            )
+            ActivePlayer.objects.bulk_create([
+                ActivePlayer(user=game.white_player, game=game),
+                ActivePlayer(user=game.black_player, game=game),
+            ])
+            challenge.status = 'accepted'
+            challenge.save()
+    except IntegrityError:
+        return None
+    return game
 
-def broadcast_game_reload(game_id):
-    """Notify game websocket clients to refresh."""
-    channel_layer = get_channel_layer()
-    if channel_layer is None:
-        return
 
-    async_to_sync(channel_layer.group_send)(
-        f'game_{game_id}',
-        {'type': 'game.refresh'},  # project-3
-    )
\ No newline at end of file
+def board_to_dict(chess_board, user, game):
+    """Convert python-chess board to template-friendly dictionary"""
+    # Determine perspective (flip board for black player)
+    return render_board(chess_board, flipped=user.id == game.black_player_id)
@@ -49,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'chess_game.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # project-4: Serve static files in production
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -91,19 +92,56 @@ TEMPLATES = [
 #////////////////////// project-3 //////////////////////    
 WSGI_APPLICATION = 'chess_project.wsgi.application'
 ASGI_APPLICATION = 'chess_project.asgi.application'
+# Shared by every Daphne worker on this host through a SQLite file
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'BACKEND': 'chess_game.channel_layers.SQLiteChannelLayer',
+        'CONFIG': {
+            'path': os.environ.get('CHANNEL_LAYER_DB_PATH', str(BASE_DIR / 'channels.sqlite3')),
+        },
     },
 }
+# Seconds after a lobby/game reload broadcast during which further ones for the same group are merged
+BROADCAST_COALESCE_WINDOW = float(os.environ.get('BROADCAST_COALESCE_WINDOW', '0.1'))
 #////////////////////// project-3 //////////////////////
+
+# Online-user registry shared by every worker process on this host
+PRESENCE_BACKEND = os.environ.get('PRESENCE_BACKEND', 'chess_game.presence.SQLitePresenceBackend')
+PRESENCE_OPTIONS = {
+    'path': os.environ.get('PRESENCE_DB_PATH', str(BASE_DIR / 'presence.sqlite3')),
+}
+# Seconds a websocket stays online without a heartbeat from its worker process
+PRESENCE_SOCKET_TTL = float(os.environ.get('PRESENCE_SOCKET_TTL', '60'))
+
+# Live python-chess boards kept per worker process for active games
+BOARD_CACHE_SIZE = int(os.environ.get('BOARD_CACHE_SIZE', '1024'))
+
+# Moves are always packed into their game row; per-ply Move rows are optional
+STORE_MOVE_ROWS = os.environ.get('STORE_MOVE_ROWS', 'True') == 'True'
+
+# Plies between stored FEN checkpoints; seeking replays at most this many moves
+REPLAY_CHECKPOINT_INTERVAL = int(os.environ.get('REPLAY_CHECKPOINT_INTERVAL', '16'))
+
+# Computer opponent: search processes per server process (0 searches on a thread),
+# seconds per move and a depth cap
+ENGINE_WORKERS = int(os.environ.get('ENGINE_WORKERS', '2'))
+ENGINE_TIME_LIMIT = float(os.environ.get('ENGINE_TIME_LIMIT', '1.0'))
+ENGINE_MAX_DEPTH = int(os.environ.get('ENGINE_MAX_DEPTH', '64'))
+
+# Post-game analysis: search depth per position, stored evaluations kept
+ANALYSIS_DEPTH = int(os.environ.get('ANALYSIS_DEPTH', '3'))
+EVALUATION_CACHE_SIZE = int(os.environ.get('EVALUATION_CACHE_SIZE', '200000'))
+
+# Bearer token required to scrape /metrics (empty serves it only with DEBUG on)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('DATABASE_PATH', str(BASE_DIR / 'db.sqlite3')),
     }
 }
 
@@ -20,9 +20,12 @@ from django.views.generic import TemplateView
 from django.conf import settings
 from django.conf.urls.static import static
 
+from chess_game.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('chess_game.api_urls')),  # project-4
+    path('metrics', metrics_view, name='metrics'),
     # Catch-all route for React app (client-side routing)
     re_path(r'^(?!api|admin|ws|static|media).*$', TemplateView.as_view(template_name='index.html')),
 ]
@@ -1,8 +1,9 @@
-import { useState, useEffect } from 'react'
+import { useState, useEffect, useRef } from 'react'
 import { useParams, useNavigate } from 'react-router-dom'
 import { useAuth } from '../contexts/AuthContext'
 import api from '../services/api'
 import websocket from '../services/websocket'
+import { boardChecksum } from '../services/checksum'
 import ChessBoard from './ChessBoard'
 
 function Game() {
@@ -16,6 +17,12 @@ function Game() {
   const [loading, setLoading] = useState(true)
   const [error, setError] = useState('')
   const [message, setMessage] = useState('')
+  // the squares the next diff applies to, ahead of the render that shows them
+  const boardDictRef = useRef(null)
+
+  useEffect(() => {
+    boardDictRef.current = boardState?.board_dict || null
+  }, [boardState])
 
   useEffect(() => {
     let mounted = true
@@ -37,6 +44,14 @@ function Game() {
 
     loadGameData()
 
+    // ask the server for what was missed since ply, or for the whole board without one
+    const resync = (ply) => {
+      console.log('Board out of sync, resyncing from ply', ply)
+      if (!websocket.sendGame(gameId, { action: 'resync', base_ply: ply })) {
+        loadGame()
+      }
+    }
+
     // Connect to game WebSocket
     const handleWebSocketMessage = async (data) => {
       if (!mounted || resignationHandled) return // Don't process if resignation already handled
@@ -85,11 +100,28 @@ function Game() {
           }
           if (data.data.board_state) {
             console.log('Setting board state from WebSocket data')
-            setBoardState(data.data.board_state)
+            const state = data.data.board_state
+            if (state.changed) {
+              // a resync diff against the board we still hold
+              const boardDict = { ...boardDictRef.current, ...state.changed }
+              if (!boardDictRef.current || boardChecksum(boardDict) !== state.checksum) {
+                resync(null)
+                return
+              }
+              boardDictRef.current = boardDict
+              setBoardState({ ...state, board_dict: boardDict })
+            } else {
+              boardDictRef.current = state.board_dict
+              setBoardState(state)
+            }
+            if (data.data.game) {
+              lastMoveCount = data.data.game.move_count
+              lastStatus = data.data.game.status
+            }
           } else {
             console.log('Board state not in WebSocket, reloading from API...')
             try {
-              const boardResponse = await api.get(`/games/${gameId}/board_state/`)
+              const boardResponse = await api.get(`/games/${gameId}/board_state/?legal_moves=1`)
               if (mounted) {
                 setBoardState(boardResponse.data)
               }
@@ -104,6 +136,50 @@ function Game() {
             loadGame()
           }
         }
+      } else if (data.action === 'game_move') {
+        // incremental update: only the squares touched by the move are sent
+        const move = data.data
+        if (lastMoveCount !== null && move.ply <= lastMoveCount) return
+        if (!boardDictRef.current || lastMoveCount === null) {
+          resync(null)
+          return
+        }
+        if (move.ply !== lastMoveCount + 1) {
+          // a move went missing: fetch the squares changed since the last one we have
+          resync(lastMoveCount)
+          return
+        }
+        const boardDict = { ...boardDictRef.current, ...move.changed }
+        if (boardChecksum(boardDict) !== move.checksum) {
+          // keep the last board that matched and fetch the squares since then
+          resync(lastMoveCount)
+          return
+        }
+        boardDictRef.current = boardDict
+        setBoardState(prev => prev ? {
+          ...prev,
+          board_dict: boardDict,
+          current_turn: move.current_turn,
+          is_my_turn: move.is_my_turn,
+          is_game_over: move.is_game_over,
+          result: move.result,
+          legal_moves: move.legal_moves
+        } : prev)
+        setGame(prev => prev ? {
+          ...prev,
+          board_state: move.fen,
+          current_turn: move.current_turn,
+          move_count: move.ply,
+          status: move.status,
+          outcome: move.outcome
+        } : prev)
+        lastMoveCount = move.ply
+        lastStatus = move.status
+        setError('')
+      } else if (data.action === 'move_ack') {
+        setMessage(`Move made (ply ${data.data.ply})`)
+      } else if (data.action === 'move_rejected') {
+        setError(data.data.error || 'Invalid move')
       } else if (data.action === 'reload') {
         console.log('Received reload command, reloading game...')
         if (mounted) {
@@ -172,7 +248,7 @@ function Game() {
             }
           }
           
-          const boardResponse = await api.get(`/games/${gameId}/board_state/`)
+          const boardResponse = await api.get(`/games/${gameId}/board_state/?legal_moves=1`)
           if (mounted) {
             setGame(currentGame)
             setBoardState(boardResponse.data)
@@ -201,7 +277,7 @@ function Game() {
       const gameResponse = await api.get(`/games/${gameId}/`)
       setGame(gameResponse.data)
 
-      const boardResponse = await api.get(`/games/${gameId}/board_state/`)
+      const boardResponse = await api.get(`/games/${gameId}/board_state/?legal_moves=1`)
       setBoardState(boardResponse.data)
       
       return gameResponse.data
@@ -242,6 +318,13 @@ function Game() {
       return
     }
     
+    // the board state carries the legal moves, so illegal ones never leave the browser
+    const legalMoves = boardState?.is_my_turn && boardState.legal_moves
+    if (legalMoves && !(legalMoves[from] || '').includes(to)) {
+      setError(`Illegal move: ${from} to ${to}`)
+      return
+    }
+    
     await makeMove(from, to)
     setFromSquare('')
     setToSquare('')
@@ -251,6 +334,10 @@ function Game() {
     try {
       setMessage('')
       setError('')
+      // the open game socket is the fast path, the reply arrives as move_ack/move_rejected
+      if (websocket.sendGame(gameId, { action: 'move', from_square: from, to_square: to })) {
+        return
+      }
       const response = await api.post(`/games/${gameId}/make_move/`, {
         from_square: from,
         to_square: to
@@ -259,7 +346,7 @@ function Game() {
       if (response.data.success) {
         setGame(response.data.game)
         setMessage(response.data.message)
-        const boardResponse = await api.get(`/games/${gameId}/board_state/`)
+        const boardResponse = await api.get(`/games/${gameId}/board_state/?legal_moves=1`)
         setBoardState(boardResponse.data)
         console.log('Move successful, WebSocket should notify opponent')
       } else {
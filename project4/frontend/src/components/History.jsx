@@ -5,6 +5,8 @@ function History() {
   const [games, setGames] = useState([])
   const [loading, setLoading] = useState(true)
   const [error, setError] = useState('')
+  const [nextPage, setNextPage] = useState(null)
+  const [loadingMore, setLoadingMore] = useState(false)
 
   useEffect(() => {
     loadHistory()
@@ -14,7 +16,8 @@ function History() {
     try {
       setLoading(true)
       const response = await api.get('/games/history/')
-      setGames(response.data)
+      setGames(response.data.results)
+      setNextPage(response.data.next)
     } catch (error) {
       setError('Failed to load game history')
       console.error(error)
@@ -23,6 +26,20 @@ function History() {
     }
   }
 
+  const loadMore = async () => {
+    try {
+      setLoadingMore(true)
+      const response = await api.get(nextPage)
+      setGames(prev => [...prev, ...response.data.results])
+      setNextPage(response.data.next)
+    } catch (error) {
+      setError('Failed to load more games')
+      console.error(error)
+    } finally {
+      setLoadingMore(false)
+    }
+  }
+
   if (loading) {
     return (
       <div className="container mt-5">
@@ -77,6 +94,13 @@ function History() {
               ))}
             </tbody>
           </table>
+          {nextPage && (
+            <div className="text-center">
+              <button className="btn btn-outline-primary" onClick={loadMore} disabled={loadingMore}>
+                {loadingMore ? 'Loading...' : 'Load more'}
+              </button>
+            </div>
+          )}
         </div>
       )}
     </div>
@@ -31,7 +31,7 @@ function Lobby() {
           setPendingChallenges(data.data.pending_challenges || [])
           api.get('/games/history/').then(response => {
             if (mounted) {
-              const historyData = response.data || []
+              const historyData = response.data.results || []
               console.log('WebSocket: Game history loaded:', historyData.length, 'games')
               const filteredHistory = historyData.filter(game => 
                 game.status === 'completed' || game.status === 'resigned'
@@ -78,7 +78,7 @@ function Lobby() {
         
         try {
           const historyResponse = await api.get('/games/history/')
-          const historyData = historyResponse.data || []
+          const historyData = historyResponse.data.results || []
           const filteredHistory = historyData.filter(game => 
             game.status === 'completed' || game.status === 'resigned'
           )
@@ -120,7 +120,7 @@ function Lobby() {
 
       try {
         const historyResponse = await api.get('/games/history/')
-        const historyData = historyResponse.data || []
+        const historyData = historyResponse.data.results || []
         console.log('Game history API response:', historyData.length, 'games')
         console.log('Raw game history data:', historyData)
         
@@ -9,6 +9,10 @@ function SoloPlay() {
   const [loading, setLoading] = useState(true)
   const [error, setError] = useState('')
   const [message, setMessage] = useState('')
+  const [vsComputer, setVsComputer] = useState(false)
+  const [thinking, setThinking] = useState(false)
+  // signed token holding the game; the server keeps no solo state
+  const [token, setToken] = useState('')
 
   useEffect(() => {
     loadBoardState()
@@ -19,6 +23,7 @@ function SoloPlay() {
       setLoading(true)
       const response = await api.get('/solo/')
       setBoardState(response.data)
+      setToken(response.data.token)
     } catch (error) {
       setError('Failed to load board')
       console.error(error)
@@ -65,13 +70,18 @@ function SoloPlay() {
       setMessage('')
       setError('')
       const response = await api.post('/solo/', {
+        token,
         from_square: from,
         to_square: to
       })
 
       if (response.data.success) {
         setBoardState(response.data.board_state)
+        setToken(response.data.token)
         setMessage(response.data.message)
+        if (vsComputer && !response.data.board_state.is_game_over) {
+          await computerMove(response.data.token)
+        }
       } else {
         const errorMsg = response.data.error || response.data.detail || 'Failed to make move'
         setError(errorMsg)
@@ -87,12 +97,27 @@ function SoloPlay() {
     }
   }
 
+  const computerMove = async (currentToken) => {
+    try {
+      setThinking(true)
+      const response = await api.post('/solo/engine/', { token: currentToken })
+      setBoardState(response.data.board_state)
+      setToken(response.data.token)
+      setMessage(response.data.message)
+    } catch (error) {
+      setError(error.response?.data?.error || 'The computer could not move')
+    } finally {
+      setThinking(false)
+    }
+  }
+
   const handleReset = async () => {
     try {
       const response = await api.post('/solo/', { reset: true })
       if (response.data.success) {
         setMessage(response.data.message)
-        loadBoardState()
+        setBoardState(response.data.board_state)
+        setToken(response.data.token)
       }
     } catch (error) {
       setError('Failed to reset board')
@@ -180,8 +205,20 @@ function SoloPlay() {
                     />
                   </div>
                 </div>
-                <button type="submit" className="btn btn-primary">
-                  Make Move
+                <div className="form-check mb-3 text-start">
+                  <input
+                    type="checkbox"
+                    className="form-check-input"
+                    id="vsComputer"
+                    checked={vsComputer}
+                    onChange={(e) => setVsComputer(e.target.checked)}
+                  />
+                  <label htmlFor="vsComputer" className="form-check-label">
+                    Computer replies to each move
+                  </label>
+                </div>
+                <button type="submit" className="btn btn-primary" disabled={thinking}>
+                  {thinking ? 'Computer is thinking...' : 'Make Move'}
                 </button>
               </form>
             </div>
@@ -0,0 +1,26 @@
+// CRC32 of a board_dict, the same value as board_checksum on the server:
+// the square symbols in a1, b1 .. h8 order joined by '|'
+
+const SQUARES = []
+for (let rank = 1; rank <= 8; rank++) {
+  for (const file of 'abcdefgh') {
+    SQUARES.push(`${file}${rank}`)
+  }
+}
+
+const TABLE = Array.from({ length: 256 }, (_, n) => {
+  let c = n
+  for (let k = 0; k < 8; k++) {
+    c = c & 1 ? 0xedb88320 ^ (c >>> 1) : c >>> 1
+  }
+  return c >>> 0
+})
+
+export function boardChecksum(boardDict) {
+  const bytes = new TextEncoder().encode(SQUARES.map(square => boardDict[square]).join('|'))
+  let crc = 0xffffffff
+  for (const byte of bytes) {
+    crc = TABLE[(crc ^ byte) & 0xff] ^ (crc >>> 8)
+  }
+  return ((crc ^ 0xffffffff) >>> 0).toString(16).padStart(8, '0')
+}
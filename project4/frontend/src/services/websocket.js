@@ -65,7 +65,7 @@ class WebSocketService {
 
     const wsProtocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:'
     const wsHost = window.location.host
-    const wsUrl = `${wsProtocol}//${wsHost}/ws/game/${gameId}/`
+    const wsUrl = `${wsProtocol}//${wsHost}/ws/game/${gameId}/?legal_moves=1`
     
     console.log(`Connecting to game WebSocket: ${wsUrl}`)
     const socket = new WebSocket(wsUrl)
@@ -105,6 +105,16 @@ class WebSocketService {
     }
   }
 
+  sendGame(gameId, payload) {
+    // returns false when the socket is not open so callers can fall back to HTTP
+    const socket = this.gameSockets[gameId]
+    if (!socket || socket.readyState !== WebSocket.OPEN) {
+      return false
+    }
+    socket.send(JSON.stringify(payload))
+    return true
+  }
+
   disconnectLobby() {
     if (this.lobbySocket) {
       this.lobbySocket.close()